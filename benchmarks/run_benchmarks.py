@@ -0,0 +1,192 @@
+"""
+Times the collector and publish hot paths against a synthetic /sys and
+/proc tree and prints the results as JSON.
+
+    python benchmarks/run_benchmarks.py --cores 192 --gpus 8 --rapl 2 --output bench.json
+
+For every benchmark it reports latency percentiles, memory allocated per
+call (tracemalloc) and read/write syscalls per call (/proc/self/io, which
+doesn't count open/close/stat/getdents; use strace -c for those). No
+broker is needed: MQTT publishes go to an in-process stand-in that drops
+them.
+
+psutil-backed metrics (memory, network, load, temperatures) still read the
+host; everything resolved through sysfs_root/proc_root uses the tree.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'system_monitor'))
+
+import mqtt_client
+from compact import CompactEncoder
+from monitor import SystemMonitor, describe_metric
+from synthetic import build_tree, advance
+
+
+class NullPahoClient:
+    """Stands in for paho's Client, publishes go nowhere."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        # publish, connect_async, loop_start, username_pw_set, ...
+        return lambda *args, **kwargs: None
+
+
+def _syscalls():
+    """Read/write-class syscalls made by this process so far, or None."""
+    try:
+        with open('/proc/self/io') as f:
+            fields = dict(line.split(': ') for line in f.read().splitlines())
+        return int(fields['syscr']) + int(fields['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def bench(func, iterations, warmup=5, alloc_iterations=20):
+    for _ in range(warmup):
+        func()
+
+    before = _syscalls()
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter_ns()
+        func()
+        timings.append(time.perf_counter_ns() - started)
+    after = _syscalls()
+
+    # Allocation pass, separate because tracemalloc slows everything down
+    tracemalloc.start()
+    peaks = []
+    blocks = []
+    for _ in range(alloc_iterations):
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        diff = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+        peaks.append(peak - base)
+        blocks.append(sum(stat.count_diff for stat in diff if stat.count_diff > 0))
+    tracemalloc.stop()
+
+    timings.sort()
+    us = [t / 1000.0 for t in timings]
+    peaks.sort()
+    blocks.sort()
+    return {
+        'iterations': iterations,
+        'latency_us': {
+            'mean': round(sum(us) / len(us), 2),
+            'p50': round(_percentile(us, 50), 2),
+            'p90': round(_percentile(us, 90), 2),
+            'p99': round(_percentile(us, 99), 2),
+            'max': round(us[-1], 2),
+        },
+        'alloc_peak_bytes': _percentile(peaks, 50),
+        'alloc_blocks_retained': _percentile(blocks, 50),
+        'read_write_syscalls_per_call': round((after - before) / iterations, 2) if before is not None else None,
+    }
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        sysfs, proc = build_tree(root, cores=args.cores, gpus=args.gpus,
+                                 rapl_packages=args.rapl, disks=args.disks)
+        # Run every collector on every call so each one is measured
+        monitor = SystemMonitor(sysfs_root=sysfs, proc_root=proc,
+                                collector_intervals={name: 0 for name in ('disk', 'system')})
+
+        def get_stats():
+            advance(sysfs, proc)
+            monitor.get_stats()
+        results['get_stats'] = bench(get_stats, args.iterations)
+
+        now = time.time()
+        for name, collector in monitor.collectors.collectors.items():
+            results[f'collector.{name}'] = bench(lambda c=collector: c.run(now), args.iterations)
+
+        # Two consecutive samples, so delta mode has changes to publish
+        advance(sysfs, proc)
+        samples = [monitor.get_stats()]
+        advance(sysfs, proc)
+        samples.append(monitor.get_stats())
+        stats = samples[-1]
+
+    mqtt_client.mqtt.Client = NullPahoClient
+    for name, mode, encoding in (('full', 'full', 'json'), ('delta', 'delta', 'json'),
+                                 ('compact', 'full', 'compact')):
+        client = mqtt_client.MQTTClient('localhost', 1883, None, None, 'bench', publish_mode=mode,
+                                        describe_metric=describe_metric, state_encoding=encoding)
+        client.publish_discovery(stats)
+        ticks = iter(range(10**9))
+        results[f'publish_update.{name}'] = bench(
+            lambda: client.publish_update(samples[next(ticks) % 2]), args.iterations)
+        results[f'publish_update.{name}']['bytes_per_call'] = client.last_publish_bytes
+
+    # State serialization alone: JSON against the compact encoding
+    results['serialize.json'] = bench(lambda: json.dumps(stats), args.iterations)
+    results['serialize.json']['bytes_per_call'] = len(json.dumps(stats))
+    encoder = CompactEncoder()
+    results['serialize.compact'] = bench(lambda: encoder.encode(stats), args.iterations)
+    results['serialize.compact']['bytes_per_call'] = len(encoder.encode(stats)[0])
+    results['serialize.compact']['schema_bytes'] = len(encoder.schema)
+
+    client = mqtt_client.MQTTClient('localhost', 1883, None, None, 'bench', describe_metric=describe_metric)
+
+    def discovery_cold():
+        client.discovered.clear()
+        client._config_cache.clear()
+        client.publish_discovery(stats)
+    results['publish_discovery.cold'] = bench(discovery_cold, args.iterations)
+    results['publish_discovery.warm'] = bench(lambda: client.publish_discovery(stats), args.iterations)
+
+    return {
+        'config': {
+            'cores': args.cores,
+            'gpus': args.gpus,
+            'rapl_packages': args.rapl,
+            'disks': args.disks,
+            'iterations': args.iterations,
+            'metrics': len(stats),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cores', type=int, default=8)
+    parser.add_argument('--gpus', type=int, default=1)
+    parser.add_argument('--rapl', type=int, default=1, help='RAPL packages')
+    parser.add_argument('--disks', type=int, default=2)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--output', help='Write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Builds a synthetic /sys and /proc tree for benchmarking the collectors
+without real hardware. The tree scales with the number of cores, AMD GPUs,
+RAPL packages and block devices.
+"""
+import os
+import random
+
+
+def _write(root, rel_path, content):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(f'{content}\n')
+
+
+def build_tree(root, cores=8, gpus=1, rapl_packages=1, disks=2, seed=0):
+    """
+    Creates root/sys and root/proc. Returns (sysfs_root, proc_root).
+    """
+    rng = random.Random(seed)
+    sysfs = os.path.join(root, 'sys')
+    proc = os.path.join(root, 'proc')
+
+    # RAPL: one package per socket with core/uncore/dram subdomains
+    for pkg in range(rapl_packages):
+        base = f'class/powercap/intel-rapl/intel-rapl:{pkg}'
+        _write(sysfs, f'{base}/name', f'package-{pkg}')
+        _write(sysfs, f'{base}/energy_uj', rng.randrange(10**9))
+        _write(sysfs, f'{base}/max_energy_range_uj', 262143328850)
+        for sub, name in enumerate(['core', 'uncore', 'dram']):
+            _write(sysfs, f'{base}/intel-rapl:{pkg}:{sub}/name', name)
+            _write(sysfs, f'{base}/intel-rapl:{pkg}:{sub}/energy_uj', rng.randrange(10**9))
+            _write(sysfs, f'{base}/intel-rapl:{pkg}:{sub}/max_energy_range_uj', 262143328850)
+
+    # AMD GPUs with hwmon sensors, plus their display connectors
+    for card in range(gpus):
+        base = f'class/drm/card{card}'
+        _write(sysfs, f'{base}/device/vendor', '0x1002')
+        _write(sysfs, f'{base}/device/gpu_busy_percent', rng.randrange(100))
+        _write(sysfs, f'{base}/device/hwmon/hwmon{card}/temp1_input', rng.randrange(30000, 90000))
+        _write(sysfs, f'{base}/device/hwmon/hwmon{card}/power1_average', rng.randrange(10**8))
+        os.makedirs(os.path.join(sysfs, f'class/drm/card{card}-DP-1'), exist_ok=True)
+
+    # Block devices
+    disk_names = [f'nvme{i}n1' for i in range(disks)]
+    for name in disk_names + ['loop0']:
+        os.makedirs(os.path.join(sysfs, 'block', name), exist_ok=True)
+
+    # /proc/stat with a realistic (long) intr line after the cpu lines
+    def cpu_fields():
+        return ' '.join(str(rng.randrange(10**7)) for _ in range(10))
+    lines = [f'cpu  {cpu_fields()}']
+    lines += [f'cpu{i} {cpu_fields()}' for i in range(cores)]
+    lines.append('intr ' + ' '.join(str(rng.randrange(10**6)) for _ in range(cores * 20)))
+    lines += ['ctxt 123456789', 'btime 1700000000', 'processes 4242', 'procs_running 2', 'procs_blocked 0']
+    _write(proc, 'stat', '\n'.join(lines))
+
+    # /proc/diskstats
+    stats = []
+    for i, name in enumerate(disk_names + ['loop0']):
+        counters = ' '.join(str(rng.randrange(10**6)) for _ in range(15))
+        stats.append(f'259 {i} {name} {counters}')
+    _write(proc, 'diskstats', '\n'.join(stats))
+
+    # /proc/self/mounts: '/' plus one data volume per disk
+    mounts = ['overlay / overlay rw 0 0', 'proc /proc proc rw 0 0', 'tmpfs /dev tmpfs rw 0 0']
+    mounts += [f'/dev/{name} /tmp ext4 rw 0 0' for name in disk_names[:1]]
+    _write(proc, 'self/mounts', '\n'.join(mounts))
+
+    return sysfs, proc
+
+
+def advance(sysfs, proc, rng=random):
+    """
+    Bumps the counters in the tree so rates have something to compute.
+    """
+    for dirpath, _, filenames in os.walk(os.path.join(sysfs, 'class/powercap')):
+        if 'energy_uj' in filenames:
+            path = os.path.join(dirpath, 'energy_uj')
+            with open(path) as f:
+                value = int(f.read())
+            with open(path, 'w') as f:
+                f.write(f'{value + rng.randrange(10**6)}\n')
@@ -0,0 +1,226 @@
+import os
+import re
+import time
+from sysfs import SysfsAttribute, DEVICE_GONE_ERRNOS
+from collectors import counter_delta
+
+# Container cgroups as created by docker (systemd and cgroupfs drivers),
+# podman, containerd (Kubernetes) and CRI-O
+CONTAINER_CGROUP = re.compile(r'^(?:(docker|libpod|cri-containerd|crio)-)?([0-9a-f]{64})(?:\.scope)?$')
+# Containers are never nested deeper than kubepods.slice/<qos>/<pod>/<container>
+MAX_DEPTH = 5
+# Attribute files read per container
+FILES_PER_CONTAINER = 4
+
+
+class Container:
+    """The cgroup of one container and its open attribute files."""
+
+    def __init__(self, path, container_id, runtime):
+        self.path = path
+        self.id = container_id
+        self.runtime = runtime
+        self.label = container_id[:12]
+        self.cpu = SysfsAttribute(os.path.join(path, 'cpu.stat'), size=512)
+        self.memory = SysfsAttribute(os.path.join(path, 'memory.current'))
+        self.memory_stat = SysfsAttribute(os.path.join(path, 'memory.stat'), size=4096)
+        self.io = SysfsAttribute(os.path.join(path, 'io.stat'), size=512)
+        # (usage_usec, throttled_usec, read bytes, written bytes) of the previous sample
+        self.previous = None
+        prefix = f'container_{self.label}_'
+        self.keys = {
+            'cpu': prefix + 'cpu_percent',
+            'throttled': prefix + 'cpu_throttled_percent',
+            'memory': prefix + 'memory_mb',
+            'anon': prefix + 'memory_anon_mb',
+            'file': prefix + 'memory_file_mb',
+            'read': prefix + 'read_bytes_per_s',
+            'write': prefix + 'write_bytes_per_s',
+        }
+
+    def attributes(self):
+        return (self.cpu, self.memory, self.memory_stat, self.io)
+
+    def close(self):
+        for attr in self.attributes():
+            attr.close()
+
+
+class ContainerCgroups:
+    """
+    Per-container CPU, memory and I/O from the cgroup v2 hierarchy.
+
+    Containers are found by walking cgroup_root for runtime scopes. The
+    walk is repeated every rescan_interval seconds, or on the next sample
+    when the root's descendant count in cgroup.stat changes; only the
+    containers that appeared or disappeared are opened or closed. A
+    container whose files vanish between rescans is dropped right away.
+
+    Attribute files of the first max_open_files / 4 containers stay open
+    between samples, the rest are reopened on each read. Read errors other
+    than a vanished cgroup or a disabled controller are recorded in the
+    diagnostics.
+    """
+
+    def __init__(self, cgroup_root='/sys/fs/cgroup', rescan_interval=30, max_open_files=1024,
+                 diagnostics=None):
+        self.root = cgroup_root
+        self.diagnostics = diagnostics
+        self.rescan_interval = rescan_interval
+        self.max_cached = max(0, max_open_files // FILES_PER_CONTAINER)
+        self.stat = SysfsAttribute(os.path.join(cgroup_root, 'cgroup.stat'), size=256)
+        self.containers = {}  # {cgroup path: Container}
+        self.labels = {}  # {short id: Container}
+        self.last_scan = None
+        self.descendants = None
+
+    def available(self):
+        # cgroup.controllers only exists on the unified (v2) hierarchy
+        return os.path.exists(os.path.join(self.root, 'cgroup.controllers'))
+
+    def discover(self):
+        """Returns {cgroup path: (container id, runtime)}."""
+        found = {}
+        stack = [(self.root, 0, None)]
+        while stack:
+            path, depth, top = stack.pop()
+            try:
+                entries = os.scandir(path)
+            except OSError:
+                continue  # Removed while walking
+            with entries:
+                for entry in entries:
+                    if not entry.is_dir(follow_symlinks=False):
+                        continue
+                    match = CONTAINER_CGROUP.match(entry.name)
+                    if match:
+                        # cgroupfs driver: /docker/<id>, /kubepods/.../<id>
+                        found[entry.path] = (match.group(2), match.group(1) or top)
+                    elif depth < MAX_DEPTH:
+                        stack.append((entry.path, depth + 1, top or entry.name.split('.')[0]))
+        return found
+
+    def rescan(self, now=None):
+        found = self.discover()
+        for path in [p for p in self.containers if p not in found]:
+            self._drop(path)
+        for path, (container_id, runtime) in found.items():
+            if path not in self.containers:
+                container = Container(path, container_id, runtime)
+                self.containers[path] = container
+                self.labels[container.label] = container
+        self.last_scan = now if now is not None else time.time()
+
+    def runtime(self, label):
+        """Runtime that created a container, by short id."""
+        container = self.labels.get(label)
+        return container.runtime if container else None
+
+    def sample(self, time_delta, now=None):
+        if now is None:
+            now = time.time()
+        descendants = self._descendants()
+        if self.last_scan is None or descendants != self.descendants \
+                or (self.rescan_interval and now - self.last_scan >= self.rescan_interval):
+            self.rescan(now)
+            self.descendants = descendants
+
+        data = {}
+        gone = []
+        for i, (path, container) in enumerate(self.containers.items()):
+            try:
+                self._sample_container(container, time_delta, data)
+            except OSError as e:
+                if e.errno in DEVICE_GONE_ERRNOS:
+                    gone.append(path)
+                else:
+                    self._record(e)
+            if i >= self.max_cached:
+                container.close()
+        for path in gone:
+            # Stopped between rescans, its keys disappear from this sample
+            self._drop(path)
+        return data
+
+    def close(self):
+        for container in self.containers.values():
+            container.close()
+        self.containers.clear()
+        self.labels.clear()
+        self.stat.close()
+
+    def _drop(self, path):
+        container = self.containers.pop(path)
+        container.close()
+        if self.labels.get(container.label) is container:
+            del self.labels[container.label]
+
+    def _descendants(self):
+        try:
+            for line in bytes(self.stat.read_bytes()).split(b'\n'):
+                if line.startswith(b'nr_descendants '):
+                    return int(line[15:])
+        except (OSError, ValueError) as e:
+            self._record(e)
+        return None
+
+    def _record(self, exc):
+        if self.diagnostics:
+            self.diagnostics.record_error('cgroups', exc)
+
+    def _sample_container(self, container, time_delta, data):
+        """
+        Adds a container's metrics to data. Raises OSError if the container
+        is gone (cpu.stat exists in every cgroup); the other files are
+        missing when their controller isn't enabled for the cgroup.
+        """
+        keys = container.keys
+        usage = throttled = 0
+        for line in bytes(container.cpu.read_bytes()).split(b'\n'):
+            if line.startswith(b'usage_usec '):
+                usage = int(line[11:])
+            elif line.startswith(b'throttled_usec '):
+                throttled = int(line[15:])
+
+        try:
+            data[keys['memory']] = int(container.memory.read_bytes()) // 1024 // 1024
+            for line in bytes(container.memory_stat.read_bytes()).split(b'\n'):
+                if line.startswith(b'anon '):
+                    data[keys['anon']] = int(line[5:]) // 1024 // 1024
+                elif line.startswith(b'file '):
+                    data[keys['file']] = int(line[5:]) // 1024 // 1024
+        except OSError as e:
+            if e.errno not in DEVICE_GONE_ERRNOS:
+                self._record(e)
+
+        # One line per device: "8:0 rbytes=... wbytes=... rios=... ..."
+        read = written = 0
+        try:
+            for line in bytes(container.io.read_bytes()).split(b'\n'):
+                for field in line.split()[1:]:
+                    if field.startswith(b'rbytes='):
+                        read += int(field[7:])
+                    elif field.startswith(b'wbytes='):
+                        written += int(field[7:])
+        except OSError as e:
+            if e.errno not in DEVICE_GONE_ERRNOS:
+                self._record(e)
+            read = written = None
+
+        current = (usage, throttled, read, written)
+        previous = container.previous
+        container.previous = current
+        if previous is None:
+            return
+        usage_d, throttled_d, read_d, written_d = [
+            counter_delta(p, c) if c is not None and p is not None else None
+            for p, c in zip(previous, current)
+        ]
+        if min(usage_d, throttled_d) < 0:
+            return  # Container restarted in the same cgroup
+        # Percent of one CPU, like `docker stats`
+        data[keys['cpu']] = round(usage_d / (time_delta * 10_000), 1)
+        data[keys['throttled']] = round(min(100.0, throttled_d / (time_delta * 10_000)), 1)
+        if read_d is not None and written_d is not None and min(read_d, written_d) >= 0:
+            data[keys['read']] = round(read_d / time_delta, 2)
+            data[keys['write']] = round(written_d / time_delta, 2)
@@ -0,0 +1,234 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Collectors due within this many seconds of a tick run on that tick, so a
+# collector with the same interval as the caller doesn't slip a whole tick.
+DUE_TOLERANCE = 0.05
+# Threads running collectors concurrently, 0 runs them one by one
+DEFAULT_WORKERS = 4
+# Longest a collector that keeps missing its deadline is backed off
+MAX_BACKOFF = 300
+# Stats key counting the collectors whose cached values are stale
+STALE_KEY = 'collectors_stale'
+
+
+class Collector:
+    """
+    A named stats function with its own sampling interval.
+
+    interval: seconds between runs, 0 runs on every tick.
+    cost: relative cost, cheaper collectors run first when several are due.
+    rate: the function takes the seconds since its previous run (for
+    counters such as RAPL energy).
+    timeout: seconds a tick waits for the collector, None waits until it
+    returns.
+    """
+
+    def __init__(self, name, func, interval=0, cost=1, rate=False, timeout=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cost = cost
+        self.rate = rate
+        self.timeout = timeout
+        self.created = time.time()
+        self.last_run = None
+        self.last_duration = 0.0
+        self.data = {}
+        # Deadline of the current run (monotonic clock) and whether it's still running
+        self.limit = None
+        self.deadline = None
+        self.running = False
+        # The run missed its deadline, data holds the previous values
+        self.stale = False
+        # Consecutive runs that missed their deadline
+        self.timeouts = 0
+
+    def run(self, now):
+        if self.rate:
+            # Time since the previous run, or since the monitor started
+            time_delta = now - (self.last_run if self.last_run is not None else self.created)
+            # We need at least a small delta to calculate rates correctly
+            if time_delta <= 0:
+                time_delta = 0.001
+            return self.func(time_delta)
+        return self.func()
+
+
+class CollectorScheduler:
+    """
+    Runs only the collectors that are due and merges their results with the
+    cached values of the others. Due times are kept in a heap.
+
+    run_due() runs the due collectors concurrently on up to max_workers
+    threads and waits for each until its deadline. A collector past its
+    deadline keeps running in the background while its previous values are
+    reported as stale; it is only rescheduled once it returns, so a hung
+    collector is never started twice and holds at most one thread. Each
+    consecutive miss doubles the wait before its next run, up to
+    MAX_BACKOFF seconds.
+
+    With a diagnostics recorder every run's duration and any exception it
+    raised (TimeoutError for a missed deadline) are recorded.
+    """
+
+    def __init__(self, diagnostics=None, max_workers=DEFAULT_WORKERS, timeout=None):
+        self.collectors = {}
+        self.diagnostics = diagnostics
+        self.max_workers = max_workers
+        # Default deadline of collectors registered without their own
+        self.timeout = timeout
+        self._executor = None
+        self._heap = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def register(self, name, func, interval=0, cost=1, rate=False, timeout=None):
+        collector = Collector(name, func, interval, cost, rate, timeout if timeout is not None else self.timeout)
+        self.collectors[name] = collector
+        self._push(collector, 0)
+        return collector
+
+    def set_interval(self, name, interval):
+        """Changes a collector's interval and runs it on the next tick."""
+        collector = self.collectors[name]
+        collector.interval = interval
+        with self._lock:
+            self._heap = [entry for entry in self._heap if entry[3] is not collector]
+            heapq.heapify(self._heap)
+        self._push(collector, 0)
+
+    def due(self, now):
+        """Pops and returns the collectors due at now, cheapest first."""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now + DUE_TOLERANCE:
+                due.append(heapq.heappop(self._heap)[3])
+        due.sort(key=lambda c: c.cost)
+        return due
+
+    def run(self, collector, now):
+        """Runs a collector, caches its result and schedules its next run."""
+        started = time.monotonic()
+        try:
+            data = collector.run(now)
+        except Exception as e:
+            # Keep the last good values
+            data = None
+            print(f"Error in collector {collector.name}: {e}")
+            if self.diagnostics:
+                self.diagnostics.record_error(collector.name, e)
+        finished = time.monotonic()
+        collector.last_duration = finished - started
+        if self.diagnostics:
+            self.diagnostics.observe_collector(collector.name, collector.last_duration)
+
+        if data is not None or not collector.rate:
+            # A rate collector that raised may have consumed only part of
+            # its counters, so its next delta spans both intervals
+            collector.last_run = now
+        with self._lock:
+            if data is not None:
+                collector.data = data
+            late = collector.deadline is not None and finished > collector.deadline
+            collector.deadline = None
+            collector.timeouts = collector.timeouts + 1 if late else 0
+            if late:
+                # Back off from when it returned, doubling with each miss
+                backoff = min(MAX_BACKOFF, collector.limit * 2 ** (collector.timeouts - 1))
+                due = time.time() + max(collector.interval, backoff)
+            else:
+                due = now + collector.interval
+            # Rescheduled before it counts as finished
+            heapq.heappush(self._heap, (due, collector.cost, next(self._seq), collector))
+            collector.running = False
+            collector.stale = False
+
+    def run_due(self, now=None, timeout=None):
+        """
+        Runs the collectors due at now and returns when each has finished or
+        passed its deadline: its own timeout, capped at timeout.
+        """
+        if now is None:
+            now = time.time()
+        due = self.due(now)
+        if not self.max_workers:
+            for collector in due:
+                self.run(collector, now)
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='collector')
+        started = time.monotonic()
+        pending = {}
+        for collector in due:
+            limit = collector.timeout
+            if timeout is not None:
+                limit = timeout if limit is None else min(limit, timeout)
+            collector.limit = limit
+            collector.deadline = started + limit if limit is not None else None
+            collector.running = True
+            pending[self._executor.submit(self.run, collector, now)] = collector
+
+        while pending:
+            deadlines = [c.deadline for c in pending.values() if c.deadline is not None]
+            remaining = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                del pending[future]
+            current = time.monotonic()
+            for future, collector in list(pending.items()):
+                if collector.deadline is not None and current >= collector.deadline:
+                    del pending[future]
+                    with self._lock:
+                        if not collector.running:
+                            continue
+                        collector.stale = True
+                    if self.diagnostics:
+                        self.diagnostics.record_error(
+                            collector.name, TimeoutError(f'{collector.name} missed its {collector.limit}s deadline'))
+
+    def stale(self):
+        """Names of the collectors whose cached values are stale."""
+        return [name for name, collector in self.collectors.items() if collector.stale]
+
+    def snapshot(self, count_stale=False):
+        """
+        Merged results of all collectors, in registration order. With
+        count_stale the number of stale collectors is added as STALE_KEY.
+        """
+        stats = {}
+        stale = 0
+        for collector in self.collectors.values():
+            stats.update(collector.data)
+            stale += collector.stale
+        if count_stale:
+            stats[STALE_KEY] = stale
+        return stats
+
+    def close(self):
+        """Stops the thread pool without waiting for hung collectors."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _push(self, collector, due):
+        with self._lock:
+            heapq.heappush(self._heap, (due, collector.cost, next(self._seq), collector))
+
+
+def counter_delta(previous, current, width=None):
+    """
+    Difference between two readings of a monotonic counter. A decrease
+    means the counter was reset and is returned as negative, unless width
+    is given for a counter that really is that many bits wide: then it
+    wrapped and is corrected.
+    """
+    if current >= previous:
+        return current - previous
+    if width and previous < 2**width:
+        return current + 2**width - previous
+    return -1
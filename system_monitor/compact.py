@@ -0,0 +1,153 @@
+"""
+Compact binary state encoding for bandwidth-constrained links.
+
+A retained schema message lists the metric keys and their packed types
+once; each state message then carries only a small header and the values
+as little-endian float32 (float64 for values too large for float32 to hold
+to the unit, e.g. boot_time):
+
+    header: magic b'SM', format version, pad, schema id (uint32), value count (uint32)
+    values: one float32/float64 per schema key, in schema order
+
+Decoding at the receiving end:
+
+    python compact.py --broker central-mqtt --device my-host --republish
+"""
+import sys
+import json
+import zlib
+import struct
+import operator
+
+MAGIC = b'SM'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<2sBxII')
+# Largest magnitude float32 still represents to the unit
+FLOAT32_LIMIT = 2 ** 24
+
+
+class CompactEncoder:
+    """
+    Packs stats dicts against a schema that is rebuilt whenever the key set
+    changes (or a float32 value outgrows its precision). Values are packed
+    into a preallocated buffer; encode() returns one bytes copy of it
+    because paho keeps a reference to queued payloads.
+    """
+
+    def __init__(self):
+        self.schema_id = None
+        self.schema = None  # Serialized schema message
+        self._key_set = None
+        self._getter = None
+        self._struct = None
+        self._buffer = bytearray()
+        self._narrow = ()  # Positions packed as float32
+
+    def encode(self, sensor_data):
+        """
+        Returns (payload, schema_changed). When schema_changed is True the
+        new self.schema has to be published before the payload.
+        """
+        changed = False
+        if sensor_data.keys() != self._key_set:
+            self._build(sensor_data)
+            changed = True
+        values = self._getter(sensor_data)
+        if self._narrow and max(map(abs, values)) >= FLOAT32_LIMIT \
+                and any(abs(values[i]) >= FLOAT32_LIMIT for i in self._narrow):
+            self._build(sensor_data)
+            changed = True
+            values = self._getter(sensor_data)
+        self._struct.pack_into(self._buffer, HEADER.size, *values)
+        return bytes(self._buffer), changed
+
+    def _build(self, sensor_data):
+        keys = [k for k, v in sensor_data.items() if isinstance(v, (int, float))]
+        types = ''.join('d' if abs(sensor_data[k]) >= FLOAT32_LIMIT else 'f' for k in keys)
+        schema = {'format': FORMAT_VERSION, 'keys': keys, 'types': types}
+        self.schema_id = zlib.crc32(json.dumps(schema).encode('utf-8'))
+        schema['id'] = self.schema_id
+        self.schema = json.dumps(schema)
+
+        self._key_set = set(sensor_data)
+        # itemgetter returns a bare value for one key, keep it a tuple
+        getter = operator.itemgetter(*keys) if keys else (lambda data: ())
+        self._getter = getter if len(keys) != 1 else (lambda data: (getter(data),))
+        self._struct = struct.Struct('<' + types)
+        self._narrow = tuple(i for i, t in enumerate(types) if t == 'f')
+        self._buffer = bytearray(HEADER.size + self._struct.size)
+        HEADER.pack_into(self._buffer, 0, MAGIC, FORMAT_VERSION, self.schema_id, len(keys))
+
+
+def decode(schema, payload):
+    """
+    Returns the stats dict of a compact state payload. schema is the parsed
+    schema message. Raises ValueError if the payload doesn't match it.
+    """
+    magic, version, schema_id, count = HEADER.unpack_from(payload)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a compact state payload')
+    if schema_id != schema['id'] or count != len(schema['keys']):
+        raise ValueError(f'Payload has schema {schema_id}, expected {schema["id"]}')
+    values = struct.unpack_from('<' + schema['types'], payload, HEADER.size)
+    data = {}
+    for key, kind, value in zip(schema['keys'], schema['types'], values):
+        if kind == 'f':
+            # Drop the float32 noise (12.3 would decode as 12.300000190734863)
+            value = float(f'{value:.7g}')
+        if value.is_integer() and abs(value) < 2 ** 53:
+            value = int(value)
+        data[key] = value
+    return data
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Decode compact state messages.')
+    parser.add_argument('--broker', default='localhost')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--device', default='+', help='Device id, + for all devices')
+    parser.add_argument('--prefix', default='homeassistant')
+    parser.add_argument('--republish', action='store_true',
+                        help='Publish the decoded JSON to the regular state topic for Home Assistant')
+    args = parser.parse_args()
+
+    import paho.mqtt.client as mqtt
+    schemas = {}  # {device id: schema}
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        client.subscribe(f'{args.prefix}/sensor/{args.device}/schema')
+        client.subscribe(f'{args.prefix}/sensor/{args.device}/compact')
+
+    def on_message(client, userdata, msg):
+        device, kind = msg.topic.split('/')[-2:]
+        if kind == 'schema':
+            schemas[device] = json.loads(msg.payload)
+            return
+        schema = schemas.get(device)
+        if schema is None:
+            print(f'{device}: no schema yet', file=sys.stderr)
+            return
+        try:
+            data = decode(schema, msg.payload)
+        except ValueError as e:
+            print(f'{device}: {e}', file=sys.stderr)
+            return
+        if args.republish:
+            client.publish(f'{args.prefix}/sensor/{device}/state', json.dumps(data))
+        else:
+            print(json.dumps({'device': device, 'state': data}))
+
+    client = mqtt.Client()
+    if args.username and args.password:
+        client.username_pw_set(args.username, args.password)
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(args.broker, args.port)
+    client.loop_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+import os
+import re
+import sys
+import time
+import threading
+import psutil
+
+# Upper bounds of the duration histogram buckets in milliseconds, the last
+# bucket takes everything above
+DURATION_BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Histogram:
+    """
+    Duration histogram with fixed buckets. The bucket counts are cumulative
+    since start; mean, p95 and max are also kept for the window since the
+    last window_stats() call.
+    """
+
+    def __init__(self, bounds=DURATION_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._reset_window()
+
+    def observe(self, value):
+        bucket = len(self.bounds)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                bucket = i
+                break
+        self.counts[bucket] += 1
+        self.count += 1
+        self.sum += value
+        self.window_counts[bucket] += 1
+        self.window_count += 1
+        self.window_sum += value
+        self.window_max = max(self.window_max, value)
+
+    def window_stats(self):
+        """
+        Returns (mean, p95, max) of the values observed since the previous
+        call, or None if there were none. p95 is the upper bound of the
+        bucket it falls in.
+        """
+        if not self.window_count:
+            return None
+        rank = 0.95 * self.window_count
+        p95 = self.window_max
+        seen = 0
+        for i, count in enumerate(self.window_counts[:-1]):
+            seen += count
+            if seen >= rank:
+                p95 = min(self.bounds[i], self.window_max)
+                break
+        stats = (self.window_sum / self.window_count, p95, self.window_max)
+        self._reset_window()
+        return stats
+
+    def buckets(self):
+        """Cumulative counts per upper bound, like a Prometheus histogram."""
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            buckets[str(bound)] = total
+        buckets['+Inf'] = self.count
+        return buckets
+
+    def _reset_window(self):
+        self.window_counts = [0] * (len(self.bounds) + 1)
+        self.window_count = 0
+        self.window_sum = 0.0
+        self.window_max = 0.0
+
+
+class Diagnostics:
+    """
+    The monitor's own health: how long each collector takes, which errors
+    were swallowed where, tick overruns, MQTT publish latency and the
+    process's RSS and CPU usage.
+
+    Recording is thread-safe (collectors run in a thread pool). collect()
+    returns the values as flat diag_* metrics plus per-metric details
+    (histogram buckets, errors by exception type) for JSON attributes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}  # {collector: Histogram}
+        self.errors = {}  # {source: {exception type: count}}
+        self.ticks = 0
+        self.overruns = 0
+        self.tick_ms = Histogram()
+        self.publish_ms = Histogram()
+        self.startup = None  # (total ms, {phase: ms}) up to the first publish
+        self._process = None
+        self._last_cpu = None  # (wall clock, user + system seconds)
+
+    def observe_collector(self, name, seconds):
+        with self.lock:
+            histogram = self.durations.get(name)
+            if histogram is None:
+                histogram = self.durations[name] = Histogram()
+            histogram.observe(seconds * 1000)
+
+    def record_error(self, source, exc):
+        """Counts an exception that was handled instead of raised."""
+        with self.lock:
+            by_type = self.errors.setdefault(source, {})
+            name = type(exc).__name__
+            by_type[name] = by_type.get(name, 0) + 1
+
+    def observe_tick(self, seconds, overruns=0):
+        with self.lock:
+            self.ticks += 1
+            self.overruns += overruns
+            self.tick_ms.observe(seconds * 1000)
+
+    def observe_publish(self, seconds):
+        with self.lock:
+            self.publish_ms.observe(seconds * 1000)
+
+    def set_startup(self, profile):
+        with self.lock:
+            self.startup = (profile.total_ms(), dict(profile.phases))
+
+    def collect(self):
+        """
+        Returns (values, details). Durations are mean/p95/max over the
+        window since the previous call; counters are totals since start.
+        """
+        values = {}
+        details = {}
+        with self.lock:
+            for name, histogram in self.durations.items():
+                prefix = f'diag_collector_{_label(name)}_ms'
+                if self._window(values, prefix, histogram):
+                    details[f'{prefix}_max'] = histogram.buckets()
+            for source, by_type in self.errors.items():
+                key = f'diag_errors_{_label(source)}'
+                values[key] = sum(by_type.values())
+                details[key] = dict(by_type)
+            values['diag_ticks'] = self.ticks
+            values['diag_tick_overruns'] = self.overruns
+            self._window(values, 'diag_tick_ms', self.tick_ms)
+            self._window(values, 'diag_publish_ms', self.publish_ms)
+            if self.startup is not None:
+                values['diag_startup_ms'], details['diag_startup_ms'] = self.startup
+        values.update(self._process_stats())
+        return values, details
+
+    def totals(self):
+        """
+        Cumulative state for exporters that compute their own rates:
+        ({collector: (bucket counts, sum in ms, count)},
+        {(source, exception type): count}).
+        """
+        with self.lock:
+            durations = {name: (list(h.counts), h.sum, h.count) for name, h in self.durations.items()}
+            errors = {(source, name): count for source, by_type in self.errors.items()
+                      for name, count in by_type.items()}
+        return durations, errors
+
+    def _window(self, values, prefix, histogram):
+        stats = histogram.window_stats()
+        if stats is None:
+            return False
+        mean, p95, peak = stats
+        values[f'{prefix}_mean'] = round(mean, 2)
+        values[f'{prefix}_p95'] = round(p95, 2)
+        values[f'{prefix}_max'] = round(peak, 2)
+        return True
+
+    def _process_stats(self):
+        data = {}
+        try:
+            if self._process is None:
+                self._process = psutil.Process()
+            data['diag_rss_mb'] = round(self._process.memory_info().rss / 1024 / 1024, 1)
+        except Exception as e:
+            self.record_error('diagnostics', e)
+
+        now = time.monotonic()
+        times = os.times()
+        cpu = times.user + times.system
+        if self._last_cpu is not None:
+            wall = now - self._last_cpu[0]
+            if wall > 0:
+                data['diag_cpu_percent'] = round((cpu - self._last_cpu[1]) / wall * 100, 2)
+        self._last_cpu = (now, cpu)
+        data['diag_threads'] = threading.active_count()
+        return data
+
+
+class StartupProfile:
+    """
+    Wall-clock durations of the startup phases, from before the imports
+    up to the first publish.
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.last = self.started
+        self.phases = []  # [(phase, ms)] in order
+
+    def mark(self, phase):
+        """Ends phase, which started at the previous mark."""
+        now = time.perf_counter()
+        self.phases.append((phase, round((now - self.last) * 1000, 1)))
+        self.last = now
+
+    def total_ms(self):
+        return round((self.last - self.started) * 1000, 1)
+
+    def report(self):
+        lines = ['Startup profile:']
+        lines += [f'  {phase:<14} {ms:9.1f} ms' for phase, ms in self.phases]
+        lines.append(f'  {"total":<14} {self.total_ms():9.1f} ms')
+        try:
+            import resource
+            # Kilobytes on Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            lines.append(f'  peak RSS {peak:.1f} MB, {len(sys.modules)} modules loaded')
+        except ImportError:
+            pass
+        return '\n'.join(lines)
+
+
+def _label(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
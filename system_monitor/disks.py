@@ -0,0 +1,207 @@
+import os
+import re
+import time
+import threading
+from sysfs import SysfsAttribute
+from collectors import counter_delta
+
+# Filesystems that don't hold user data
+PSEUDO_FILESYSTEMS = {
+    'autofs', 'binfmt_misc', 'bpf', 'cgroup', 'cgroup2', 'configfs', 'debugfs', 'devpts',
+    'devtmpfs', 'efivarfs', 'fusectl', 'hugetlbfs', 'mqueue', 'nsfs', 'overlay', 'proc',
+    'pstore', 'ramfs', 'rpc_pipefs', 'securityfs', 'squashfs', 'sysfs', 'tmpfs', 'tracefs',
+    'fuse.lxcfs', 'fuse.gvfsd-fuse', 'fuse.portal', 'nfsd',
+}
+# Mount points, and everything below them, that are never data volumes
+# (container bind mounts of /etc/hosts and friends share the host's data device)
+SKIP_MOUNTS = ('/etc', '/proc', '/sys', '/dev', '/run', '/boot/efi')
+# Block devices without useful I/O stats
+SKIP_BLOCK_DEVICES = re.compile(r'^(loop|ram|zram|fd|sr)\d*')
+# /proc/diskstats sectors are always 512 bytes
+SECTOR_SIZE = 512
+
+
+def _skipped(mountpoint):
+    # /devdata is a data volume, /dev/shm is not
+    return any(mountpoint == skip or mountpoint.startswith(skip + '/') for skip in SKIP_MOUNTS)
+
+
+def _label(mountpoint):
+    if mountpoint == '/':
+        return 'root'
+    return re.sub(r'[^a-zA-Z0-9_]', '_', mountpoint.strip('/'))
+
+
+class DiskUsage:
+    """
+    Usage of the real mounts, discovered once from /proc/self/mounts and
+    deduplicated by device.
+
+    statvfs() runs on a daemon thread per mount with a shared timeout, so a
+    hung NFS mount can't block the tick. A mount whose previous call is
+    still stuck is not queried again until it returns; its last values are
+    reported meanwhile and it is listed in stale.
+    """
+
+    def __init__(self, proc_root='/proc', timeout=2.0, rescan_interval=300, diagnostics=None):
+        self.mounts_file = os.path.join(proc_root, 'self/mounts')
+        self.timeout = timeout
+        self.rescan_interval = rescan_interval
+        self.diagnostics = diagnostics
+        self.mounts = []  # [(mountpoint, label)]
+        self.last_scan = None
+        self._pending = {}  # {mountpoint: thread still running statvfs}
+        self._results = {}  # {mountpoint: os.statvfs_result}
+        self._last = {}  # {mountpoint: data of the last answered statvfs}
+        self.stale = []  # Mount points whose statvfs is hung
+
+    def available(self):
+        return os.path.exists(self.mounts_file)
+
+    def discover(self):
+        devices = {}
+        with open(self.mounts_file, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                device, mountpoint, fstype = fields[0], fields[1], fields[2]
+                # Spaces and tabs are octal-escaped in the mounts file
+                mountpoint = mountpoint.replace('\\040', ' ').replace('\\011', '\t')
+                if mountpoint != '/':
+                    if fstype in PSEUDO_FILESYSTEMS or _skipped(mountpoint):
+                        continue
+                # Keep the shortest mount point per device
+                if device not in devices or len(mountpoint) < len(devices[device]):
+                    devices[device] = mountpoint
+        mountpoints = sorted(set(devices.values()))
+        if '/' not in mountpoints:
+            mountpoints.insert(0, '/')
+        self.mounts = [(mp, _label(mp)) for mp in mountpoints]
+
+    def sample(self, now=None):
+        if now is None:
+            now = time.time()
+        if self.last_scan is None or (self.rescan_interval and now - self.last_scan >= self.rescan_interval):
+            self.discover()
+            self.last_scan = now
+
+        started = []
+        for mountpoint, _ in self.mounts:
+            if mountpoint in self._pending:
+                continue  # Still hung from an earlier tick
+            thread = threading.Thread(target=self._statvfs, args=(mountpoint,), daemon=True)
+            self._pending[mountpoint] = thread
+            thread.start()
+            started.append(thread)
+
+        deadline = time.monotonic() + self.timeout
+        for thread in started:
+            thread.join(max(0, deadline - time.monotonic()))
+
+        data = {}
+        stale = []
+        for mountpoint, label in self.mounts:
+            st = self._results.pop(mountpoint, None)
+            if st is None:
+                if mountpoint in self._pending and mountpoint in self._last:
+                    # Hung: keep its sensors with the last values
+                    data.update(self._last[mountpoint])
+                    stale.append(mountpoint)
+                else:
+                    self._last.pop(mountpoint, None)
+                continue
+            values = {}
+            if st.f_blocks:
+                used = (st.f_blocks - st.f_bfree) * st.f_frsize
+                free = st.f_bavail * st.f_frsize
+                total = used + free
+                if total:
+                    values[f'disk_{label}_usage_percent'] = round(used / total * 100, 1)
+                values[f'disk_{label}_free_gb'] = free // 1024 // 1024 // 1024
+            self._last[mountpoint] = values
+            data.update(values)
+        self.stale = stale
+        return data
+
+    def _statvfs(self, mountpoint):
+        try:
+            self._results[mountpoint] = os.statvfs(mountpoint)
+        except OSError as e:
+            # Unmounted or inaccessible, its keys disappear
+            if self.diagnostics:
+                self.diagnostics.record_error('statvfs', e)
+        finally:
+            del self._pending[mountpoint]
+
+
+class DiskIO:
+    """
+    Per-device throughput, IOPS and utilisation from /proc/diskstats deltas.
+    Only whole disks listed in /sys/block are reported.
+    """
+
+    def __init__(self, proc_root='/proc', sysfs_root='/sys', rescan_interval=300):
+        self.attr = SysfsAttribute(os.path.join(proc_root, 'diskstats'), size=4096)
+        self.block_dir = os.path.join(sysfs_root, 'block')
+        self.rescan_interval = rescan_interval
+        self.devices = {}  # {name: [keys]}
+        self.last_scan = None
+        self.previous = {}  # {name: (reads, sectors_read, writes, sectors_written, io_ms)}
+
+    def available(self):
+        return os.path.exists(self.attr.path)
+
+    def discover(self):
+        self.devices = {}
+        try:
+            names = sorted(os.listdir(self.block_dir))
+        except OSError:
+            names = []
+        for name in names:
+            if SKIP_BLOCK_DEVICES.match(name):
+                continue
+            label = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+            self.devices[name] = [
+                f'disk_{label}_read_bytes_per_s',
+                f'disk_{label}_write_bytes_per_s',
+                f'disk_{label}_read_iops',
+                f'disk_{label}_write_iops',
+                f'disk_{label}_util_percent',
+            ]
+
+    def sample(self, time_delta, now=None):
+        if now is None:
+            now = time.time()
+        if self.last_scan is None or (self.rescan_interval and now - self.last_scan >= self.rescan_interval):
+            self.discover()
+            self.last_scan = now
+
+        data = {}
+        current = {}
+        for line in self.attr.read_text().splitlines():
+            fields = line.split()
+            if len(fields) < 14 or fields[2] not in self.devices:
+                continue
+            name = fields[2]
+            # reads completed, sectors read, writes completed, sectors written, ms doing I/O
+            counters = (int(fields[3]), int(fields[5]), int(fields[7]), int(fields[9]), int(fields[12]))
+            current[name] = counters
+            previous = self.previous.get(name)
+            if previous is None:
+                continue
+            reads, sectors_read, writes, sectors_written, io_ms = \
+                [counter_delta(p, c) for p, c in zip(previous, counters)]
+            if min(reads, sectors_read, writes, sectors_written, io_ms) < 0:
+                continue  # Device was reset
+            keys = self.devices[name]
+            data[keys[0]] = round(sectors_read * SECTOR_SIZE / time_delta, 2)
+            data[keys[1]] = round(sectors_written * SECTOR_SIZE / time_delta, 2)
+            data[keys[2]] = round(reads / time_delta, 2)
+            data[keys[3]] = round(writes / time_delta, 2)
+            data[keys[4]] = round(min(100.0, io_ms / (time_delta * 1000) * 100), 1)
+        self.previous = current
+        return data
+
+    def close(self):
+        self.attr.close()
@@ -0,0 +1,151 @@
+import threading
+from sysfs import SysfsAttribute, DEVICE_GONE_ERRNOS
+
+# Microjoules per kilowatt-hour
+UJ_PER_KWH = 3.6e12
+
+
+class EnergyDomain:
+    __slots__ = ('path', 'name', 'max_range', 'attr', 'last', 'pending', 'total', 'sampled', 'failed')
+
+    def __init__(self, path, name, energy, max_range):
+        self.path = path
+        self.name = name
+        self.max_range = max_range  # Counter range in µJ, None if unknown
+        self.attr = SysfsAttribute(energy)
+        self.last = None  # Previous raw reading
+        self.pending = 0  # µJ since the last sample
+        self.total = 0  # µJ accumulated by the monitor
+        self.sampled = False  # Had a reading at the last sample, so pending is a full interval
+        self.failed = False  # Unreadable (e.g. root-only energy_uj), skipped until the next scan
+
+
+class EnergyCounters:
+    """
+    Power and accumulated energy of the CPU energy domains found by the
+    hardware registry (RAPL packages and subdomains, amd_energy sockets).
+
+    The counters are free-running microjoule values. A reading below the
+    previous one wrapped at max_energy_range_uj, which takes only minutes
+    at full load on large servers, and is corrected; a domain without a
+    known range is treated as reset instead. Every poll() folds the
+    readings into the energy used since the last sample() and a running
+    total, so with start(interval) a background thread keeps polling faster
+    than a counter can wrap twice, however long the collector interval is.
+
+    A counter whose device is gone calls invalidate (a hardware rescan).
+    One that can't be read for another reason, e.g. energy_uj being
+    root-only in a rootless container, is recorded in diagnostics once and
+    skipped until the next scan.
+    """
+
+    def __init__(self, invalidate=None, diagnostics=None):
+        self.domains = {}  # {path: EnergyDomain}
+        self.invalidate = invalidate
+        self.diagnostics = diagnostics
+        self.lock = threading.Lock()
+        self._restored = {}  # {path: (last reading, total)} from import_state
+        self._stop = threading.Event()
+        self._thread = None
+
+    def set_domains(self, domains):
+        """Follows a hardware scan, keeping the counters of known domains."""
+        with self.lock:
+            current = {}
+            for info in domains:
+                domain = self.domains.pop(info['path'], None)
+                if domain is None:
+                    domain = EnergyDomain(info['path'], info['name'], info['energy'], info['max_range'])
+                    restored = self._restored.pop(info['path'], None)
+                    if restored is not None:
+                        domain.last, domain.total = restored
+                        domain.sampled = True
+                else:
+                    # Retried after every scan
+                    domain.failed = False
+                current[info['path']] = domain
+            for domain in self.domains.values():
+                domain.attr.close()
+            self.domains = current
+
+    def poll(self):
+        with self.lock:
+            self._poll()
+
+    def sample(self, time_delta):
+        """
+        Returns the mean power of each domain since the previous sample and
+        its accumulated energy.
+        """
+        data = {}
+        with self.lock:
+            self._poll()
+            for domain in self.domains.values():
+                if domain.last is None or domain.failed:
+                    continue
+                if domain.sampled:
+                    data[f'cpu_power_{domain.name}_watts'] = round(domain.pending / 1_000_000.0 / time_delta, 2)
+                data[f'cpu_energy_{domain.name}_kwh'] = round(domain.total / UJ_PER_KWH, 6)
+                domain.pending = 0
+                domain.sampled = True
+        return data
+
+    def export_state(self):
+        """Returns ({path: last reading}, {path: total}) of the known domains."""
+        with self.lock:
+            readings = {path: d.last for path, d in self.domains.items() if d.last is not None}
+            totals = {path: d.total for path, d in self.domains.items() if d.last is not None}
+        return readings, totals
+
+    def import_state(self, readings, totals=None):
+        """Restores counters of export_state(), applied when the domain is found."""
+        totals = totals or {}
+        with self.lock:
+            for path, last in readings.items():
+                self._restored[path] = (last, totals.get(path, 0))
+
+    def start(self, interval):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='energy', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.poll()
+
+    def _poll(self):
+        gone = False
+        for domain in self.domains.values():
+            if domain.failed:
+                continue
+            try:
+                value = domain.attr.read_int()
+            except (OSError, ValueError) as e:
+                if isinstance(e, OSError) and e.errno in DEVICE_GONE_ERRNOS:
+                    gone = True
+                    continue
+                domain.failed = True
+                domain.sampled = False
+                if self.diagnostics:
+                    self.diagnostics.record_error('energy', e)
+                continue
+            if domain.last is not None:
+                delta = value - domain.last
+                if delta < 0:
+                    if domain.max_range is None:
+                        # Reset, not a wrap: this interval is lost
+                        domain.sampled = False
+                        delta = 0
+                    else:
+                        delta += domain.max_range
+                domain.pending += delta
+                domain.total += delta
+            domain.last = value
+        if gone and self.invalidate:
+            self.invalidate()
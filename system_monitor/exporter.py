@@ -0,0 +1,188 @@
+import re
+import gzip
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from diagnostics import DURATION_BUCKETS_MS
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+PREFIX = 'system_monitor_'
+# Suffixes added by the sampler's aggregates, exported as an "aggregate" label
+_AGGREGATE_SUFFIX = re.compile(r'_(min|max|mean)$')
+_INVALID_NAME = re.compile(r'[^a-zA-Z0-9_:]')
+
+
+class PrometheusExporter:
+    """
+    Serves the latest stats in OpenMetrics text format on /metrics.
+
+    The exposition is rendered once per update() and scrapes are answered
+    from that buffer (and its gzip variant, compressed on first request),
+    so scrapes never run collectors and many scrapers cost almost nothing.
+
+    Flattened keys are mapped to metric names with labels by label_rules
+    (see monitor.METRIC_LABELS); describe_metric decides between gauge and
+    counter. With diagnostics, collector durations and handled errors are
+    exported as a histogram and a counter.
+    """
+
+    def __init__(self, port, host='', describe_metric=None, label_rules=(), diagnostics=None):
+        self.port = port
+        self.host = host
+        self.describe_metric = describe_metric
+        self.label_rules = [(re.compile(pattern), name, labels) for pattern, name, labels in label_rules]
+        self.diagnostics = diagnostics
+        self.lock = threading.Lock()
+        self._body = b'# EOF\n'
+        self._gzip = None
+        self._series = {}  # {key: (family, type, sample name, labels)}
+        self.server = None
+        self._thread = None
+
+    def start(self):
+        handler = type('Handler', (_Handler,), {'exporter': self})
+        self.server = ThreadingHTTPServer((self.host, self.port), handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name='exporter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def update(self, stats):
+        """Renders a new exposition from a stats snapshot."""
+        body = self.render(stats).encode('utf-8')
+        with self.lock:
+            self._body = body
+            self._gzip = None
+
+    def body(self, compressed=False):
+        with self.lock:
+            if not compressed:
+                return self._body
+            if self._gzip is None:
+                self._gzip = gzip.compress(self._body, compresslevel=5)
+            return self._gzip
+
+    def render(self, stats):
+        families = {}  # {family: (type, [sample lines])}, insertion ordered
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = self._describe(key, stats)
+            family, metric_type, sample, labels = series
+            lines = families.setdefault(family, (metric_type, []))[1]
+            lines.append(f'{sample}{labels} {_format_value(value)}')
+        if len(self._series) > len(stats):
+            # Keys went away (e.g. a removed container), forget their series
+            self._series = {key: series for key, series in self._series.items() if key in stats}
+
+        if self.diagnostics:
+            self._render_diagnostics(families)
+
+        out = []
+        for family, (metric_type, lines) in families.items():
+            out.append(f'# TYPE {family} {metric_type}')
+            out.extend(lines)
+        out.append('# EOF')
+        return '\n'.join(out) + '\n'
+
+    def _render_diagnostics(self, families):
+        durations, errors = self.diagnostics.totals()
+        family = PREFIX + 'collector_duration_seconds'
+        for collector, (counts, total_ms, count) in durations.items():
+            lines = families.setdefault(family, ('histogram', []))[1]
+            label = f'collector="{_escape(collector)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(DURATION_BUCKETS_MS, counts):
+                cumulative += bucket_count
+                lines.append(f'{family}_bucket{{{label},le="{bound / 1000}"}} {cumulative}')
+            lines.append(f'{family}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{family}_count{{{label}}} {count}')
+            lines.append(f'{family}_sum{{{label}}} {total_ms / 1000}')
+
+        family = PREFIX + 'errors'
+        for (source, error_type), count in errors.items():
+            lines = families.setdefault(family, ('counter', []))[1]
+            lines.append(f'{family}_total{{source="{_escape(source)}",type="{_escape(error_type)}"}} {count}')
+
+    def _describe(self, key, stats):
+        """Returns (family, type, sample name, label string) for a key."""
+        labels = {}
+        base = key
+        match = _AGGREGATE_SUFFIX.search(key)
+        if match and key[:match.start()] in stats:
+            # A sampler aggregate, the last value is published under the base key
+            base = key[:match.start()]
+            labels['aggregate'] = match.group(1)
+
+        name = base
+        for pattern, template, fixed in self.label_rules:
+            rule_match = pattern.fullmatch(base)
+            if rule_match:
+                groups = rule_match.groupdict()
+                name = template.format(**groups)
+                labels.update(fixed)
+                labels.update({k: v for k, v in groups.items() if k != 'metric' and v is not None})
+                break
+
+        metadata = self.describe_metric(base) if self.describe_metric else None
+        counter = bool(metadata) and metadata.get('state_class') == 'total_increasing'
+        family = PREFIX + _INVALID_NAME.sub('_', name)
+        if counter and 'aggregate' in labels:
+            # Aggregates of a counter (min/max/mean over a window) are gauges,
+            # a family can't hold both
+            counter = False
+            family += '_aggregate'
+        elif not counter and 'aggregate' not in labels and any(
+                f'{key}_{aggregate}' in stats for aggregate in ('min', 'max', 'mean')):
+            # The last value, labelled like its aggregates in the same family
+            labels['aggregate'] = 'last'
+        if counter:
+            sample = family + '_total'
+        else:
+            sample = family
+        label_text = ''
+        if labels:
+            label_text = '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + '}'
+        return family, 'counter' if counter else 'gauge', sample, label_text
+
+
+class _Handler(BaseHTTPRequestHandler):
+    exporter = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        compressed = 'gzip' in self.headers.get('Accept-Encoding', '')
+        body = self.exporter.body(compressed)
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        if compressed:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per scrape would flood the container log
+        pass
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isnan(value):
+            return 'NaN'
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+    return repr(value)
@@ -0,0 +1,167 @@
+import os
+import glob
+import time
+
+INTEL_VENDOR_ID = '0x8086'
+AMD_VENDOR_ID = '0x1002'
+NVIDIA_VENDOR_ID = '0x10de'
+# PCI class of display controllers (VGA, 3D, ...)
+DISPLAY_CLASS = '0x03'
+
+
+class HardwareRegistry:
+    """
+    Resolves the sysfs sensor files the monitor reads on every tick.
+
+    Discovery (globbing /sys, reading vendor and name files) only happens in
+    scan(). Collectors use the resolved paths and call invalidate() when a
+    read fails, so hotplugged or removed devices are picked up on the next
+    refresh. A slow periodic rescan catches devices that appear later.
+    """
+
+    def __init__(self, sysfs_root='/sys', rescan_interval=300):
+        self.sysfs_root = sysfs_root
+        self.rescan_interval = rescan_interval
+        self.last_scan = None
+
+        # CPU energy counters: [{'path', 'name', 'energy', 'max_range'}]
+        # (max_range is the wrap-around value in µJ, None if unknown)
+        self.energy_domains = []
+        # Intel GPUs: [{'card', 'freq'}]
+        self.intel_gpus = []
+        # AMD GPUs: [{'card', 'busy', 'temp', 'power'}] (missing sensors are None)
+        self.amd_gpus = []
+
+    def refresh(self, now=None):
+        """
+        Rescans if no scan happened yet, the registry was invalidated or the
+        rescan interval elapsed. Returns True if a scan was performed.
+        """
+        if now is None:
+            now = time.time()
+        if self.last_scan is not None:
+            if not self.rescan_interval or now - self.last_scan < self.rescan_interval:
+                return False
+        self.scan()
+        self.last_scan = now
+        return True
+
+    def invalidate(self):
+        """Forces a rescan on the next refresh()."""
+        self.last_scan = None
+
+    def paths(self):
+        """
+        Returns every sensor file the collectors read through the shared
+        SysfsReader. Energy counters have their own, see EnergyCounters.
+        """
+        paths = {gpu['freq'] for gpu in self.intel_gpus}
+        for gpu in self.amd_gpus:
+            paths.update(p for p in (gpu['busy'], gpu['temp'], gpu['power']) if p)
+        return paths
+
+    def scan(self):
+        self.energy_domains = self._scan_rapl() or self._scan_amd_energy()
+        self.intel_gpus = []
+        self.amd_gpus = []
+        for path in sorted(glob.glob(os.path.join(self.sysfs_root, 'class/drm/card*'))):
+            card_name = os.path.basename(path)
+            # Skip connectors like card0-DP-1, they share the parent's device
+            if '-' in card_name:
+                continue
+            vendor_id = _read_text(os.path.join(path, 'device/vendor'))
+            if vendor_id == INTEL_VENDOR_ID:
+                freq = os.path.join(path, 'gt_act_freq_mhz')
+                if os.path.exists(freq):
+                    self.intel_gpus.append({'card': card_name, 'freq': freq})
+            elif vendor_id == AMD_VENDOR_ID:
+                self.amd_gpus.append(self._scan_amd(path, card_name))
+
+    def _scan_rapl(self):
+        # Packages (and psys) with their core, uncore and dram subdomains.
+        # AMD Zen CPUs are exposed here too on recent kernels.
+        domains = []
+        rapl_path = os.path.join(self.sysfs_root, 'class/powercap/intel-rapl')
+        for pkg in sorted(glob.glob(os.path.join(rapl_path, 'intel-rapl:*'))):
+            name = _read_text(os.path.join(pkg, 'name'))
+            if not name or not self._add_rapl(domains, pkg, name):
+                continue
+            for sub in sorted(glob.glob(os.path.join(pkg, 'intel-rapl:*'))):
+                sub_name = _read_text(os.path.join(sub, 'name'))
+                if sub_name:
+                    self._add_rapl(domains, sub, f'{name}_{sub_name}')
+        return domains
+
+    def _add_rapl(self, domains, path, name):
+        energy_file = os.path.join(path, 'energy_uj')
+        if not os.path.exists(energy_file):
+            return False
+        max_range = _read_text(os.path.join(path, 'max_energy_range_uj'))
+        domains.append({'path': path, 'name': name, 'energy': energy_file,
+                        'max_range': int(max_range) if max_range and max_range.isdigit() else None})
+        return True
+
+    def _scan_amd_energy(self):
+        # The amd_energy hwmon driver, for kernels without AMD powercap. Its
+        # counters are extended to 64 bits by the driver, so they don't wrap.
+        # Only the per-socket counters, not one per core.
+        domains = []
+        for hwmon in sorted(glob.glob(os.path.join(self.sysfs_root, 'class/hwmon/hwmon*'))):
+            if _read_text(os.path.join(hwmon, 'name')) != 'amd_energy':
+                continue
+            for label_file in sorted(glob.glob(os.path.join(hwmon, 'energy*_label'))):
+                label = _read_text(label_file) or ''
+                energy_file = label_file[:-len('label')] + 'input'
+                if label.startswith('Esocket') and os.path.exists(energy_file):
+                    domains.append({'path': energy_file, 'name': label[1:], 'energy': energy_file,
+                                    'max_range': None})
+        return domains
+
+    def _scan_amd(self, path, card_name):
+        gpu = {'card': card_name, 'busy': None, 'temp': None, 'power': None}
+        busy = os.path.join(path, 'device/gpu_busy_percent')
+        if os.path.exists(busy):
+            gpu['busy'] = busy
+        for hwmon in sorted(glob.glob(os.path.join(path, 'device/hwmon/hwmon*'))):
+            temp = os.path.join(hwmon, 'temp1_input')
+            if gpu['temp'] is None and os.path.exists(temp):
+                gpu['temp'] = temp
+            # Try power1_average first, then power1_input
+            if gpu['power'] is None:
+                for p_file in ['power1_average', 'power1_input']:
+                    p_path = os.path.join(hwmon, p_file)
+                    if os.path.exists(p_path):
+                        gpu['power'] = p_path
+                        break
+        return gpu
+
+
+def has_nvidia_gpu(sysfs_root='/sys', proc_root='/proc'):
+    """
+    Whether an NVIDIA GPU is present, without loading NVML: the driver's
+    /proc entry (the container runtime maps it in), or an NVIDIA display
+    controller on the PCI bus.
+    """
+    try:
+        if os.listdir(os.path.join(proc_root, 'driver/nvidia/gpus')):
+            return True
+    except OSError:
+        pass
+    try:
+        entries = os.scandir(os.path.join(sysfs_root, 'bus/pci/devices'))
+    except OSError:
+        return False
+    with entries:
+        for entry in entries:
+            if _read_text(os.path.join(entry.path, 'vendor')) == NVIDIA_VENDOR_ID \
+                    and (_read_text(os.path.join(entry.path, 'class')) or '').startswith(DISPLAY_CLASS):
+                return True
+    return False
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
@@ -0,0 +1,309 @@
+"""
+On-device rollup history of the published metrics.
+
+Each metric has one fixed-size ring file, memory-mapped, holding min, max
+and mean per slot at three resolutions. A slot's position follows from its
+start time, so writing needs no head pointer and a restarted monitor keeps
+filling the same rings:
+
+    header: magic b'SMHR', version, level count, (resolution, slots) per level
+    rings:  per level, slots records of (slot start, count, min, max, sum)
+
+The counter snapshots the rate collectors need (see
+SystemMonitor.export_state) are kept next to the rings in state.json.
+
+Dumping what was recorded, e.g. while the broker was down:
+
+    python history.py --dir /data/history --resolution 60 --since 7200 cpu_usage_percent
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import struct
+
+MAGIC = b'SMHR'
+FORMAT_VERSION = 1
+# (seconds per slot, slots): 10 minutes of 1s, a day of 1m and 30 days of 1h
+LEVELS = ((1, 600), (60, 1440), (3600, 720))
+HEADER = struct.Struct('<4sHH')
+LEVEL = struct.Struct('<II')
+# The rings start at a fixed offset after the header
+HEADER_SIZE = 64
+RECORD = struct.Struct('<IIddd')
+STATE_FILE = 'state.json'
+# Seconds between checks for rings to prune
+PRUNE_CHECK_INTERVAL = 60
+# Sampler aggregates of a metric, the rings already keep its min/max/mean
+_AGGREGATE_SUFFIX = re.compile(r'_(min|max|mean)$')
+# Per-core and per-container keys, recorded after the host-level ones
+_BULK_KEY = re.compile(r'(cpu_core_\d+|container_[0-9a-f]{12})_')
+
+
+class RingFile:
+    """Rollup rings of one metric, mapped from path."""
+
+    def __init__(self, path, levels=LEVELS):
+        self.path = path
+        self.levels = levels
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, len(levels)) + b''.join(LEVEL.pack(*level) for level in levels)
+        if len(header) > HEADER_SIZE:
+            raise ValueError('Too many history levels')
+        self.offsets = []
+        size = HEADER_SIZE
+        for _, slots in levels:
+            self.offsets.append(size)
+            size += slots * RECORD.size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0), 0o644)
+        try:
+            if os.pread(fd, len(header), 0) != header:
+                # New file, or written with other levels: start over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                if hasattr(os, 'posix_fallocate'):
+                    # Fail here on a full disk, not with SIGBUS on a later write
+                    os.posix_fallocate(fd, 0, size)
+                os.pwrite(fd, header, 0)
+            # The mapping stays valid after the fd is closed
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def add(self, timestamp, value):
+        for (resolution, slots), offset in zip(self.levels, self.offsets):
+            start = int(timestamp) // resolution * resolution
+            position = offset + (start // resolution) % slots * RECORD.size
+            slot_start, count, low, high, total = RECORD.unpack_from(self.map, position)
+            if slot_start != start:
+                # First value of this slot, it overwrites one a full ring ago
+                RECORD.pack_into(self.map, position, start, 1, value, value, value)
+            else:
+                RECORD.pack_into(self.map, position, start, count + 1,
+                                 min(low, value), max(high, value), total + value)
+
+    def read(self, resolution, since=0, until=None):
+        """
+        Returns [(slot start, min, max, mean, count)] of one level, oldest
+        first, for the slots starting in [since, until].
+        """
+        if until is None:
+            until = time.time()
+        for (level_resolution, slots), offset in zip(self.levels, self.offsets):
+            if level_resolution == resolution:
+                break
+        else:
+            raise ValueError(f'No {resolution}s history level')
+        # Older slots have been overwritten or are left over from a full ring ago
+        since = max(since, until - slots * resolution)
+        rows = []
+        for start, count, low, high, total in RECORD.iter_unpack(self.map[offset:offset + slots * RECORD.size]):
+            if count and since <= start <= until:
+                rows.append((start, low, high, total / count, count))
+        rows.sort()
+        return rows
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+
+
+class HistoryStore:
+    """
+    Ring files of up to max_metrics metrics in directory. Numeric values
+    of each recorded stats dict are added to their metric's rings; files
+    are created the first time a metric is seen. The pages are written
+    back by the kernel, flush() forces them out (e.g. before a power cut).
+
+    The sampler's _min/_max/_mean keys are not recorded, the rings of their
+    metric already hold them. When max_metrics is reached, host-level
+    metrics take the ring of a per-core or per-container one; rings of
+    metrics not seen for prune_after seconds (a stopped container, a
+    removed interface) are deleted to make room.
+    """
+
+    def __init__(self, directory, levels=LEVELS, max_metrics=256, prune_after=86400):
+        self.directory = directory
+        self.levels = levels
+        self.max_metrics = max_metrics
+        self.prune_after = prune_after
+        os.makedirs(directory, exist_ok=True)
+        self.rings = {}  # {key: RingFile}
+        # {ring path: last recorded}; rings left by a previous run count
+        # against the limit and are pruned like the others
+        self.seen = {self._path(key): None for key in self.keys()}
+        self.skipped = set()  # Keys over max_metrics, retried once a ring is freed
+        self.aggregates = set()  # Sampler aggregate keys, never recorded
+        self._reported = set()  # Skipped keys already logged
+        self._last_prune = None
+
+    def keys(self):
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith('.ring'))
+
+    def record(self, timestamp, stats):
+        new = []
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            ring = self.rings.get(key)
+            if ring is None:
+                if key not in self.skipped and key not in self.aggregates:
+                    new.append(key)
+                continue
+            ring.add(timestamp, value)
+            self.seen[ring.path] = timestamp
+        if new:
+            self._add(timestamp, stats, new)
+        if self.prune_after and (self._last_prune is None or timestamp - self._last_prune >= PRUNE_CHECK_INTERVAL):
+            self.prune(timestamp)
+
+    def prune(self, now):
+        """Deletes the rings of metrics not recorded for prune_after seconds."""
+        self._last_prune = now
+        for path, seen in list(self.seen.items()):
+            if seen is None:
+                # Left by a previous run, its clock starts now
+                self.seen[path] = now
+            elif now - seen > self.prune_after:
+                self._remove(path)
+
+    def query(self, key, resolution=60, since=0, until=None):
+        """Rollups of one metric, see RingFile.read. Unknown keys have none."""
+        ring = self.rings.get(key)
+        if ring is None:
+            if not os.path.exists(self._path(key)):
+                return []
+            ring = self._open(key, create=False)
+            if ring is None:
+                return []
+        return ring.read(resolution, since, until)
+
+    def save_state(self, state):
+        """Atomically replaces the saved counter snapshot."""
+        path = os.path.join(self.directory, STATE_FILE)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def load_state(self):
+        """The saved counter snapshot, or None."""
+        try:
+            with open(os.path.join(self.directory, STATE_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def flush(self):
+        for ring in self.rings.values():
+            ring.flush()
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
+    def _add(self, timestamp, stats, keys):
+        skipped = []
+        # Host-level metrics first, they may take the rings of bulk ones
+        for key in sorted(keys, key=priority):
+            match = _AGGREGATE_SUFFIX.search(key)
+            if match and key[:match.start()] in stats:
+                self.aggregates.add(key)
+                continue
+            ring = self._open(key)
+            if ring is None:
+                skipped.append(key)
+                continue
+            ring.add(timestamp, stats[key])
+            self.seen[ring.path] = timestamp
+        unreported = [key for key in skipped if key not in self._reported]
+        if unreported:
+            self._reported.update(unreported)
+            print(f"History is full ({self.max_metrics} metrics), not recording {len(unreported)} more: "
+                  f"{', '.join(unreported[:5])}{', ...' if len(unreported) > 5 else ''}")
+
+    def _open(self, key, create=True):
+        path = self._path(key)
+        if key in self.skipped:
+            return None
+        if create and path not in self.seen:
+            if len(self.seen) >= self.max_metrics and not self._evict(key):
+                self.skipped.add(key)
+                return None
+            self.seen[path] = None
+        try:
+            ring = RingFile(path, self.levels)
+        except OSError as e:
+            print(f"History for {key} disabled: {e}")
+            self.skipped.add(key)
+            return None
+        self.rings[key] = ring
+        return ring
+
+    def _evict(self, key):
+        """Deletes the least recently recorded ring of a lower priority than key."""
+        rank = priority(key)
+        candidates = [(seen or 0, path) for path, seen in self.seen.items()
+                      if priority(os.path.basename(path)[:-5]) > rank]
+        if not candidates:
+            return False
+        path = min(candidates)[1]
+        print(f"History is full ({self.max_metrics} metrics), {os.path.basename(path)[:-5]} makes room for {key}")
+        self._remove(path)
+        return True
+
+    def _remove(self, path):
+        for key, ring in list(self.rings.items()):
+            if ring.path == path:
+                ring.close()
+                del self.rings[key]
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        del self.seen[path]
+        # A ring is free, the skipped keys get another chance
+        self.skipped.clear()
+
+    def _path(self, key):
+        return os.path.join(self.directory, re.sub(r'[^a-zA-Z0-9_.-]', '_', key) + '.ring')
+
+
+def priority(key):
+    """Keys of which a host has hundreds rank after the host-level ones."""
+    return 1 if _BULK_KEY.match(key) else 0
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Dump the on-device metric history.')
+    parser.add_argument('keys', nargs='*', help='Metrics to dump, all by default')
+    parser.add_argument('--dir', default=os.environ.get('HISTORY_DIR', '/data/history'))
+    parser.add_argument('--resolution', type=int, default=60, choices=[level[0] for level in LEVELS],
+                        help='Seconds per row')
+    parser.add_argument('--since', type=float, default=3600, help='Seconds back from now')
+    parser.add_argument('--list', action='store_true', help='List the recorded metrics')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.dir):
+        print(f'No history in {args.dir}', file=sys.stderr)
+        sys.exit(1)
+    store = HistoryStore(args.dir)
+    if args.list:
+        print('\n'.join(store.keys()))
+        return
+    now = time.time()
+    for key in args.keys or store.keys():
+        for start, low, high, mean, count in store.query(key, args.resolution, now - args.since, now):
+            print(json.dumps({'key': key, 'timestamp': start, 'min': low, 'max': high,
+                              'mean': round(mean, 6), 'count': count}))
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
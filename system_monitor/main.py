@@ -1,10 +1,173 @@
-import os
 import time
+# Start of the startup profile, before the imports below
+STARTED = time.perf_counter()
+import os
+import math
+import signal
 import socket
-from monitor import SystemMonitor
+import asyncio
+from collectors import DEFAULT_WORKERS
+from monitor import SystemMonitor, DEFAULT_COLLECTOR_INTERVALS, DEFAULT_NET_EXCLUDE, METRIC_LABELS, describe_metric
 from mqtt_client import MQTTClient
+from offline_buffer import OfflineBuffer
+from diagnostics import StartupProfile
+
+# How often the first tick checks for the broker connection
+CONNECT_POLL_INTERVAL = 0.05
+
+def parse_deadband(text):
+    """
+    Parses a deadband like "0.5" (absolute) or "2%" (relative to the last
+    published value) into an (absolute, relative) tuple.
+    """
+    text = text.strip()
+    if text.endswith('%'):
+        return (0.0, float(text[:-1]) / 100.0)
+    return (float(text), 0.0)
+
+async def collect(monitor, timeout):
+    """
+    Runs the due collectors in the scheduler's thread pool, waiting at most
+    timeout seconds. Collectors past their deadline finish in the background
+    and their results land in the cache for a later tick, so one hung sensor
+    can't stall the rest.
+    """
+    loop = asyncio.get_running_loop()
+    now = time.time()
+    await loop.run_in_executor(None, monitor.refresh_hardware, now)
+    await loop.run_in_executor(None, monitor.collectors.run_due, now, timeout)
+    return monitor.collectors.snapshot(count_stale=True)
+
+async def wait_connected(client, stop, deadline):
+    """
+    Waits for the broker connection until the deadline, returning early when
+    stop is set. Returns whether the connection is up.
+    """
+    loop = asyncio.get_running_loop()
+    while not client.wait_connected(0):
+        remaining = deadline - loop.time()
+        if remaining <= 0 or stop.is_set():
+            return False
+        try:
+            await asyncio.wait_for(stop.wait(), min(remaining, CONNECT_POLL_INTERVAL))
+        except asyncio.TimeoutError:
+            pass
+    return True
+
+async def run(monitor, client, sampler, interval, collector_timeout, connect_timeout=30,
+              diagnostics_interval=0, exporter=None, profile=None, print_profile=False,
+              history=None, state_interval=60):
+    loop = asyncio.get_running_loop()
+    diagnostics = monitor.diagnostics
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    if sampler:
+        sampler.start()
+
+    # The network thread connects while the first sample is collected instead
+    # of one after the other. QoS 0 publishes without a connection are
+    # dropped by paho, so the first update waits for it; samples taken while
+    # disconnected later on go to the offline buffer.
+    connect_deadline = loop.time() + connect_timeout
+
+    print(f"Starting main loop with interval: {interval}s")
+    next_tick = loop.time()
+    next_diagnostics = next_tick + diagnostics_interval
+    next_state = next_tick + state_interval
+    while not stop.is_set():
+        tick_started = loop.time()
+        try:
+            if sampler:
+                stats = sampler.collect()
+            else:
+                stats = await collect(monitor, collector_timeout)
+            if connect_deadline is not None:
+                if profile:
+                    profile.mark('first_collect')
+                if not await wait_connected(client, stop, connect_deadline):
+                    if stop.is_set():
+                        break
+                    print(f"MQTT broker not connected after {connect_timeout}s, continuing")
+                connect_deadline = None
+                if profile:
+                    profile.mark('connect')
+                # Waiting for the broker is not a tick overrun
+                next_tick = loop.time()
+            # Report what the previous update cost on the wire
+            stats.update(client.publish_stats())
+            # Scrapes are served from this snapshot until the next tick
+            if exporter:
+                exporter.update(stats)
+            # Sensors not seen before are discovered here, including rates
+            # such as CPU power that only appear from the second tick on
+            publish_started = time.monotonic()
+            client.publish_update(stats)
+            client.publish_attributes(monitor.attributes())
+            # Drain samples buffered while the broker was unreachable
+            client.flush_offline()
+            diagnostics.observe_publish(time.monotonic() - publish_started)
+            if profile:
+                profile.mark('first_publish')
+                diagnostics.set_startup(profile)
+                if print_profile:
+                    print(profile.report())
+                profile = None
+            # The monitor's own overhead, at a much lower cadence
+            if diagnostics_interval and tick_started >= next_diagnostics:
+                client.publish_diagnostics(*diagnostics.collect())
+                next_diagnostics = tick_started + diagnostics_interval
+        except Exception as e:
+            print(f"Error in main loop: {e}")
+            diagnostics.record_error('main', e)
+        else:
+            if history:
+                try:
+                    history.record(time.time(), stats)
+                    if tick_started >= next_state:
+                        history.save_state(monitor.export_state())
+                        next_state = tick_started + state_interval
+                except Exception as e:
+                    print(f"Error recording history: {e}")
+                    diagnostics.record_error('history', e)
+
+        # Schedule against a monotonic clock so ticks don't drift by the time
+        # spent collecting and publishing
+        next_tick += interval
+        now = loop.time()
+        overruns = 0
+        if next_tick < now:
+            overruns = math.ceil((now - next_tick) / interval)
+            next_tick += overruns * interval
+        diagnostics.observe_tick(now - tick_started, overruns)
+        try:
+            await asyncio.wait_for(stop.wait(), next_tick - now)
+        except asyncio.TimeoutError:
+            pass
+
+    print("Shutting down...")
+    if sampler:
+        await loop.run_in_executor(None, sampler.stop)
+    if history:
+        # Rates resume from these counters after a restart
+        try:
+            history.save_state(monitor.export_state())
+            history.flush()
+        except Exception as e:
+            print(f"Error saving history state: {e}")
+        history.close()
+    monitor.close()
+    client.disconnect()
 
 def main():
+    profile = StartupProfile(STARTED)
+    profile.mark('imports')
+    print_profile = os.environ.get('STARTUP_PROFILE', 'false').lower() in ('1', 'true', 'yes')
+
     # Load Environment Variables
     broker = os.environ.get('MQTT_BROKER', 'localhost')
     try:
@@ -21,37 +184,211 @@ def main():
     except ValueError:
         print("Invalid UPDATE_INTERVAL, defaulting to 10s")
         interval = 10
+    if interval <= 0:
+        print("UPDATE_INTERVAL must be positive, defaulting to 10s")
+        interval = 10
+
+    try:
+        rescan_interval = int(os.environ.get('HARDWARE_RESCAN_INTERVAL', 300))
+    except ValueError:
+        print("Invalid HARDWARE_RESCAN_INTERVAL, defaulting to 300s")
+        rescan_interval = 300
+
+    try:
+        sample_interval = float(os.environ.get('SAMPLE_INTERVAL', 0))
+    except ValueError:
+        print("Invalid SAMPLE_INTERVAL, disabling high-frequency sampling")
+        sample_interval = 0
+    aggregate_prefixes = [p.strip() for p in os.environ.get('SAMPLE_AGGREGATES', '').split(',') if p.strip()]
+
+    # Per-collector intervals, e.g. COLLECTOR_INTERVAL_DISK=300
+    collector_intervals = {}
+    for name in DEFAULT_COLLECTOR_INTERVALS:
+        env_name = f'COLLECTOR_INTERVAL_{name.upper()}'
+        if env_name in os.environ:
+            try:
+                collector_intervals[name] = float(os.environ[env_name])
+            except ValueError:
+                print(f"Invalid {env_name}, using default of {DEFAULT_COLLECTOR_INTERVALS[name]}s")
+
+    # Per-collector deadlines, e.g. COLLECTOR_TIMEOUT_GPU=2
+    collector_timeouts = {}
+    for name in DEFAULT_COLLECTOR_INTERVALS:
+        env_name = f'COLLECTOR_TIMEOUT_{name.upper()}'
+        if env_name in os.environ:
+            try:
+                collector_timeouts[name] = float(os.environ[env_name])
+            except ValueError:
+                print(f"Invalid {env_name}, using COLLECTOR_TIMEOUT")
+
+    try:
+        collector_workers = int(os.environ.get('COLLECTOR_WORKERS', DEFAULT_WORKERS))
+    except ValueError:
+        print(f"Invalid COLLECTOR_WORKERS, defaulting to {DEFAULT_WORKERS}")
+        collector_workers = DEFAULT_WORKERS
+
+    # Seconds between CPU energy counter reads in the background, 0 reads
+    # them only when the cpu collector runs
+    try:
+        energy_poll_interval = float(os.environ.get('ENERGY_POLL_INTERVAL', 0))
+    except ValueError:
+        print("Invalid ENERGY_POLL_INTERVAL, defaulting to 0")
+        energy_poll_interval = 0
+
+    publish_mode = os.environ.get('PUBLISH_MODE', 'full').lower()
+    if publish_mode not in ('full', 'delta'):
+        print("Invalid PUBLISH_MODE, defaulting to full")
+        publish_mode = 'full'
+    try:
+        deadband = parse_deadband(os.environ.get('DELTA_DEADBAND', '0'))
+    except ValueError:
+        print("Invalid DELTA_DEADBAND, defaulting to 0")
+        deadband = (0.0, 0.0)
+    # Per-metric deadbands by key prefix, e.g. "cpu_core_=2,cpu_power_=5%"
+    deadbands = {}
+    for item in os.environ.get('DELTA_DEADBANDS', '').split(','):
+        if '=' not in item:
+            continue
+        prefix, value = item.split('=', 1)
+        try:
+            deadbands[prefix.strip()] = parse_deadband(value)
+        except ValueError:
+            print(f"Invalid deadband for {prefix.strip()} in DELTA_DEADBANDS, ignoring")
+    state_encoding = os.environ.get('STATE_ENCODING', 'json').lower()
+    if state_encoding not in ('json', 'compact'):
+        print("Invalid STATE_ENCODING, defaulting to json")
+        state_encoding = 'json'
+    if state_encoding == 'compact' and publish_mode != 'full':
+        print("STATE_ENCODING=compact only applies to PUBLISH_MODE=full, using json")
+        state_encoding = 'json'
+    try:
+        full_refresh_ticks = int(os.environ.get('FULL_REFRESH_TICKS', 30))
+    except ValueError:
+        print("Invalid FULL_REFRESH_TICKS, defaulting to 30")
+        full_refresh_ticks = 30
+
+    try:
+        collector_timeout = float(os.environ.get('COLLECTOR_TIMEOUT', 5))
+    except ValueError:
+        print("Invalid COLLECTOR_TIMEOUT, defaulting to 5s")
+        collector_timeout = 5
+    # A tick never waits longer than the update interval
+    collector_timeout = min(collector_timeout, interval)
+
+    try:
+        offline_bytes = int(os.environ.get('OFFLINE_BUFFER_BYTES', 1024 * 1024))
+        offline_spill_bytes = int(os.environ.get('OFFLINE_SPILL_BYTES', 16 * 1024 * 1024))
+    except ValueError:
+        print("Invalid OFFLINE_BUFFER_BYTES or OFFLINE_SPILL_BYTES, using defaults")
+        offline_bytes = 1024 * 1024
+        offline_spill_bytes = 16 * 1024 * 1024
+    offline_spill_dir = os.environ.get('OFFLINE_SPILL_DIR')
+
+    # Network interface filters, comma-separated fnmatch patterns
+    net_include = [p.strip() for p in os.environ.get('NET_INCLUDE', '').split(',') if p.strip()]
+    net_exclude = os.environ.get('NET_EXCLUDE')
+    if net_exclude is None:
+        net_exclude = DEFAULT_NET_EXCLUDE
+    else:
+        net_exclude = [p.strip() for p in net_exclude.split(',') if p.strip()]
+
+    try:
+        statvfs_timeout = float(os.environ.get('DISK_STATVFS_TIMEOUT', 2))
+    except ValueError:
+        print("Invalid DISK_STATVFS_TIMEOUT, defaulting to 2s")
+        statvfs_timeout = 2
+
+    # Per-container stats from the cgroup v2 hierarchy
+    cgroup_root = None
+    if os.environ.get('CONTAINER_STATS', 'false').lower() in ('1', 'true', 'yes'):
+        cgroup_root = os.environ.get('CGROUP_ROOT', '/sys/fs/cgroup')
+
+    # Top-N processes by CPU and memory (0 disables the collector)
+    try:
+        top_processes = int(os.environ.get('TOP_PROCESSES', 0))
+    except ValueError:
+        print("Invalid TOP_PROCESSES, disabling the process collector")
+        top_processes = 0
+    try:
+        process_rescan_interval = float(os.environ.get('PROCESS_RESCAN_INTERVAL', 30))
+    except ValueError:
+        print("Invalid PROCESS_RESCAN_INTERVAL, defaulting to 30s")
+        process_rescan_interval = 30
+
+    try:
+        diagnostics_interval = float(os.environ.get('DIAGNOSTICS_INTERVAL', 60))
+    except ValueError:
+        print("Invalid DIAGNOSTICS_INTERVAL, defaulting to 60s")
+        diagnostics_interval = 60
+
+    try:
+        prometheus_port = int(os.environ.get('PROMETHEUS_PORT', 0))
+    except ValueError:
+        print("Invalid PROMETHEUS_PORT, disabling the Prometheus exporter")
+        prometheus_port = 0
+    prometheus_host = os.environ.get('PROMETHEUS_HOST', '')
 
     device_name = os.environ.get('DEVICE_NAME', socket.gethostname())
 
     print(f"Starting System Monitor for device: {device_name}")
     print(f"Connecting to MQTT Broker: {broker}:{port}")
 
+    profile.mark('config')
+
     # Initialize Monitor and MQTT Client
-    monitor = SystemMonitor()
-    client = MQTTClient(broker, port, username, password, device_name)
-
-    # Allow some time for connection
-    time.sleep(2)
-
-    # Initial Fetch to register sensors
-    print("Performing initial discovery...")
-    # First call initializes state but might miss rates (CPU power)
-    monitor.get_stats() 
-    time.sleep(1) # Sleep briefly to allow rate calculation on next call
-    initial_stats = monitor.get_stats()
-    client.publish_discovery(initial_stats)
-    
-    # Main Loop
-    print(f"Starting main loop with interval: {interval}s")
-    while True:
+    monitor = SystemMonitor(hardware_rescan_interval=rescan_interval, collector_intervals=collector_intervals,
+                            net_include=net_include, net_exclude=net_exclude,
+                            statvfs_timeout=statvfs_timeout, cgroup_root=cgroup_root,
+                            top_processes=top_processes, process_rescan_interval=process_rescan_interval,
+                            collector_timeout=collector_timeout, collector_timeouts=collector_timeouts,
+                            collector_workers=collector_workers, energy_poll_interval=energy_poll_interval)
+    history = None
+    history_dir = os.environ.get('HISTORY_DIR')
+    if history_dir:
+        from history import HistoryStore
         try:
-            stats = monitor.get_stats()
-            client.publish_update(stats)
-        except Exception as e:
-            print(f"Error in main loop: {e}")
-        
-        time.sleep(interval)
+            history_max_metrics = int(os.environ.get('HISTORY_MAX_METRICS', 256))
+            history_prune_after = float(os.environ.get('HISTORY_PRUNE_AFTER', 86400))
+        except ValueError:
+            print("Invalid HISTORY_MAX_METRICS or HISTORY_PRUNE_AFTER, using defaults")
+            history_max_metrics = 256
+            history_prune_after = 86400
+        history = HistoryStore(history_dir, max_metrics=history_max_metrics, prune_after=history_prune_after)
+        state = history.load_state()
+        if state and monitor.import_state(state):
+            print(f"Restored counters from {history_dir}, rates resume on the first update")
+    profile.mark('monitor')
+    offline_buffer = None
+    if offline_bytes > 0:
+        offline_buffer = OfflineBuffer(offline_bytes, offline_spill_dir, offline_spill_bytes)
+    client = MQTTClient(broker, port, username, password, device_name,
+                        publish_mode=publish_mode, deadband=deadband, deadbands=deadbands,
+                        full_refresh_ticks=full_refresh_ticks, describe_metric=describe_metric,
+                        describe_device=monitor.describe_device, offline_buffer=offline_buffer,
+                        state_encoding=state_encoding)
+    profile.mark('mqtt_client')
+
+    sampler = None
+    if 0 < sample_interval < interval:
+        from sampler import Sampler
+        # Keep twice the samples of one publish interval in the ring buffer
+        capacity = max(2, math.ceil(interval / sample_interval) * 2)
+        sampler = Sampler(monitor, sample_interval, capacity, aggregate_prefixes)
+        print(f"Sampling every {sample_interval}s, publishing aggregates every {interval}s")
+
+    exporter = None
+    if prometheus_port:
+        from exporter import PrometheusExporter
+        exporter = PrometheusExporter(prometheus_port, prometheus_host, describe_metric=describe_metric,
+                                      label_rules=METRIC_LABELS, diagnostics=monitor.diagnostics)
+        exporter.start()
+        print(f"Serving Prometheus metrics on port {prometheus_port}")
+
+    asyncio.run(run(monitor, client, sampler, interval, collector_timeout,
+                    diagnostics_interval=diagnostics_interval, exporter=exporter,
+                    profile=profile, print_profile=print_profile, history=history))
+    if exporter:
+        exporter.stop()
 
 if __name__ == "__main__":
     main()
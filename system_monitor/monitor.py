@@ -1,66 +1,364 @@
 import platform
 import psutil
 import os
-import glob
+import re
 import time
+import fnmatch
+from array import array
+from types import SimpleNamespace
+from hardware import HardwareRegistry, has_nvidia_gpu
+from sysfs import SysfsReader, DEVICE_GONE_ERRNOS
+from collectors import CollectorScheduler, DEFAULT_WORKERS, STALE_KEY, counter_delta
+from procstat import ProcStat
+from disks import DiskUsage, DiskIO
+from diagnostics import Diagnostics
+from energy import EnergyCounters
+
+# Default seconds between runs per collector, 0 runs on every tick.
+# Boot time never changes and disk usage barely moves.
+DEFAULT_COLLECTOR_INTERVALS = {
+    'cpu': 0,
+    'memory': 0,
+    'disk': 60,
+    'disk_io': 0,
+    'network': 0,
+    'system': 60,
+    'gpu': 0,
+    'containers': 0,
+    'processes': 0,
+}
+
+# Home Assistant metadata for the metrics the collectors produce:
+# (key pattern, unit_of_measurement, device_class, state_class)
+METRICS = [
+    # cpu
+    (r'cpu_usage_percent', '%', None, 'measurement'),
+    (r'cpu_core_\d+_usage_percent', '%', None, 'measurement'),
+    (r'cpu_(user|system|iowait|steal)_percent', '%', None, 'measurement'),
+    (r'cpu_freq_current', 'MHz', 'frequency', 'measurement'),
+    (r'load_(1m|5m|15m)', None, None, 'measurement'),
+    (r'cpu_temp(_.+)?', '°C', 'temperature', 'measurement'),
+    (r'cpu_power_.+_watts', 'W', 'power', 'measurement'),
+    (r'cpu_energy_.+_kwh', 'kWh', 'energy', 'total_increasing'),
+    # memory
+    (r'memory_(total|used|free)_mb', 'MB', 'data_size', 'measurement'),
+    (r'(memory|swap)_percent', '%', None, 'measurement'),
+    # disk
+    (r'disk_.+_usage_percent', '%', None, 'measurement'),
+    (r'disk_.+_free_gb', 'GB', 'data_size', 'measurement'),
+    (r'disk_.+_(read|write)_bytes_per_s', 'B/s', 'data_rate', 'measurement'),
+    (r'disk_.+_(read|write)_iops', 'IOPS', None, 'measurement'),
+    (r'disk_.+_util_percent', '%', None, 'measurement'),
+    # network
+    (r'net_bytes_(sent|recv)_mb', 'MB', 'data_size', 'total_increasing'),
+    (r'net_(.+_)?(rx|tx)_bytes_per_s', 'B/s', 'data_rate', 'measurement'),
+    (r'net_.+_(rx|tx)_packets_per_s', 'packets/s', None, 'measurement'),
+    (r'net_.+_(errors|drops)_per_s', 'packets/s', None, 'measurement'),
+    # system
+    (r'boot_time', None, None, None),
+    (r'uptime_seconds', 's', 'duration', 'total_increasing'),
+    # gpu
+    (r'gpu_(nvidia_\d+|amd_.+)_usage_percent', '%', None, 'measurement'),
+    (r'gpu_nvidia_\d+_memory_percent', '%', None, 'measurement'),
+    (r'gpu_nvidia_\d+_memory_total_mb', 'MB', 'data_size', 'measurement'),
+    (r'gpu_nvidia_\d+_power_limit_watts', 'W', 'power', 'measurement'),
+    (r'gpu_(nvidia_\d+|amd_.+)_temp_c', '°C', 'temperature', 'measurement'),
+    (r'gpu_(nvidia_\d+|amd_.+)_power_watts', 'W', 'power', 'measurement'),
+    (r'gpu_intel_.+_freq_mhz', 'MHz', 'frequency', 'measurement'),
+    # containers
+    (r'container_[0-9a-f]{12}_cpu(_throttled)?_percent', '%', None, 'measurement'),
+    (r'container_[0-9a-f]{12}_memory(_anon|_file)?_mb', 'MB', 'data_size', 'measurement'),
+    (r'container_[0-9a-f]{12}_(read|write)_bytes_per_s', 'B/s', 'data_rate', 'measurement'),
+    # processes
+    (r'process_count', None, None, 'measurement'),
+    (r'process_top_cpu_percent', '%', None, 'measurement'),
+    (r'process_top_rss_mb', 'MB', 'data_size', 'measurement'),
+    # agent (sampler and MQTT client)
+    (r'collectors_stale', None, None, 'measurement'),
+    (r'sampler_(samples|overruns)', None, None, 'measurement'),
+    (r'sampler_(jitter|tick)_ms_(mean|max)', 'ms', 'duration', 'measurement'),
+    (r'mqtt_publish_messages', None, None, 'measurement'),
+    (r'mqtt_publish_bytes', 'B', 'data_size', 'measurement'),
+    (r'mqtt_offline_queued', None, None, 'measurement'),
+    (r'mqtt_offline_dropped', None, None, 'total_increasing'),
+    # diagnostics (the monitor's own overhead)
+    (r'diag_(collector_.+|tick|publish)_ms_(mean|p95|max)', 'ms', 'duration', 'measurement'),
+    (r'diag_startup_ms', 'ms', 'duration', 'measurement'),
+    (r'diag_errors_.+', None, None, 'total_increasing'),
+    (r'diag_(ticks|tick_overruns)', None, None, 'total_increasing'),
+    (r'diag_rss_mb', 'MB', 'data_size', 'measurement'),
+    (r'diag_cpu_percent', '%', None, 'measurement'),
+    (r'diag_threads', None, None, 'measurement'),
+]
+_METRIC_PATTERNS = [(re.compile(pattern), unit, device_class, state_class)
+                    for pattern, unit, device_class, state_class in METRICS]
+# Suffixes added by the sampler's aggregates, described like their base metric
+_AGGREGATE_SUFFIX = re.compile(r'_(min|max|mean)$')
+
+def describe_metric(key):
+    """
+    Returns the Home Assistant fields (unit_of_measurement, device_class,
+    state_class) for a metric key, or None if the key isn't declared.
+    """
+    for candidate in (key, _AGGREGATE_SUFFIX.sub('', key)):
+        for pattern, unit, device_class, state_class in _METRIC_PATTERNS:
+            if pattern.fullmatch(candidate):
+                return {
+                    'unit_of_measurement': unit,
+                    'device_class': device_class,
+                    'state_class': state_class,
+                }
+    return None
+
+# Prometheus names for the flattened keys: (key pattern, metric name, fixed
+# labels). Named groups become labels, except "metric" which is substituted
+# into the name. Keys without a rule are exported under their own name.
+METRIC_LABELS = [
+    (r'cpu_core_(?P<core>\d+)_usage_percent', 'cpu_core_usage_percent', {}),
+    (r'cpu_power_(?P<domain>.+)_watts', 'cpu_power_watts', {}),
+    (r'cpu_energy_(?P<domain>.+)_kwh', 'cpu_energy_kwh', {}),
+    # Own families, apart from the unlabelled cpu_temp and host totals
+    (r'cpu_temp_(?P<sensor>.+)', 'cpu_sensor_temp', {}),
+    (r'net_(?P<metric>(rx|tx)_bytes_per_s)', 'net_total_{metric}', {}),
+    (r'disk_(?P<device>.+)_(?P<metric>(read|write)_bytes_per_s|(read|write)_iops|util_percent)', 'disk_{metric}', {}),
+    (r'disk_(?P<mount>.+)_(?P<metric>usage_percent|free_gb)', 'disk_{metric}', {}),
+    (r'net_(?P<interface>.+)_(?P<metric>(rx|tx)_(bytes|packets)_per_s|errors_per_s|drops_per_s)', 'net_{metric}', {}),
+    (r'gpu_nvidia_(?P<gpu>\d+)_(?P<metric>.+)', 'gpu_{metric}', {'vendor': 'nvidia'}),
+    (r'gpu_(?P<vendor>amd|intel)_(?P<card>card\d+)_(?P<metric>.+)', 'gpu_{metric}', {}),
+    (r'container_(?P<container>[0-9a-f]{12})_(?P<metric>.+)', 'container_{metric}', {}),
+]
+
+# Per-container keys, published as their own Home Assistant devices
+_CONTAINER_KEY = re.compile(r'container_([0-9a-f]{12})_')
+
+# Architectures with RAPL and discrete GPU collectors
+X86_ARCHS = ('x86_64', 'i686')
+
+# Interfaces skipped by default: loopback and per-container virtual links
+DEFAULT_NET_EXCLUDE = ('lo', 'veth*', 'docker*', 'br-*', 'virbr*')
+
+# Network counters from psutil: (counter fields, key suffix) per published rate
+NET_RATES = (
+    (('bytes_recv',), 'rx_bytes_per_s'),
+    (('bytes_sent',), 'tx_bytes_per_s'),
+    (('packets_recv',), 'rx_packets_per_s'),
+    (('packets_sent',), 'tx_packets_per_s'),
+    (('errin', 'errout'), 'errors_per_s'),
+    (('dropin', 'dropout'), 'drops_per_s'),
+)
 
 class SystemMonitor:
-    def __init__(self):
+    def __init__(self, sysfs_root='/sys', hardware_rescan_interval=300, collector_intervals=None,
+                 proc_root='/proc', net_include=None, net_exclude=DEFAULT_NET_EXCLUDE,
+                 statvfs_timeout=2.0, cgroup_root=None,
+                 top_processes=0, process_rescan_interval=30,
+                 collector_timeout=None, collector_timeouts=None, collector_workers=DEFAULT_WORKERS,
+                 energy_poll_interval=0):
         self.os_type = platform.system()
         self.arch = platform.machine()
+        self.proc_root = proc_root
+        # Collector timings and errors that would otherwise be swallowed
+        self.diagnostics = Diagnostics()
+
+        # Linux fast path: all CPU usage from a single /proc/stat read
+        self.procstat = None
+        if self.os_type == 'Linux' and os.path.exists(os.path.join(proc_root, 'stat')):
+            self.procstat = ProcStat(os.path.join(proc_root, 'stat'))
+
+        # Sysfs sensor paths are discovered once and reused on every tick
+        self.hardware = HardwareRegistry(sysfs_root, hardware_rescan_interval)
+        # Hot counters stay open and are re-read with pread()
+        self.sysfs = SysfsReader()
         
-        # State for rate calculations (CPU Power)
-        self.last_check_time = time.time()
-        self.last_cpu_energy = {} # {package_path: energy_uj_value}
+        # Usage of real mounts and per-device I/O rates, psutil on '/' otherwise
+        self.disk_usage = DiskUsage(proc_root, statvfs_timeout, hardware_rescan_interval, self.diagnostics)
+        if not self.disk_usage.available():
+            self.disk_usage = None
+        self.disk_io = DiskIO(proc_root, sysfs_root, hardware_rescan_interval)
+        if not self.disk_io.available():
+            self.disk_io = None
 
-        # Initialize NVIDIA stats if possible
-        self.nvml_initialized = False
-        try:
-            import pynvml
-            pynvml.nvmlInit()
-            self.nvml_initialized = True
-            self.pynvml = pynvml
-        except ImportError:
-            pass
-        except Exception:
-            pass
+        # Per-container stats from cgroup v2, only when a cgroup_root is given
+        self.containers = None
+        if cgroup_root:
+            from cgroups import ContainerCgroups
+            self.containers = ContainerCgroups(cgroup_root, diagnostics=self.diagnostics)
+            if not self.containers.available():
+                print(f"No cgroup v2 hierarchy at {cgroup_root}, container stats disabled")
+                self.containers = None
+
+        # Top-N processes by CPU and memory, only when top_processes > 0
+        self.processes = None
+        if top_processes > 0:
+            from processes import TopProcesses
+            self.processes = TopProcesses(proc_root, top_processes, process_rescan_interval)
+            if not self.processes.available():
+                self.processes = None
+
+        # CPU power and energy (x86 Linux RAPL or amd_energy). Polled between
+        # collector runs every energy_poll_interval seconds if set, so a long
+        # cpu interval can't miss a counter wrapping twice.
+        self.energy = EnergyCounters(self.hardware.invalidate, self.diagnostics)
+        if energy_poll_interval > 0 and self.os_type == 'Linux' and self.arch in X86_ARCHS:
+            self.energy.start(energy_poll_interval)
+
+        # Network interface filter (fnmatch patterns, empty include means all)
+        self.net_include = tuple(net_include or ())
+        self.net_exclude = tuple(net_exclude or ())
+        self.last_net_counters = {} # {interface: psutil snetio}
+        self._net_keys = {} # {interface: [key per NET_RATES entry]}, None if filtered out
+
+        # NVML is only loaded where the GPU collector reads it (x86) and an
+        # NVIDIA GPU was detected, it costs startup time and memory
+        self.nvidia = None
+        if self.arch in X86_ARCHS and has_nvidia_gpu(sysfs_root, proc_root):
+            try:
+                import pynvml
+                from nvidia import NvidiaGPUs
+                pynvml.nvmlInit()
+                self.nvidia = NvidiaGPUs(pynvml, self.diagnostics)
+            except ImportError:
+                pass
+            except Exception as e:
+                # GPU present but no usable driver
+                self.diagnostics.record_error('nvidia_init', e)
+
+        # Each collector runs on its own interval, results of the others are cached
+        intervals = dict(DEFAULT_COLLECTOR_INTERVALS)
+        if collector_intervals:
+            intervals.update(collector_intervals)
+        # Collectors run concurrently, one that misses its deadline (default
+        # collector_timeout, per collector in collector_timeouts) is reported
+        # with its previous values
+        self.collectors = CollectorScheduler(self.diagnostics, collector_workers, collector_timeout)
+        self.collectors.register('cpu', self._get_cpu_stats, intervals['cpu'], cost=2, rate=True)
+        self.collectors.register('memory', self._get_memory_stats, intervals['memory'], cost=1)
+        self.collectors.register('disk', self._get_disk_stats, intervals['disk'], cost=2)
+        self.collectors.register('disk_io', self._get_disk_io_stats, intervals['disk_io'], cost=1, rate=True)
+        self.collectors.register('network', self._get_network_stats, intervals['network'], cost=1, rate=True)
+        self.collectors.register('system', self._get_system_stats, intervals['system'], cost=1)
+        self.collectors.register('gpu', self._get_gpu_stats, intervals['gpu'], cost=3)
+        if self.containers:
+            self.collectors.register('containers', self._get_container_stats, intervals['containers'],
+                                     cost=3, rate=True)
+        if self.processes:
+            self.collectors.register('processes', self._get_process_stats, intervals['processes'],
+                                     cost=3, rate=True)
+        for name, timeout in (collector_timeouts or {}).items():
+            if name in self.collectors.collectors:
+                self.collectors.collectors[name].timeout = timeout
 
     def get_stats(self):
-        stats = {}
-        # Calculate time delta for rates
         current_time = time.time()
-        time_delta = current_time - self.last_check_time
-        
-        # We need at least a small delta to calculate rates correctly
-        # If called too fast, we might skip update or use tiny delta
-        if time_delta <= 0:
-            time_delta = 0.001
-
-        stats.update(self._get_cpu_stats(time_delta))
-        stats.update(self._get_memory_stats())
-        stats.update(self._get_disk_stats())
-        stats.update(self._get_network_stats())
-        stats.update(self._get_system_stats())
-        stats.update(self._get_gpu_stats())
-        
-        self.last_check_time = current_time
-        return stats
+        self.refresh_hardware(current_time)
+        self.collectors.run_due(current_time)
+        return self.collectors.snapshot(count_stale=True)
+
+    def refresh_hardware(self, now=None):
+        """
+        Rescans sysfs sensors if the registry is stale or was invalidated.
+        """
+        if self.hardware.refresh(now):
+            self.sysfs.retain(self.hardware.paths())
+            self.energy.set_domains(self.hardware.energy_domains)
+
+    def rescan_hardware(self):
+        """
+        Rediscovers sysfs sensors immediately, e.g. after a GPU hotplug.
+        """
+        self.hardware.scan()
+        self.hardware.last_scan = time.time()
+        self.sysfs.retain(self.hardware.paths())
+        self.energy.set_domains(self.hardware.energy_domains)
+
+    def close(self):
+        """
+        Stops the collector and energy threads and releases the files and
+        NVML handle held between samples.
+        """
+        self.collectors.close()
+        self.energy.stop()
+        self.energy.set_domains([])
+        self.sysfs.close()
+        for collector in (self.procstat, self.disk_io, self.containers, self.processes, self.nvidia):
+            if collector:
+                collector.close()
+
+    def boot_id(self):
+        try:
+            with open(os.path.join(self.proc_root, 'sys/kernel/random/boot_id')) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def export_state(self):
+        """
+        Returns the counter snapshots of the rate collectors (CPU jiffies,
+        RAPL energy, network and disk counters) and when each collector took
+        them, as a JSON-serializable dict for import_state().
+        """
+        energy, energy_total = self.energy.export_state()
+        state = {
+            'boot_id': self.boot_id(),
+            'time': time.time(),
+            'collectors': {name: collector.last_run for name, collector in self.collectors.collectors.items()
+                           if collector.rate and collector.last_run is not None},
+            'cpu_energy': energy,
+            'cpu_energy_total': energy_total,
+            'net': {nic: {field: getattr(counters, field) for fields, _ in NET_RATES for field in fields}
+                    for nic, counters in list(self.last_net_counters.items())},
+        }
+        if self.procstat and self.procstat.previous is not None:
+            state['procstat'] = {'labels': list(self.procstat.labels), 'jiffies': list(self.procstat.previous)}
+        if self.disk_io:
+            state['disk_io'] = {name: list(counters) for name, counters in self.disk_io.previous.items()}
+        return state
+
+    def import_state(self, state, max_age=600):
+        """
+        Restores counters saved by export_state() so rates are reported from
+        the first tick, averaged since the snapshot. Returns False (and
+        restores nothing) if the host rebooted since, which resets the
+        counters, or the snapshot is older than max_age seconds.
+        """
+        boot_id = self.boot_id()
+        age = time.time() - state.get('time', 0)
+        if boot_id is None or state.get('boot_id') != boot_id or not 0 <= age <= max_age:
+            return False
+        for name, last_run in state.get('collectors', {}).items():
+            collector = self.collectors.collectors.get(name)
+            if collector is not None and collector.rate:
+                collector.last_run = last_run
+        self.energy.import_state(state.get('cpu_energy', {}), state.get('cpu_energy_total'))
+        for nic, counters in state.get('net', {}).items():
+            self.last_net_counters[nic] = SimpleNamespace(**counters)
+        procstat = state.get('procstat')
+        if self.procstat and procstat:
+            self.procstat.labels = tuple(procstat['labels'])
+            self.procstat.previous = array('Q', procstat['jiffies'])
+        if self.disk_io:
+            for name, counters in state.get('disk_io', {}).items():
+                self.disk_io.previous[name] = tuple(counters)
+        return True
 
     def _get_cpu_stats(self, time_delta):
         data = {}
         # Usage
-        data['cpu_usage_percent'] = psutil.cpu_percent(interval=None)
-        per_core = psutil.cpu_percent(interval=None, percpu=True)
-        for i, p in enumerate(per_core):
-            data[f'cpu_core_{i}_usage_percent'] = p
+        if self.procstat:
+            data.update(self.procstat.sample())
+        else:
+            data['cpu_usage_percent'] = psutil.cpu_percent(interval=None)
+            per_core = psutil.cpu_percent(interval=None, percpu=True)
+            for i, p in enumerate(per_core):
+                data[f'cpu_core_{i}_usage_percent'] = p
         
         # Frequency
         try:
             freq = psutil.cpu_freq()
             if freq:
                 data['cpu_freq_current'] = freq.current
-        except Exception:
-            pass
+        except Exception as e:
+            self.diagnostics.record_error('cpu_freq', e)
 
         # Load
         if hasattr(os, 'getloadavg'):
@@ -71,45 +369,22 @@ class SystemMonitor:
 
         # Temp (Linux only usually)
         if self.os_type == 'Linux':
-            temps = psutil.sensors_temperatures()
-            if 'coretemp' in temps:
-                for entry in temps['coretemp']:
-                    if entry.label:
-                        data[f'cpu_temp_{entry.label}'] = entry.current
-                    else:
-                        data['cpu_temp'] = entry.current
-            elif 'cpu_thermal' in temps: # Raspberry Pi often
-                 data['cpu_temp'] = temps['cpu_thermal'][0].current
-
-        # Power (x86 Linux RAPL)
-        if self.os_type == 'Linux' and self.arch in ['x86_64', 'i686']:
-            rapl_path = '/sys/class/powercap/intel-rapl'
-            if os.path.exists(rapl_path):
-                # Iterate over packages
-                packages = glob.glob(os.path.join(rapl_path, 'intel-rapl:*'))
-                for pkg in packages:
-                    name_file = os.path.join(pkg, 'name')
-                    energy_file = os.path.join(pkg, 'energy_uj')
-                    if os.path.exists(name_file) and os.path.exists(energy_file):
-                        try:
-                            with open(name_file, 'r') as f:
-                                name = f.read().strip()
-                            with open(energy_file, 'r') as f:
-                                energy_uj = int(f.read().strip())
-                            
-                            # Calculate Watts if we have previous data
-                            if pkg in self.last_cpu_energy:
-                                diff_uj = energy_uj - self.last_cpu_energy[pkg]
-                                # Handle wrap-around if necessary (though unlikely for 64bit counters in short intervals)
-                                if diff_uj >= 0:
-                                    power_watts = (diff_uj / 1_000_000.0) / time_delta
-                                    data[f'cpu_power_{name}_watts'] = round(power_watts, 2)
-                            
-                            # Update state
-                            self.last_cpu_energy[pkg] = energy_uj
-
-                        except Exception:
-                            pass
+            try:
+                temps = psutil.sensors_temperatures()
+                if 'coretemp' in temps:
+                    for entry in temps['coretemp']:
+                        if entry.label:
+                            data[f'cpu_temp_{entry.label}'] = entry.current
+                        else:
+                            data['cpu_temp'] = entry.current
+                elif 'cpu_thermal' in temps: # Raspberry Pi often
+                     data['cpu_temp'] = temps['cpu_thermal'][0].current
+            except Exception as e:
+                self.diagnostics.record_error('cpu_temp', e)
+
+        # Power and accumulated energy (x86 Linux RAPL or amd_energy)
+        if self.os_type == 'Linux' and self.arch in X86_ARCHS:
+            data.update(self.energy.sample(time_delta))
         
         return data
 
@@ -125,22 +400,115 @@ class SystemMonitor:
         }
 
     def _get_disk_stats(self):
+        if self.disk_usage:
+            return self.disk_usage.sample()
         data = {}
         try:
             usage = psutil.disk_usage('/')
             data['disk_root_usage_percent'] = usage.percent
             data['disk_root_free_gb'] = usage.free // 1024 // 1024 // 1024
-        except Exception:
-            pass
+        except Exception as e:
+            self.diagnostics.record_error('disk', e)
         return data
 
-    def _get_network_stats(self):
+    def _get_disk_io_stats(self, time_delta):
+        if self.disk_io:
+            return self.disk_io.sample(time_delta)
+        return {}
+
+    def _get_container_stats(self, time_delta):
+        return self.containers.sample(time_delta)
+
+    def _get_process_stats(self, time_delta):
+        return self.processes.sample(time_delta)
+
+    def attributes(self):
+        """
+        Returns {key: JSON attributes} for metrics that carry more than their
+        value, e.g. the process lists behind process_top_cpu_percent.
+        """
+        stale = {'collectors': self.collectors.stale()}
+        if self.disk_usage:
+            stale['mounts'] = list(self.disk_usage.stale)
+        attributes = {STALE_KEY: stale}
+        if self.processes:
+            attributes.update(self.processes.attributes)
+        return attributes
+
+    def describe_device(self, key):
+        """
+        Returns the Home Assistant device (id, name, model) a per-container
+        key belongs to, or None for metrics of the host itself.
+        """
+        match = _CONTAINER_KEY.match(key)
+        if not match:
+            return None
+        label = match.group(1)
+        runtime = self.containers.runtime(label) if self.containers else None
+        return {
+            'id': f'container_{label}',
+            'name': f'Container {label}',
+            'model': f'{runtime} container' if runtime else 'Container',
+        }
+
+    def _get_network_stats(self, time_delta):
         data = {}
         net = psutil.net_io_counters()
         data['net_bytes_sent_mb'] = net.bytes_sent // 1024 // 1024
         data['net_bytes_recv_mb'] = net.bytes_recv // 1024 // 1024
+
+        # Per-interface rates from counter deltas
+        totals = {'rx_bytes_per_s': 0.0, 'tx_bytes_per_s': 0.0}
+        rated = False
+        counters = psutil.net_io_counters(pernic=True)
+        for nic, current in counters.items():
+            keys = self._net_interface_keys(nic)
+            if keys is None:
+                continue
+            previous = self.last_net_counters.get(nic)
+            self.last_net_counters[nic] = current
+            if previous is None:
+                continue
+            diffs = [counter_delta(getattr(previous, field), getattr(current, field))
+                     for fields, _ in NET_RATES for field in fields]
+            if min(diffs) < 0:
+                # Interface was reset, rates resume on the next tick
+                continue
+            rated = True
+            diffs = iter(diffs)
+            for (fields, suffix), key in zip(NET_RATES, keys):
+                rate = sum(next(diffs) for _ in fields) / time_delta
+                data[key] = round(rate, 2)
+                if suffix in totals:
+                    totals[suffix] += rate
+
+        # Forget interfaces that went away (container veths come and go)
+        for nic in [n for n in self.last_net_counters if n not in counters]:
+            del self.last_net_counters[nic]
+        if len(self._net_keys) > len(counters):
+            self._net_keys = {nic: keys for nic, keys in self._net_keys.items() if nic in counters}
+
+        # Totals only once there is a rate to sum, not a 0 before the second sample
+        if rated:
+            data['net_rx_bytes_per_s'] = round(totals['rx_bytes_per_s'], 2)
+            data['net_tx_bytes_per_s'] = round(totals['tx_bytes_per_s'], 2)
         return data
 
+    def _net_interface_keys(self, nic):
+        """
+        Returns the metric keys for an interface, or None if it is filtered
+        out. Built once per interface name.
+        """
+        if nic in self._net_keys:
+            return self._net_keys[nic]
+        keys = None
+        included = not self.net_include or any(fnmatch.fnmatch(nic, p) for p in self.net_include)
+        if included and not any(fnmatch.fnmatch(nic, p) for p in self.net_exclude):
+            name = re.sub(r'[^a-zA-Z0-9_]', '_', nic)
+            keys = [f'net_{name}_{suffix}' for _, suffix in NET_RATES]
+        self._net_keys[nic] = keys
+        return keys
+
     def _get_system_stats(self):
         return {
             'boot_time': int(psutil.boot_time()),
@@ -150,93 +518,54 @@ class SystemMonitor:
     def _get_gpu_stats(self):
         data = {}
         # ARM: Skip
-        if self.arch not in ['x86_64', 'i686']:
+        if self.arch not in X86_ARCHS:
             return data
 
         # NVIDIA
-        if self.nvml_initialized:
-            try:
-                device_count = self.pynvml.nvmlDeviceGetCount()
-                for i in range(device_count):
-                    handle = self.pynvml.nvmlDeviceGetHandleByIndex(i)
-                    name = self.pynvml.nvmlDeviceGetName(handle)
-                    if isinstance(name, bytes):
-                        name = name.decode('utf-8')
-                    util = self.pynvml.nvmlDeviceGetUtilizationRates(handle)
-                    mem = self.pynvml.nvmlDeviceGetMemoryInfo(handle)
-                    temp = self.pynvml.nvmlDeviceGetTemperature(handle, 0)
-                    try:
-                        power = self.pynvml.nvmlDeviceGetPowerUsage(handle) / 1000.0 # mW to W
-                        data[f'gpu_nvidia_{i}_power_watts'] = power
-                    except Exception:
-                        pass
-                    
-                    data[f'gpu_nvidia_{i}_usage_percent'] = util.gpu
-                    data[f'gpu_nvidia_{i}_memory_percent'] = (mem.used / mem.total) * 100
-                    data[f'gpu_nvidia_{i}_temp_c'] = temp
-            except Exception:
-                pass
+        if self.nvidia:
+            data.update(self.nvidia.sample())
 
         # Intel (sysfs)
-        # Look for /sys/class/drm/card*/gt_act_freq_mhz
-        for path in glob.glob('/sys/class/drm/card*'):
-            try:
-                # Basic check if it is Intel
-                vendor_path = os.path.join(path, 'device/vendor')
-                if os.path.exists(vendor_path):
-                    with open(vendor_path, 'r') as f:
-                        vendor_id = f.read().strip()
-                    if vendor_id == '0x8086': # Intel
-                        card_name = os.path.basename(path)
-                        # Frequency
-                        freq_path = os.path.join(path, 'gt_act_freq_mhz')
-                        if os.path.exists(freq_path):
-                            with open(freq_path, 'r') as f:
-                                data[f'gpu_intel_{card_name}_freq_mhz'] = int(f.read().strip())
-                        # Attempt to find power/energy if available (often in rapl but specific)
-            except Exception:
-                pass
+        for gpu in self.hardware.intel_gpus:
+            freq = self._read_sysfs_int(gpu['freq'])
+            if freq is not None:
+                data[f'gpu_intel_{gpu["card"]}_freq_mhz'] = freq
+            # Attempt to find power/energy if available (often in rapl but specific)
 
         # AMD (sysfs)
-        # Look for /sys/class/drm/card*/device/gpu_busy_percent
-        for path in glob.glob('/sys/class/drm/card*'):
-            try:
-                vendor_path = os.path.join(path, 'device/vendor')
-                if os.path.exists(vendor_path):
-                    with open(vendor_path, 'r') as f:
-                        vendor_id = f.read().strip()
-                    if vendor_id == '0x1002': # AMD
-                        card_name = os.path.basename(path)
-                        # Usage
-                        busy_path = os.path.join(path, 'device/gpu_busy_percent')
-                        if os.path.exists(busy_path):
-                            with open(busy_path, 'r') as f:
-                                data[f'gpu_amd_{card_name}_usage_percent'] = int(f.read().strip())
-                        # Temp and Power (via hwmon)
-                        hwmon_dir = os.path.join(path, 'device/hwmon')
-                        if os.path.exists(hwmon_dir):
-                            for hwmon in glob.glob(os.path.join(hwmon_dir, 'hwmon*')):
-                                # Temp
-                                temp_input = os.path.join(hwmon, 'temp1_input')
-                                if os.path.exists(temp_input):
-                                    with open(temp_input, 'r') as f:
-                                        # Millidegree Celsius
-                                        data[f'gpu_amd_{card_name}_temp_c'] = int(f.read().strip()) / 1000.0
-                                
-                                # Power
-                                # Try power1_average first, then power1_input
-                                power_found = False
-                                for p_file in ['power1_average', 'power1_input']:
-                                    p_path = os.path.join(hwmon, p_file)
-                                    if os.path.exists(p_path):
-                                        with open(p_path, 'r') as f:
-                                            # Microwatts
-                                            val = int(f.read().strip())
-                                            data[f'gpu_amd_{card_name}_power_watts'] = val / 1_000_000.0
-                                            power_found = True
-                                            break
-
-            except Exception:
-                pass
+        for gpu in self.hardware.amd_gpus:
+            card_name = gpu['card']
+            if gpu['busy']:
+                busy = self._read_sysfs_int(gpu['busy'])
+                if busy is not None:
+                    data[f'gpu_amd_{card_name}_usage_percent'] = busy
+            if gpu['temp']:
+                # Millidegree Celsius
+                temp = self._read_sysfs_int(gpu['temp'])
+                if temp is not None:
+                    data[f'gpu_amd_{card_name}_temp_c'] = temp / 1000.0
+            if gpu['power']:
+                # Microwatts
+                power = self._read_sysfs_int(gpu['power'])
+                if power is not None:
+                    data[f'gpu_amd_{card_name}_power_watts'] = power / 1_000_000.0
 
         return data
+
+    def _read_sysfs_int(self, path):
+        """
+        Reads an integer sysfs attribute resolved by the hardware registry.
+        A missing file means the device went away, so a rescan is scheduled;
+        other errors are recorded and the read is retried on the next tick.
+        """
+        try:
+            return self.sysfs.read_int(path)
+        except OSError as e:
+            if e.errno in DEVICE_GONE_ERRNOS:
+                self.hardware.invalidate()
+            else:
+                self.diagnostics.record_error('sysfs', e)
+        except ValueError as e:
+            self.diagnostics.record_error('sysfs', e)
+        return None
+
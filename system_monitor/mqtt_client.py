@@ -1,24 +1,30 @@
 import json
+import time
+import threading
 import paho.mqtt.client as mqtt
 
 class MQTTClient:
-    def __init__(self, broker, port, username, password, device_name):
+    def __init__(self, broker, port, username, password, device_name,
+                 publish_mode='full', deadband=(0.0, 0.0), deadbands=None, full_refresh_ticks=0,
+                 describe_metric=None, describe_device=None, removal_ticks=3,
+                 offline_buffer=None, replay_batch_size=50, replay_batches=5,
+                 state_encoding='json'):
         self.client = mqtt.Client()
         if username and password:
             self.client.username_pw_set(username, password)
-        self.client.connect(broker, port)
+        # Set by the network thread once the broker accepted the connection
+        self.connected = threading.Event()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        # Connect in the network thread so startup doesn't block on the broker
+        self.client.connect_async(broker, port)
         self.client.loop_start()
         self.device_name = device_name
         self.discovery_prefix = "homeassistant"
         
         # Sanitize device name for IDs
         self.device_id = device_name.lower().replace(" ", "_")
-
-    def publish_discovery(self, sensor_data):
-        """
-        Publishes MQTT Auto Discovery config for each sensor key found in sensor_data.
-        """
-        device_info = {
+        self.device_info = {
             "identifiers": [self.device_id],
             "name": self.device_name,
             "manufacturer": "Custom System Monitor",
@@ -26,58 +32,368 @@ class MQTTClient:
             "sw_version": "1.0"
         }
 
-        for key, value in sensor_data.items():
-            # Infer sensor type/unit based on key name
-            unit_of_measurement = None
-            device_class = None
-            state_class = "measurement" # Default to measurement
-            
-            if "_percent" in key:
-                unit_of_measurement = "%"
-                # If usage, maybe not a specific device class, but fine
-            elif "_mb" in key:
-                unit_of_measurement = "MB"
-                device_class = "data_size"
-            elif "_gb" in key:
-                unit_of_measurement = "GB"
-                device_class = "data_size"
-            elif "_c" in key or "_temp" in key:
-                unit_of_measurement = "°C"
-                device_class = "temperature"
-            elif "_watts" in key:
-                unit_of_measurement = "W"
-                device_class = "power"
-            elif "_freq" in key:
-                unit_of_measurement = "MHz"
-                device_class = "frequency"
-            elif "uptime" in key:
-                unit_of_measurement = "s"
-                device_class = "duration"
-                state_class = "total_increasing"
-
-            unique_id = f"{self.device_id}_{key}"
-            config_topic = f"{self.discovery_prefix}/sensor/{self.device_id}/{key}/config"
-            
-            payload = {
-                "name": f"{self.device_name} {key.replace('_', ' ').title()}",
-                "state_topic": f"{self.discovery_prefix}/sensor/{self.device_id}/state",
-                "value_template": f"{{{{ value_json.{key} }}}}",
-                "unique_id": unique_id,
-                "device": device_info
-            }
-            
-            if unit_of_measurement:
-                payload["unit_of_measurement"] = unit_of_measurement
-            if device_class:
-                payload["device_class"] = device_class
-            if state_class:
-                payload["state_class"] = state_class
-
-            self.client.publish(config_topic, json.dumps(payload), retain=True)
+        # Discovery index: keys with a published config, their cached
+        # payloads and how many updates a discovered key has been missing
+        self.describe_metric = describe_metric
+        # Returns {'id', 'name', 'model'} for keys that belong to a device
+        # behind this one (e.g. a container), None for the host's own metrics
+        self.describe_device = describe_device
+        self.removal_ticks = removal_ticks
+        self.discovered = set()
+        self.diagnostics_discovered = set()
+        # Keys whose entities read JSON attributes from the attributes topic
+        self.attribute_keys = set()
+        self._last_attributes = None
+        self._config_cache = {}
+        self._missing = {}
+
+        # 'full' publishes one JSON state per tick, 'delta' publishes only
+        # changed metrics to per-metric state topics
+        self.publish_mode = publish_mode
+        # Deadbands are (absolute, relative) thresholds, per key prefix in deadbands
+        self.deadband = deadband
+        self.deadbands = sorted((deadbands or {}).items(), key=lambda item: -len(item[0]))
+        self._deadband_cache = {}
+        # Publish every metric every N ticks in delta mode (0 = never)
+        self.full_refresh_ticks = full_refresh_ticks
+        self.last_published = {}
+        self.ticks = 0
+
+        # Publish counters for the most recent publish_update call
+        self.last_publish_messages = 0
+        self.last_publish_bytes = 0
+
+        # Store-and-forward for states published while the broker is down.
+        # They are replayed to the history topic in batches of
+        # replay_batch_size, at most replay_batches per flush_offline() call.
+        self.offline_buffer = offline_buffer
+        self.replay_batch_size = replay_batch_size
+        self.replay_batches = replay_batches
+        self._ever_connected = False
+        self._reconnected = False
+
+        # 'compact' publishes full-mode states as packed floats against a
+        # retained schema (see compact.py) instead of JSON
+        self.encoder = None
+        if state_encoding == 'compact':
+            from compact import CompactEncoder
+            self.encoder = CompactEncoder()
+        self._schema_published = False
+
+    def wait_connected(self, timeout=None):
+        """
+        Blocks until the broker connection is up. Returns False on timeout.
+        """
+        return self.connected.wait(timeout)
+
+    def disconnect(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            if self._ever_connected:
+                # The broker may have lost retained configs, republish them
+                self._reconnected = True
+            self._ever_connected = True
+            self.connected.set()
+        else:
+            print(f"MQTT connection refused: {rc}")
+
+    def _on_disconnect(self, client, userdata, *args):
+        self.connected.clear()
+
+    def publish_discovery(self, sensor_data):
+        """
+        Publishes MQTT Auto Discovery config for sensor keys that appeared
+        since the last call, and clears the config of keys that have been
+        missing for removal_ticks consecutive calls.
+        """
+        for key in sensor_data:
+            self._missing.pop(key, None)
+            if key not in self.discovered:
+                config_topic, payload = self._discovery_config(key, attributes=key in self.attribute_keys)
+                self.client.publish(config_topic, payload, retain=True)
+                self.discovered.add(key)
+
+        for key in [k for k in self.discovered if k not in sensor_data]:
+            self._missing[key] = self._missing.get(key, 0) + 1
+            if self._missing[key] >= self.removal_ticks:
+                # An empty retained config removes the entity
+                config_topic, _ = self._discovery_config(key)
+                self.client.publish(config_topic, "", retain=True)
+                self._forget(key)
+
+    def _forget(self, key):
+        # Containers get new keys on every restart, nothing of a removed
+        # key may be kept or the caches grow without bound
+        self.discovered.discard(key)
+        self._missing.pop(key, None)
+        self._config_cache.pop(key, None)
+        self._deadband_cache.pop(key, None)
+        self.last_published.pop(key, None)
+        self.attribute_keys.discard(key)
+
+    def publish_diagnostics(self, values, details=None):
+        """
+        Publishes the monitor's own diagnostics (see Diagnostics.collect) to
+        the diagnostics topic, discovered as diagnostic entities. details
+        become the JSON attributes of the key they belong to.
+        """
+        details = details or {}
+        for key in values:
+            if key not in self.diagnostics_discovered:
+                config_topic, payload = self._discovery_config(key, diagnostic=True,
+                                                               attributes=key in details)
+                self.client.publish(config_topic, payload, retain=True)
+                self.diagnostics_discovered.add(key)
+        state = dict(values)
+        state['details'] = details
+        self._publish(self._diagnostics_topic(), json.dumps(state))
+
+    def _discovery_config(self, key, diagnostic=False, attributes=False):
+        """
+        Returns the (topic, serialized payload) of a sensor's discovery
+        config, built once per key.
+        """
+        cached = self._config_cache.get(key)
+        if cached is not None:
+            return cached
+
+        metadata = self.describe_metric(key) if self.describe_metric else None
+        if metadata is None:
+            metadata = _infer_metadata(key)
+
+        config_topic = f"{self.discovery_prefix}/sensor/{self.device_id}/{key}/config"
+        payload = {
+            "name": f"{self.device_name} {key.replace('_', ' ').title()}",
+            "unique_id": f"{self.device_id}_{key}",
+            "device": self._device_for(key)
+        }
+        if diagnostic:
+            payload["state_topic"] = self._diagnostics_topic()
+            payload["value_template"] = f"{{{{ value_json.{key} }}}}"
+            payload["entity_category"] = "diagnostic"
+            if attributes:
+                payload["json_attributes_topic"] = payload["state_topic"]
+                payload["json_attributes_template"] = f"{{{{ value_json.details.{key} | tojson }}}}"
+        else:
+            if self.publish_mode == 'delta':
+                payload["state_topic"] = self._metric_topic(key)
+            else:
+                payload["state_topic"] = f"{self.discovery_prefix}/sensor/{self.device_id}/state"
+                payload["value_template"] = f"{{{{ value_json.{key} }}}}"
+            if attributes:
+                payload["json_attributes_topic"] = self._attributes_topic()
+                payload["json_attributes_template"] = f"{{{{ value_json.{key} | tojson }}}}"
+        for field in ("unit_of_measurement", "device_class", "state_class"):
+            if metadata.get(field):
+                payload[field] = metadata[field]
+
+        cached = (config_topic, json.dumps(payload))
+        self._config_cache[key] = cached
+        return cached
+
+    def publish_attributes(self, attributes):
+        """
+        Publishes {key: dict} to the retained attributes topic when it changed
+        since the last call. The dicts become the JSON attributes of their
+        key's entity.
+        """
+        if not attributes or not self.connected.is_set():
+            return
+        for key in attributes:
+            if key not in self.attribute_keys:
+                self.attribute_keys.add(key)
+                self._config_cache.pop(key, None)
+                if key in self.discovered:
+                    # Already discovered without the attributes topic
+                    config_topic, payload = self._discovery_config(key, attributes=True)
+                    self.client.publish(config_topic, payload, retain=True)
+        payload = json.dumps(attributes)
+        if payload != self._last_attributes:
+            self._publish(self._attributes_topic(), payload, retain=True)
+            self._last_attributes = payload
 
     def publish_update(self, sensor_data):
         """
-        Publishes the current state of all sensors to a single JSON topic.
+        Publishes the current state of all sensors to a single JSON topic, or
+        in delta mode only the metrics that moved past their deadband.
+        """
+        self.last_publish_messages = 0
+        self.last_publish_bytes = 0
+        if self.offline_buffer is not None and not self.connected.is_set():
+            # Keep the sample with its original timestamp for replay
+            self.offline_buffer.append(time.time(), json.dumps(sensor_data))
+            return
+        if self._reconnected:
+            self._reconnected = False
+            self.discovered.clear()
+            self.diagnostics_discovered.clear()
+            self.last_published.clear()
+            self._schema_published = False
+            self._last_attributes = None
+        # Discover metrics that appeared (hotplug, new RAPL domain) or went away
+        if sensor_data.keys() != self.discovered:
+            self.publish_discovery(sensor_data)
+        if self.publish_mode == 'delta':
+            self._publish_delta(sensor_data)
+            return
+        if self.encoder is not None:
+            info = self._publish_compact(sensor_data)
+            payload = None
+        else:
+            state_topic = f"{self.discovery_prefix}/sensor/{self.device_id}/state"
+            payload = json.dumps(sensor_data)
+            info = self._publish(state_topic, payload)
+        if self.offline_buffer is not None and getattr(info, 'rc', None) == mqtt.MQTT_ERR_NO_CONN:
+            # The disconnect callback hasn't fired yet
+            self.offline_buffer.append(time.time(), payload or json.dumps(sensor_data))
+
+    def publish_stats(self):
+        """
+        Messages and bytes sent by the most recent publish_update call, and
+        the offline buffer's backlog and drop count.
         """
-        state_topic = f"{self.discovery_prefix}/sensor/{self.device_id}/state"
-        self.client.publish(state_topic, json.dumps(sensor_data))
+        stats = {
+            'mqtt_publish_messages': self.last_publish_messages,
+            'mqtt_publish_bytes': self.last_publish_bytes,
+        }
+        if self.offline_buffer is not None:
+            stats['mqtt_offline_queued'] = len(self.offline_buffer)
+            stats['mqtt_offline_dropped'] = self.offline_buffer.dropped
+        return stats
+
+    def flush_offline(self):
+        """
+        Replays buffered samples to the history topic as JSON arrays of
+        {"timestamp": ..., "state": {...}}. Call once per tick; each call
+        sends at most replay_batches batches so a long outage drains
+        gradually. Returns the number of samples sent.
+        """
+        if self.offline_buffer is None or not self.connected.is_set():
+            return 0
+        topic = f"{self.discovery_prefix}/sensor/{self.device_id}/history"
+        sent = 0
+        for _ in range(self.replay_batches):
+            batch = self.offline_buffer.pop_batch(self.replay_batch_size)
+            if not batch:
+                break
+            # States are already serialized, splice them in without re-parsing
+            payload = "[" + ",".join(
+                f'{{"timestamp":{ts:.3f},"state":{state.decode("utf-8")}}}' for ts, state in batch
+            ) + "]"
+            info = self.client.publish(topic, payload)
+            if getattr(info, 'rc', None) == mqtt.MQTT_ERR_NO_CONN:
+                # Lost the connection mid-replay, try again after reconnecting
+                self.offline_buffer.requeue(batch)
+                break
+            sent += len(batch)
+        return sent
+
+    def _publish_compact(self, sensor_data):
+        payload, schema_changed = self.encoder.encode(sensor_data)
+        if schema_changed or not self._schema_published:
+            # Ordered before the state on the same connection, so decoders
+            # always have the schema of the next payload
+            self._publish(f"{self.discovery_prefix}/sensor/{self.device_id}/schema",
+                          self.encoder.schema, retain=True)
+            self._schema_published = True
+        return self._publish(f"{self.discovery_prefix}/sensor/{self.device_id}/compact", payload)
+
+    def _publish_delta(self, sensor_data):
+        full_refresh = self.full_refresh_ticks and self.ticks % self.full_refresh_ticks == 0
+        self.ticks += 1
+        for key, value in sensor_data.items():
+            if not full_refresh and not self._changed(key, value):
+                continue
+            self.last_published[key] = value
+            self._publish(self._metric_topic(key), json.dumps(value))
+
+    def _changed(self, key, value):
+        if key not in self.last_published:
+            return True
+        old = self.last_published[key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                or isinstance(old, bool) or not isinstance(old, (int, float)):
+            return value != old
+        absolute, relative = self._deadband_for(key)
+        threshold = max(absolute, relative * abs(old))
+        return abs(value - old) > threshold
+
+    def _deadband_for(self, key):
+        deadband = self._deadband_cache.get(key)
+        if deadband is None:
+            deadband = self.deadband
+            # Longest matching prefix wins
+            for prefix, prefix_deadband in self.deadbands:
+                if key.startswith(prefix):
+                    deadband = prefix_deadband
+                    break
+            self._deadband_cache[key] = deadband
+        return deadband
+
+    def _device_for(self, key):
+        child = self.describe_device(key) if self.describe_device else None
+        if child is None:
+            return self.device_info
+        return {
+            "identifiers": [f"{self.device_id}_{child['id']}"],
+            "name": f"{self.device_name} {child['name']}",
+            "manufacturer": self.device_info["manufacturer"],
+            "model": child['model'],
+            "via_device": self.device_id,
+        }
+
+    def _diagnostics_topic(self):
+        return f"{self.discovery_prefix}/sensor/{self.device_id}/diagnostics"
+
+    def _attributes_topic(self):
+        return f"{self.discovery_prefix}/sensor/{self.device_id}/attributes"
+
+    def _metric_topic(self, key):
+        return f"{self.discovery_prefix}/sensor/{self.device_id}/{key}/state"
+
+    def _publish(self, topic, payload, retain=False):
+        info = self.client.publish(topic, payload, retain=retain)
+        self.last_publish_messages += 1
+        self.last_publish_bytes += len(topic) + len(payload)
+        return info
+
+
+def _infer_metadata(key):
+    """
+    Guesses Home Assistant fields from the key name for metrics without
+    declared metadata.
+    """
+    unit_of_measurement = None
+    device_class = None
+    state_class = "measurement" # Default to measurement
+
+    if "_percent" in key:
+        unit_of_measurement = "%"
+    elif "_mb" in key:
+        unit_of_measurement = "MB"
+        device_class = "data_size"
+    elif "_gb" in key:
+        unit_of_measurement = "GB"
+        device_class = "data_size"
+    elif "_c" in key or "_temp" in key:
+        unit_of_measurement = "°C"
+        device_class = "temperature"
+    elif "_watts" in key:
+        unit_of_measurement = "W"
+        device_class = "power"
+    elif "_freq" in key:
+        unit_of_measurement = "MHz"
+        device_class = "frequency"
+    elif "uptime" in key:
+        unit_of_measurement = "s"
+        device_class = "duration"
+        state_class = "total_increasing"
+
+    return {
+        "unit_of_measurement": unit_of_measurement,
+        "device_class": device_class,
+        "state_class": state_class,
+    }
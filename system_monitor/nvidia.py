@@ -0,0 +1,163 @@
+# nvmlValue_t member for each NVML_VALUE_TYPE_*
+_VALUE_MEMBERS = ('dVal', 'uiVal', 'ulVal', 'ullVal', 'sllVal', 'siVal')
+
+# Metrics read through one nvmlDeviceGetFieldValues() call per device where
+# the driver supports it: (pynvml field constant, key suffix, scale). Only
+# metrics with the same meaning as their single-call fallback belong here,
+# e.g. the averaged power nvmlDeviceGetPowerUsage() reports, not the
+# instantaneous one.
+BATCHED_FIELDS = (
+    ('NVML_FI_DEV_POWER_AVERAGE', 'power_watts', 0.001),  # mW to W
+)
+
+
+class NvidiaGPUs:
+    """
+    NVML-backed GPU collector. Device handles and static attributes (name,
+    UUID, total memory, power limit) are read once at init; each tick only
+    queries the values that change. A failing metric only drops that metric,
+    a failing device only that device. Errors go to the diagnostics
+    recorder if one is given.
+    """
+
+    def __init__(self, pynvml, diagnostics=None):
+        self.nvml = pynvml
+        self.diagnostics = diagnostics
+        self.devices = []
+        for i in range(pynvml.nvmlDeviceGetCount()):
+            try:
+                self.devices.append(self._init_device(i))
+            except Exception as e:
+                # Skip a broken GPU, keep the others
+                self._record('nvidia_init', e)
+
+    def _init_device(self, index):
+        nvml = self.nvml
+        handle = nvml.nvmlDeviceGetHandleByIndex(index)
+        device = {
+            'index': index,
+            'handle': handle,
+            'name': _decode(nvml.nvmlDeviceGetName(handle)),
+            'uuid': None,
+            'memory_total': None,
+            'power_limit_watts': None,
+            'lost': False,
+            'prefix': f'gpu_nvidia_{index}_',
+        }
+        try:
+            device['uuid'] = _decode(nvml.nvmlDeviceGetUUID(handle))
+        except Exception as e:
+            self._record('nvidia_init', e)
+        try:
+            device['memory_total'] = nvml.nvmlDeviceGetMemoryInfo(handle).total
+        except Exception as e:
+            self._record('nvidia_init', e)
+        try:
+            device['power_limit_watts'] = nvml.nvmlDeviceGetEnforcedPowerLimit(handle) / 1000.0
+        except Exception as e:
+            self._record('nvidia_init', e)
+
+        # Batched fields, None until the first sample finds the ones this
+        # driver supports
+        device['fields'] = None
+        if not hasattr(nvml, 'nvmlDeviceGetFieldValues'):
+            device['fields'] = []
+        return device
+
+    def sample(self):
+        data = {}
+        for device in self.devices:
+            if device['lost']:
+                continue
+            try:
+                self._sample_device(device, data)
+            except Exception as e:
+                self._error(device, e)
+        return data
+
+    def _sample_device(self, device, data):
+        nvml = self.nvml
+        handle = device['handle']
+        prefix = device['prefix']
+
+        batched = self._sample_fields(device, data)
+
+        try:
+            data[prefix + 'usage_percent'] = nvml.nvmlDeviceGetUtilizationRates(handle).gpu
+        except Exception as e:
+            self._error(device, e)
+        try:
+            mem = nvml.nvmlDeviceGetMemoryInfo(handle)
+            data[prefix + 'memory_percent'] = (mem.used / mem.total) * 100
+        except Exception as e:
+            self._error(device, e)
+        try:
+            data[prefix + 'temp_c'] = nvml.nvmlDeviceGetTemperature(handle, 0)  # NVML_TEMPERATURE_GPU
+        except Exception as e:
+            self._error(device, e)
+        if 'power_watts' not in batched:
+            try:
+                data[prefix + 'power_watts'] = nvml.nvmlDeviceGetPowerUsage(handle) / 1000.0 # mW to W
+            except Exception as e:
+                self._error(device, e)
+
+        if device['memory_total']:
+            data[prefix + 'memory_total_mb'] = device['memory_total'] // 1024 // 1024
+        if device['power_limit_watts']:
+            data[prefix + 'power_limit_watts'] = device['power_limit_watts']
+
+    def _sample_fields(self, device, data):
+        """Reads the batched fields into data, returns their key suffixes."""
+        nvml = self.nvml
+        fields = device['fields']
+        probing = fields is None
+        if probing:
+            fields = [(getattr(nvml, const), suffix, scale) for const, suffix, scale in BATCHED_FIELDS
+                      if hasattr(nvml, const)]
+        if not fields:
+            device['fields'] = []
+            return set()
+
+        try:
+            values = nvml.nvmlDeviceGetFieldValues(device['handle'], [f[0] for f in fields])
+        except Exception as e:
+            if probing:
+                # Not supported by this driver, use the single calls
+                device['fields'] = []
+            self._error(device, e)
+            return set()
+        batched = set()
+        supported = []
+        for field, value in zip(fields, values):
+            if value.nvmlReturn == 0:
+                _, suffix, scale = field
+                raw = getattr(value.value, _VALUE_MEMBERS[value.valueType])
+                data[device['prefix'] + suffix] = round(raw * scale, 2)
+                batched.add(suffix)
+                supported.append(field)
+        if probing:
+            device['fields'] = supported
+        return batched
+
+    def _error(self, device, exc):
+        self._record('nvidia', exc)
+        # A GPU that fell off the bus fails every call, stop querying it
+        lost = getattr(self.nvml, 'NVML_ERROR_GPU_IS_LOST', None)
+        if lost is not None and getattr(exc, 'value', None) == lost:
+            device['lost'] = True
+
+    def close(self):
+        try:
+            self.nvml.nvmlShutdown()
+        except Exception as e:
+            self._record('nvidia', e)
+
+    def _record(self, source, exc):
+        if self.diagnostics:
+            self.diagnostics.record_error(source, exc)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
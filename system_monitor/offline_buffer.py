@@ -0,0 +1,159 @@
+import os
+import glob
+import struct
+from collections import deque
+
+# Spill record header: original timestamp and payload length
+_RECORD = struct.Struct('<dI')
+
+
+class OfflineBuffer:
+    """
+    Bounded store-and-forward queue for state messages that couldn't be
+    published while the broker was unreachable.
+
+    Messages are kept in memory up to max_bytes. When full, the oldest
+    messages are moved to append-only segment files in spill_dir (if set)
+    or dropped. The spill directory is capped at max_spill_bytes by deleting
+    its oldest segment. Every message lost this way is counted in dropped.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024, spill_dir=None,
+                 max_spill_bytes=16 * 1024 * 1024, segment_bytes=1024 * 1024):
+        self.max_bytes = max_bytes
+        self.queue = deque()  # [(timestamp, payload_bytes)]
+        self.bytes = 0
+        self.dropped = 0
+        self.spill = SpillStore(spill_dir, max_spill_bytes, segment_bytes) if spill_dir else None
+        # Records loaded back from the spill store, replayed before the rest
+        self._replay = deque()
+
+    def __len__(self):
+        spilled = self.spill.count if self.spill else 0
+        return len(self._replay) + spilled + len(self.queue)
+
+    def append(self, timestamp, payload):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        if len(payload) > self.max_bytes:
+            self.dropped += 1
+            return
+        # Oldest-first eviction
+        while self.queue and self.bytes + len(payload) > self.max_bytes:
+            old_ts, old_payload = self.queue.popleft()
+            self.bytes -= len(old_payload)
+            if self.spill:
+                self.dropped += self.spill.append(old_ts, old_payload)
+            else:
+                self.dropped += 1
+        self.queue.append((timestamp, payload))
+        self.bytes += len(payload)
+
+    def requeue(self, batch):
+        """Puts a batch that couldn't be sent back at the front of the queue."""
+        self._replay.extendleft(reversed(batch))
+
+    def pop_batch(self, max_items):
+        """
+        Removes and returns up to max_items (timestamp, payload) records,
+        oldest first.
+        """
+        batch = []
+        while len(batch) < max_items:
+            if not self._replay and self.spill and self.spill.count:
+                self._replay.extend(self.spill.pop_segment())
+            if self._replay:
+                batch.append(self._replay.popleft())
+            elif self.queue:
+                record = self.queue.popleft()
+                self.bytes -= len(record[1])
+                batch.append(record)
+            else:
+                break
+        return batch
+
+
+class SpillStore:
+    """
+    Append-only segment files holding records evicted from memory. Existing
+    segments are picked up on startup, so buffered samples survive a restart.
+    """
+
+    def __init__(self, directory, max_bytes, segment_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        # {segment_number: [path, size, record_count]}, oldest first
+        self.segments = {}
+        for path in sorted(glob.glob(os.path.join(directory, 'segment-*.bin'))):
+            number = int(os.path.basename(path)[8:-4])
+            records = list(_read_segment(path))
+            self.segments[number] = [path, os.path.getsize(path), len(records)]
+        self._next = max(self.segments, default=-1) + 1
+        self._file = None
+        self._current = None
+
+    @property
+    def count(self):
+        return sum(segment[2] for segment in self.segments.values())
+
+    @property
+    def bytes(self):
+        return sum(segment[1] for segment in self.segments.values())
+
+    def append(self, timestamp, payload):
+        """Writes a record. Returns how many older records were dropped."""
+        if self._current is None or self.segments[self._current][1] >= self.segment_bytes:
+            self._rotate()
+        record = _RECORD.pack(timestamp, len(payload)) + payload
+        self._file.write(record)
+        self._file.flush()
+        segment = self.segments[self._current]
+        segment[1] += len(record)
+        segment[2] += 1
+
+        dropped = 0
+        while self.bytes > self.max_bytes and len(self.segments) > 1:
+            oldest = min(self.segments)
+            path, _, count = self.segments.pop(oldest)
+            os.remove(path)
+            dropped += count
+        return dropped
+
+    def pop_segment(self):
+        """Reads and deletes the oldest segment, returning its records."""
+        oldest = min(self.segments)
+        if oldest == self._current:
+            self._close()
+        path = self.segments.pop(oldest)[0]
+        records = list(_read_segment(path))
+        os.remove(path)
+        return records
+
+    def _rotate(self):
+        self._close()
+        self._current = self._next
+        self._next += 1
+        path = os.path.join(self.directory, f'segment-{self._current:08d}.bin')
+        self._file = open(path, 'ab')
+        self.segments[self._current] = [path, 0, 0]
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._current = None
+
+
+def _read_segment(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    while offset + _RECORD.size <= len(data):
+        timestamp, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        if offset + length > len(data):
+            break  # Truncated by a crash mid-write
+        yield timestamp, data[offset:offset + length]
+        offset += length
@@ -0,0 +1,140 @@
+import os
+import heapq
+import time
+from sysfs import SysfsAttribute
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# Fields of /proc/<pid>/stat counted after the ")" that ends the command name
+UTIME, STIME, STARTTIME, RSS = 11, 12, 19, 21
+
+
+class Process:
+    __slots__ = ('pid', 'path', 'attr', 'starttime', 'cpu_ticks', 'name', 'long_lived')
+
+    def __init__(self, pid, path):
+        self.pid = pid
+        self.path = path
+        self.attr = None  # Open stat file once the process is long-lived
+        self.starttime = None
+        self.cpu_ticks = None
+        self.name = None
+        self.long_lived = False
+
+
+class TopProcesses:
+    """
+    The processes using the most CPU and memory, from /proc/<pid>/stat.
+
+    The PID list is only refreshed every rescan_interval seconds; between
+    rescans each tick re-reads the stat files of the known PIDs. A process
+    still alive at its second rescan keeps its stat file open (up to
+    max_open_files) so later reads are a single pread(). Exited processes
+    are dropped when their read fails, a reused PID is detected by its
+    start time. The top N are picked with a partial select, not a sort.
+    """
+
+    def __init__(self, proc_root='/proc', top_n=5, rescan_interval=30, max_open_files=512):
+        self.proc_root = proc_root
+        self.top_n = top_n
+        self.rescan_interval = rescan_interval
+        self.max_open_files = max_open_files
+        self.processes = {}  # {pid: Process}
+        self.open_files = 0
+        self.last_scan = None
+        self.attributes = {}  # {key: JSON attributes} of the last sample
+
+    def available(self):
+        return os.path.isdir(self.proc_root) and os.path.exists(os.path.join(self.proc_root, 'self/stat'))
+
+    def rescan(self, now=None):
+        pids = set()
+        for name in os.listdir(self.proc_root):
+            if name.isdigit():
+                pids.add(int(name))
+        for pid in [p for p in self.processes if p not in pids]:
+            self._drop(pid)
+        for pid, process in self.processes.items():
+            # Survived a whole rescan interval, worth an open fd
+            if not process.long_lived:
+                process.long_lived = True
+                if self.open_files < self.max_open_files:
+                    process.attr = SysfsAttribute(process.path, size=512)
+                    self.open_files += 1
+        for pid in pids:
+            if pid not in self.processes:
+                self.processes[pid] = Process(pid, os.path.join(self.proc_root, str(pid), 'stat'))
+        self.last_scan = now if now is not None else time.time()
+
+    def sample(self, time_delta, now=None):
+        if now is None:
+            now = time.time()
+        if self.last_scan is None or now - self.last_scan >= self.rescan_interval:
+            self.rescan(now)
+
+        # Jiffies to percent of one CPU, like top
+        scale = 100.0 / (CLOCK_TICKS * time_delta) if time_delta > 0 else 0.0
+        rows = []  # (cpu percent, rss bytes, pid, name)
+        gone = []
+        for pid, process in self.processes.items():
+            try:
+                if process.attr is not None:
+                    data = bytes(process.attr.read_bytes())
+                else:
+                    data = _read_once(process.path)
+            except OSError:
+                gone.append(pid)  # Exited
+                continue
+            head, _, tail = data.rpartition(b')')
+            fields = tail.split()
+            if len(fields) <= RSS:
+                continue
+            cpu_ticks = int(fields[UTIME]) + int(fields[STIME])
+            starttime = int(fields[STARTTIME])
+            if starttime != process.starttime:
+                # New process (or the PID was reused), no CPU rate yet
+                process.starttime = starttime
+                process.name = head.partition(b'(')[2].decode('utf-8', 'replace')
+                process.cpu_ticks = None
+            cpu = 0.0
+            if process.cpu_ticks is not None:
+                cpu = (cpu_ticks - process.cpu_ticks) * scale
+            process.cpu_ticks = cpu_ticks
+            rows.append((cpu, int(fields[RSS]) * PAGE_SIZE, pid, process.name))
+        for pid in gone:
+            self._drop(pid)
+
+        top_cpu = heapq.nlargest(self.top_n, rows, key=lambda row: row[0])
+        top_rss = heapq.nlargest(self.top_n, rows, key=lambda row: row[1])
+        self.attributes = {
+            'process_top_cpu_percent': {'processes': [_describe(row) for row in top_cpu]},
+            'process_top_rss_mb': {'processes': [_describe(row) for row in top_rss]},
+        }
+        data = {'process_count': len(rows)}
+        if top_cpu:
+            data['process_top_cpu_percent'] = round(top_cpu[0][0], 1)
+            data['process_top_rss_mb'] = top_rss[0][1] // 1024 // 1024
+        return data
+
+    def close(self):
+        for pid in list(self.processes):
+            self._drop(pid)
+
+    def _drop(self, pid):
+        process = self.processes.pop(pid)
+        if process.attr is not None:
+            process.attr.close()
+            self.open_files -= 1
+
+
+def _read_once(path):
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+    try:
+        return os.read(fd, 1024)
+    finally:
+        os.close(fd)
+
+
+def _describe(row):
+    cpu, rss, pid, name = row
+    return {'pid': pid, 'name': name, 'cpu_percent': round(cpu, 1), 'rss_mb': rss // 1024 // 1024}
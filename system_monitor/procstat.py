@@ -0,0 +1,113 @@
+from array import array
+from sysfs import SysfsAttribute
+
+# Columns of the cpu lines in /proc/stat
+FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq', 'steal', 'guest', 'guest_nice')
+USER, NICE, SYSTEM, IDLE, IOWAIT, IRQ, SOFTIRQ, STEAL, GUEST, GUEST_NICE = range(len(FIELDS))
+WIDTH = len(FIELDS)
+
+
+class ProcStat:
+    """
+    CPU usage for the whole system and every core from one /proc/stat read.
+
+    The cpu lines are parsed into a flat array of jiffies (one row of FIELDS
+    per cpu line, the aggregate "cpu" line first) and usage is computed from
+    the difference to the previous read. Besides what psutil.cpu_percent()
+    reports, the aggregate row is broken down into user, system, iowait and
+    steal time.
+    """
+
+    def __init__(self, path='/proc/stat'):
+        # The cpu lines come first, so only read as much as they need
+        self.attr = SysfsAttribute(path, size=8192)
+        self.labels = None  # Core numbers of the per-core rows
+        self.previous = None
+        self._core_keys = {}
+
+    def read(self):
+        """
+        Returns (core_numbers, jiffies) where jiffies holds WIDTH values per
+        row, the aggregate row first.
+        """
+        while True:
+            data = bytes(self.attr.read_bytes(whole=False))
+            lines = data.split(b'\n')
+            if len(data) < len(self.attr.buffer):
+                break
+            # The buffer was filled, it has to reach past the last cpu line
+            # (the last element of lines may be cut off)
+            complete = False
+            for i, line in enumerate(lines):
+                if not line.startswith(b'cpu'):
+                    complete = i < len(lines) - 1 or len(line) >= 3
+                    break
+            if complete:
+                break
+            self.attr.grow()
+
+        jiffies = array('Q')
+        labels = []
+        for line in lines:
+            if not line.startswith(b'cpu'):
+                break
+            fields = line.split()
+            values = fields[1:WIDTH + 1]
+            if len(values) < WIDTH:
+                # Older kernels don't report steal/guest columns
+                values += [b'0'] * (WIDTH - len(values))
+            jiffies.extend(map(int, values))
+            if fields[0] != b'cpu':
+                # Offline cores are missing, so keep the actual core number
+                labels.append(int(fields[0][3:]))
+        return tuple(labels), jiffies
+
+    def sample(self):
+        """
+        Returns the stats dict for this tick. The first call (and the first
+        call after cores came online or went offline) reports averages since
+        boot.
+        """
+        labels, current = self.read()
+        previous = self.previous
+        if previous is None or labels != self.labels:
+            previous = array('Q', bytes(len(current) * current.itemsize))
+        self.labels = labels
+        self.previous = current
+
+        # Vectorized delta over all rows at once
+        # (iowait is known to go backwards on some kernels, so clamp at zero)
+        delta = [c - p if c > p else 0 for c, p in zip(current, previous)]
+
+        data = {}
+        for row in range(len(labels) + 1):
+            base = row * WIDTH
+            d = delta[base:base + WIDTH]
+            # guest time is already included in user (guest_nice in nice)
+            total = sum(d) - d[GUEST] - d[GUEST_NICE]
+            if total <= 0:
+                usage = 0.0
+            else:
+                usage = round(100.0 * (total - d[IDLE] - d[IOWAIT]) / total, 1)
+            if row == 0:
+                data['cpu_usage_percent'] = usage
+                if total > 0:
+                    scale = 100.0 / total
+                    data['cpu_user_percent'] = round((d[USER] - d[GUEST] + d[NICE] - d[GUEST_NICE]) * scale, 1)
+                    data['cpu_system_percent'] = round((d[SYSTEM] + d[IRQ] + d[SOFTIRQ]) * scale, 1)
+                    data['cpu_iowait_percent'] = round(d[IOWAIT] * scale, 1)
+                    data['cpu_steal_percent'] = round(d[STEAL] * scale, 1)
+            else:
+                data[self._core_key(labels[row - 1])] = usage
+        return data
+
+    def close(self):
+        self.attr.close()
+
+    def _core_key(self, core):
+        # Key strings are built once per core
+        key = self._core_keys.get(core)
+        if key is None:
+            key = f'cpu_core_{core}_usage_percent'
+            self._core_keys[core] = key
+        return key
@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+from array import array
+
+NAN = float('nan')
+
+
+class RingBuffer:
+    """
+    Fixed-capacity sample store backed by a single array('d').
+
+    Each row is one sample and each column one metric. Metrics missing from a
+    sample are stored as NaN. New metrics add a column, which is the only time
+    the array grows. clear(keep) drops the columns of metrics that are gone
+    (e.g. of restarted containers) and shrinks the array once at most a
+    quarter of it is in use.
+    """
+
+    def __init__(self, capacity, width=32):
+        self.capacity = capacity
+        self.columns = {}  # {metric_key: column_index}
+        self.min_width = width
+        self.width = width
+        self.data = array('d', [NAN]) * (capacity * width)
+        self._nan_row = array('d', [NAN]) * width
+        self.head = 0  # Next row to write
+        self.count = 0
+
+    def append(self, sample):
+        base = self.head * self.width
+        self.data[base:base + self.width] = self._nan_row
+        for key, value in sample.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            col = self.columns.get(key)
+            if col is None:
+                col = self._add_column(key)
+                base = self.head * self.width
+            self.data[base + col] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def aggregate(self):
+        """
+        Returns {metric_key: (min, max, mean, last)} over the buffered rows.
+        """
+        result = {}
+        if not self.count:
+            return result
+        width = self.width
+        # Rows in chronological order
+        first = (self.head - self.count) % self.capacity
+        rows = [(first + i) % self.capacity * width for i in range(self.count)]
+        for key, col in self.columns.items():
+            lo = math.inf
+            hi = -math.inf
+            total = 0.0
+            n = 0
+            last = NAN
+            for base in rows:
+                v = self.data[base + col]
+                if v != v:  # NaN
+                    continue
+                if v < lo:
+                    lo = v
+                if v > hi:
+                    hi = v
+                total += v
+                n += 1
+                last = v
+            if n:
+                result[key] = (lo, hi, total / n, last)
+        return result
+
+    def clear(self, keep=None):
+        """
+        Empties the buffer. With keep, only the columns of those metrics
+        (e.g. the ones that had a value in the window just aggregated) are
+        kept.
+        """
+        self.head = 0
+        self.count = 0
+        if keep is None or len(keep) == len(self.columns):
+            return
+        self.columns = {key: col for col, key in enumerate(k for k in self.columns if k in keep)}
+        width = self.width
+        while width > self.min_width and len(self.columns) <= width // 4:
+            width //= 2
+        if width != self.width:
+            # No rows are buffered, so nothing needs to be copied
+            self.data = array('d', [NAN]) * (self.capacity * width)
+            self.width = width
+            self._nan_row = array('d', [NAN]) * width
+
+    def _add_column(self, key):
+        col = len(self.columns)
+        if col >= self.width:
+            new_width = self.width * 2
+            data = array('d', [NAN]) * (self.capacity * new_width)
+            for row in range(self.capacity):
+                old = row * self.width
+                data[row * new_width:row * new_width + self.width] = self.data[old:old + self.width]
+            self.data = data
+            self.width = new_width
+            self._nan_row = array('d', [NAN]) * new_width
+        self.columns[key] = col
+        return col
+
+
+class Sampler:
+    """
+    Runs SystemMonitor.get_stats() on a background thread at a short interval
+    and aggregates the samples when collect() is called at publish time.
+    """
+
+    def __init__(self, monitor, interval, capacity, aggregate_prefixes=None):
+        self.monitor = monitor
+        self.interval = interval
+        self.ring = RingBuffer(capacity)
+        # Key prefixes that get _min/_max/_mean sensors, None means all metrics
+        self.aggregate_prefixes = tuple(aggregate_prefixes) if aggregate_prefixes else None
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reset_timing()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def collect(self):
+        """
+        Returns the aggregates of all samples since the previous call as a
+        flat dict. Each metric keeps its key with the last value and gets
+        _min, _max and _mean variants. Sampler timing is included as
+        sampler_* keys.
+        """
+        with self.lock:
+            aggregates = self.ring.aggregate()
+            # Metrics without a value in this window are gone
+            self.ring.clear(aggregates)
+            timing = self._timing_stats()
+            self._reset_timing()
+
+        data = {}
+        for key, (lo, hi, mean, last) in aggregates.items():
+            data[key] = last
+            if self.aggregate_prefixes is None or key.startswith(self.aggregate_prefixes):
+                data[f'{key}_min'] = lo
+                data[f'{key}_max'] = hi
+                data[f'{key}_mean'] = round(mean, 2)
+        data.update(timing)
+        return data
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            started = time.monotonic()
+            jitter = started - next_tick
+            try:
+                stats = self.monitor.get_stats()
+            except Exception as e:
+                print(f"Error in sampler: {e}")
+                self.monitor.diagnostics.record_error('sampler', e)
+                stats = None
+            cost = time.monotonic() - started
+
+            with self.lock:
+                if stats is not None:
+                    self.ring.append(stats)
+                self.samples += 1
+                self.jitter_total += jitter
+                self.jitter_max = max(self.jitter_max, jitter)
+                self.cost_total += cost
+                self.cost_max = max(self.cost_max, cost)
+
+            next_tick += self.interval
+            now = time.monotonic()
+            if next_tick < now:
+                # Collection took longer than the interval, skip missed ticks
+                missed = int((now - next_tick) // self.interval) + 1
+                with self.lock:
+                    self.overruns += missed
+                next_tick += missed * self.interval
+            self._stop.wait(next_tick - now)
+
+    def _reset_timing(self):
+        self.samples = 0
+        self.overruns = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.cost_total = 0.0
+        self.cost_max = 0.0
+
+    def _timing_stats(self):
+        n = self.samples or 1
+        return {
+            'sampler_samples': self.samples,
+            'sampler_overruns': self.overruns,
+            'sampler_jitter_ms_mean': round(self.jitter_total / n * 1000, 2),
+            'sampler_jitter_ms_max': round(self.jitter_max * 1000, 2),
+            'sampler_tick_ms_mean': round(self.cost_total / n * 1000, 2),
+            'sampler_tick_ms_max': round(self.cost_max * 1000, 2),
+        }
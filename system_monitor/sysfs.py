@@ -0,0 +1,134 @@
+import os
+import errno
+
+# Errors that mean the file behind a cached fd is gone (device unplugged,
+# driver reloaded) and the path has to be opened again.
+_REOPEN_ERRNOS = (errno.ENODEV, errno.ENOENT, errno.EBADF, errno.ENXIO, errno.ESTALE)
+# Errors that mean the device itself is gone and its paths have to be
+# discovered again. Others (EIO, EINVAL, ENODATA from a GPU in a low-power
+# state, EACCES) don't go away with a rescan.
+DEVICE_GONE_ERRNOS = (errno.ENOENT, errno.ENODEV, errno.ENXIO)
+
+_HAVE_PREADV = hasattr(os, 'preadv')
+
+
+class SysfsAttribute:
+    """
+    A sysfs/procfs attribute kept open between reads.
+
+    Each read is a single pread() at offset 0 into a reused buffer, which
+    makes the kernel regenerate the value without an open/close pair.
+    """
+
+    def __init__(self, path, size=64):
+        self.path = path
+        self.fd = None
+        self.buffer = bytearray(size)
+        self._view = memoryview(self.buffer)
+
+    def open(self):
+        self.close()
+        self.fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+
+    def close(self):
+        if self.fd is not None:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = None
+
+    def read_bytes(self, whole=True):
+        """
+        Returns the raw contents. The result is only valid until the next read.
+        With whole=False only the first len(buffer) bytes are read, for files
+        like /proc/stat where the interesting lines come first.
+        Raises OSError if the attribute can't be reopened.
+        """
+        if self.fd is None:
+            self.open()
+        try:
+            n = self._pread(whole)
+        except OSError as e:
+            if e.errno not in _REOPEN_ERRNOS:
+                raise
+            # The device went away, retry once with a fresh fd
+            self.open()
+            n = self._pread(whole)
+        return self._view[:n]
+
+    def grow(self):
+        self.buffer = bytearray(len(self.buffer) * 2)
+        self._view = memoryview(self.buffer)
+
+    def read_int(self):
+        return int(self.read_bytes())
+
+    def read_text(self):
+        return bytes(self.read_bytes()).decode('utf-8', 'replace')
+
+    def _pread(self, whole=True):
+        # Grow the buffer until the whole file fits in one read
+        while True:
+            if _HAVE_PREADV:
+                n = os.preadv(self.fd, [self.buffer], 0)
+            else:
+                data = os.pread(self.fd, len(self.buffer), 0)
+                n = len(data)
+                self.buffer[:n] = data
+            if n < len(self.buffer) or not whole:
+                return n
+            self.grow()
+
+
+class SysfsReader:
+    """
+    Pool of open sysfs attributes keyed by path.
+    """
+
+    def __init__(self):
+        self.attributes = {}
+
+    def get(self, path, size=64):
+        attr = self.attributes.get(path)
+        if attr is None:
+            attr = SysfsAttribute(path, size)
+            self.attributes[path] = attr
+        return attr
+
+    def read_int(self, path):
+        """
+        Reads an integer attribute. Raises OSError if the file is gone (the
+        fd is dropped so a later read starts fresh) and ValueError if the
+        contents aren't an integer.
+        """
+        attr = self.get(path)
+        try:
+            return attr.read_int()
+        except OSError:
+            self.discard(path)
+            raise
+
+    def read_text(self, path, size=4096):
+        attr = self.get(path, size)
+        try:
+            return attr.read_text()
+        except OSError:
+            self.discard(path)
+            raise
+
+    def discard(self, path):
+        attr = self.attributes.pop(path, None)
+        if attr is not None:
+            attr.close()
+
+    def retain(self, paths):
+        """Closes every cached attribute whose path is not in paths."""
+        for path in list(self.attributes):
+            if path not in paths:
+                self.discard(path)
+
+    def close(self):
+        for attr in self.attributes.values():
+            attr.close()
+        self.attributes.clear()
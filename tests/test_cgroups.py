@@ -0,0 +1,175 @@
+import sys
+import os
+import json
+import errno
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+# Mock dependencies before importing local modules
+sys.modules.setdefault('psutil', MagicMock())
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from cgroups import ContainerCgroups
+from diagnostics import Diagnostics
+from mqtt_client import MQTTClient
+from monitor import describe_metric, METRIC_LABELS
+from exporter import PrometheusExporter
+
+DOCKER_ID = 'a' * 64
+PODMAN_ID = 'b' * 64
+K8S_ID = 'c' * 64
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def write_cgroup(path, usage_usec=0, memory=0, rbytes=0, wbytes=0, io=True):
+    write_file(os.path.join(path, 'cpu.stat'),
+               f'usage_usec {usage_usec}\nuser_usec 0\nsystem_usec 0\n'
+               f'nr_periods 0\nnr_throttled 0\nthrottled_usec 0\n')
+    write_file(os.path.join(path, 'memory.current'), f'{memory}\n')
+    write_file(os.path.join(path, 'memory.stat'), f'anon {memory // 2}\nfile {memory // 4}\nkernel 0\n')
+    if io:
+        write_file(os.path.join(path, 'io.stat'),
+                   f'259:0 rbytes={rbytes} wbytes={wbytes} rios=1 wios=1 dbytes=0 dios=0\n'
+                   f'8:0 rbytes={rbytes} wbytes=0 rios=1 wios=0 dbytes=0 dios=0\n')
+
+
+class TestContainerCgroups(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        write_file(os.path.join(self.root, 'cgroup.controllers'), 'cpu io memory\n')
+        self.set_descendants(10)
+        self.docker = os.path.join(self.root, f'system.slice/docker-{DOCKER_ID}.scope')
+        self.podman = os.path.join(self.root, f'machine.slice/libpod-{PODMAN_ID}.scope')
+        self.k8s = os.path.join(self.root, f'kubepods/burstable/pod1234/{K8S_ID}')
+        write_cgroup(self.docker, usage_usec=1_000_000, memory=512 * 1024 * 1024, rbytes=1000, wbytes=0)
+        write_cgroup(self.podman)
+        write_cgroup(self.k8s, io=False)
+        # Not containers
+        write_cgroup(os.path.join(self.root, f'machine.slice/libpod-conmon-{PODMAN_ID}.scope'))
+        write_cgroup(os.path.join(self.root, 'system.slice/ssh.service'))
+
+    def set_descendants(self, count):
+        write_file(os.path.join(self.root, 'cgroup.stat'), f'nr_descendants {count}\nnr_dying_descendants 0\n')
+
+    def test_discovers_containers_of_each_runtime(self):
+        cgroups = ContainerCgroups(self.root)
+        self.assertTrue(cgroups.available())
+        found = cgroups.discover()
+        self.assertEqual(found, {
+            self.docker: (DOCKER_ID, 'docker'),
+            self.podman: (PODMAN_ID, 'libpod'),
+            self.k8s: (K8S_ID, 'kubepods'),
+        })
+
+    def test_rates_from_usage_deltas(self):
+        cgroups = ContainerCgroups(self.root)
+        data = cgroups.sample(1.0, now=1000)
+        prefix = f'container_{DOCKER_ID[:12]}_'
+        # No rates on the first sample
+        self.assertNotIn(prefix + 'cpu_percent', data)
+        self.assertEqual(data[prefix + 'memory_mb'], 512)
+        self.assertEqual(data[prefix + 'memory_anon_mb'], 256)
+
+        write_cgroup(self.docker, usage_usec=3_000_000, memory=512 * 1024 * 1024, rbytes=5000, wbytes=4000)
+        data = cgroups.sample(2.0, now=1002)
+        # 2 CPU-seconds in 2 seconds is one full core
+        self.assertEqual(data[prefix + 'cpu_percent'], 100.0)
+        self.assertEqual(data[prefix + 'read_bytes_per_s'], 4000.0)  # Summed over both devices
+        self.assertEqual(data[prefix + 'write_bytes_per_s'], 2000.0)
+        # A cgroup without the io controller still reports CPU
+        self.assertIn(f'container_{K8S_ID[:12]}_cpu_percent', data)
+        self.assertNotIn(f'container_{K8S_ID[:12]}_read_bytes_per_s', data)
+
+    def test_container_churn(self):
+        # Without cached fds, so a removed directory fails the next read
+        # (on cgroupfs a cached fd of a removed cgroup fails with ENODEV)
+        cgroups = ContainerCgroups(self.root, rescan_interval=0, max_open_files=0)
+        cgroups.sample(1.0, now=1000)
+        self.assertEqual(len(cgroups.containers), 3)
+
+        # Stopped: dropped on the next sample without waiting for a rescan
+        shutil.rmtree(self.podman)
+        data = cgroups.sample(1.0, now=1001)
+        self.assertEqual(len(cgroups.containers), 2)
+        self.assertFalse(any(key.startswith(f'container_{PODMAN_ID[:12]}') for key in data))
+
+        # Started: a changed descendant count triggers a rescan
+        new_id = 'd' * 64
+        write_cgroup(os.path.join(self.root, f'system.slice/docker-{new_id}.scope'))
+        cgroups.sample(1.0, now=1002)
+        self.assertEqual(len(cgroups.containers), 2)
+        self.set_descendants(11)
+        cgroups.sample(1.0, now=1003)
+        self.assertEqual(cgroups.runtime(new_id[:12]), 'docker')
+        self.assertIsNone(cgroups.runtime(PODMAN_ID[:12]))
+
+    def test_read_errors_recorded(self):
+        diagnostics = Diagnostics()
+        cgroups = ContainerCgroups(self.root, diagnostics=diagnostics)
+        cgroups.sample(1.0, now=1000)
+        docker = cgroups.containers[self.docker]
+        # Not readable, but the container is still there
+        with patch.object(docker.cpu, 'read_bytes', side_effect=PermissionError(errno.EACCES, 'EACCES')):
+            cgroups.sample(1.0, now=1001)
+        self.assertIn(self.docker, cgroups.containers)
+        # The k8s container has no io.stat, that's not an error
+        self.assertEqual(diagnostics.totals()[1], {('cgroups', 'PermissionError'): 1})
+
+    def test_open_file_cap(self):
+        cgroups = ContainerCgroups(self.root, max_open_files=4)
+        cgroups.sample(1.0, now=1000)
+        open_containers = [c for c in cgroups.containers.values() if c.cpu.fd is not None]
+        self.assertEqual(len(open_containers), 1)
+        cgroups.close()
+
+
+class TestContainerDiscovery(unittest.TestCase):
+    def test_container_keys_get_their_own_device(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test PC", describe_metric=describe_metric,
+                            describe_device=lambda key: {'id': 'container_aaaaaaaaaaaa', 'name': 'Container aaaaaaaaaaaa',
+                                                         'model': 'docker container'}
+                            if key.startswith('container_') else None)
+        client.client = MagicMock()
+        client.publish_discovery({'cpu_usage_percent': 1.0, 'container_aaaaaaaaaaaa_cpu_percent': 5.0})
+
+        configs = {c[0][0]: json.loads(c[0][1]) for c in client.client.publish.call_args_list}
+        host = configs['homeassistant/sensor/test_pc/cpu_usage_percent/config']
+        container = configs['homeassistant/sensor/test_pc/container_aaaaaaaaaaaa_cpu_percent/config']
+        self.assertEqual(host['device']['identifiers'], ['test_pc'])
+        self.assertEqual(container['device']['identifiers'], ['test_pc_container_aaaaaaaaaaaa'])
+        self.assertEqual(container['device']['via_device'], 'test_pc')
+        self.assertEqual(container['unit_of_measurement'], '%')
+
+    def test_container_churn_keeps_caches_bounded(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test PC", describe_metric=describe_metric,
+                            publish_mode='delta', removal_ticks=2)
+        client.client = MagicMock()
+        client.connected.set()
+        exporter = PrometheusExporter(0, describe_metric=describe_metric, label_rules=METRIC_LABELS)
+        for restart in range(50):
+            # A restarted container comes back under a new id
+            stats = {'cpu_usage_percent': 1.0, f'container_{restart:012x}_cpu_percent': 5.0}
+            for _ in range(3):
+                client.publish_update(stats)
+                exporter.render(stats)
+
+        for cache in (client.discovered, client._config_cache, client._deadband_cache,
+                      client.last_published, client._missing, exporter._series):
+            self.assertLessEqual(len(cache), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
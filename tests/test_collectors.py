@@ -0,0 +1,159 @@
+import sys
+import os
+import time
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+import collectors
+from collectors import CollectorScheduler, counter_delta
+
+
+class TestCollectorScheduler(unittest.TestCase):
+    def test_runs_only_due_collectors(self):
+        scheduler = CollectorScheduler()
+        fast = MagicMock(return_value={'cpu_usage_percent': 1})
+        slow = MagicMock(return_value={'disk_root_usage_percent': 40})
+        scheduler.register('cpu', fast, interval=0)
+        scheduler.register('disk', slow, interval=60)
+
+        scheduler.run_due(1000)
+        scheduler.run_due(1010)
+        stats = scheduler.snapshot()
+
+        self.assertEqual(fast.call_count, 2)
+        self.assertEqual(slow.call_count, 1)
+        # Cached values from collectors that weren't due are merged in
+        self.assertEqual(stats, {'cpu_usage_percent': 1, 'disk_root_usage_percent': 40})
+
+        scheduler.run_due(1060)
+        self.assertEqual(slow.call_count, 2)
+
+    def test_rate_collector_gets_own_time_delta(self):
+        scheduler = CollectorScheduler()
+        rate = MagicMock(return_value={})
+        scheduler.register('cpu', rate, interval=5, rate=True)
+
+        scheduler.run_due(1000)
+        scheduler.run_due(1002)  # Not due
+        scheduler.run_due(1005)
+        self.assertEqual(rate.call_args[0][0], 5)
+
+    def test_failed_rate_collector_delta_spans_both_intervals(self):
+        scheduler = CollectorScheduler()
+        rate = MagicMock(side_effect=[{}, RuntimeError('boom'), {}])
+        scheduler.register('cpu', rate, interval=5, rate=True)
+
+        scheduler.run_due(1000)
+        scheduler.run_due(1005)
+        scheduler.run_due(1010)
+        # Its counters weren't consumed by the failed run
+        self.assertEqual(rate.call_args[0][0], 10)
+
+    def test_cheaper_collectors_run_first(self):
+        scheduler = CollectorScheduler()
+        order = []
+        scheduler.register('gpu', lambda: order.append('gpu') or {}, cost=3)
+        scheduler.register('memory', lambda: order.append('memory') or {}, cost=1)
+        scheduler.run_due(1000)
+        self.assertEqual(order, ['memory', 'gpu'])
+
+    def test_failing_collector_keeps_last_values(self):
+        scheduler = CollectorScheduler()
+        func = MagicMock(side_effect=[{'memory_percent': 50}, RuntimeError('boom')])
+        scheduler.register('memory', func)
+        scheduler.run_due(1000)
+        scheduler.run_due(1001)
+        self.assertEqual(scheduler.snapshot(), {'memory_percent': 50})
+
+    def test_set_interval(self):
+        scheduler = CollectorScheduler()
+        func = MagicMock(return_value={})
+        scheduler.register('disk', func, interval=60)
+        scheduler.run_due(1000)
+        scheduler.set_interval('disk', 0)
+        scheduler.run_due(1001)
+        scheduler.run_due(1002)
+        self.assertEqual(func.call_count, 3)
+
+
+    def test_collectors_run_concurrently(self):
+        scheduler = CollectorScheduler(max_workers=2)
+        barrier = threading.Barrier(2, timeout=1)
+        # Each only returns once the other one is running too
+        scheduler.register('cpu', lambda: barrier.wait() and {} or {'cpu_usage_percent': 1})
+        scheduler.register('memory', lambda: barrier.wait() and {} or {'memory_percent': 2})
+        scheduler.run_due(1000)
+        self.assertEqual(len(scheduler.snapshot()), 2)
+        scheduler.close()
+
+    def test_late_collector_is_stale_and_backed_off(self):
+        scheduler = CollectorScheduler(max_workers=2, timeout=0.05)
+        release = threading.Event()
+        values = iter([{'gpu_temp_c': 40}, {'gpu_temp_c': 41}, {'gpu_temp_c': 42}])
+        def gpu():
+            value = next(values)
+            if value['gpu_temp_c'] == 41:
+                release.wait(1)  # Wedged driver call
+            return value
+        scheduler.register('gpu', gpu)
+        scheduler.register('memory', lambda: {'memory_percent': 50})
+        diagnostics = scheduler.diagnostics = MagicMock()
+
+        scheduler.run_due(1000)
+        self.assertEqual(scheduler.stale(), [])
+
+        started = time.monotonic()
+        scheduler.run_due(1001)
+        self.assertLess(time.monotonic() - started, 0.5)
+        # The last good value is kept, marked stale
+        self.assertEqual(scheduler.snapshot(count_stale=True),
+                         {'gpu_temp_c': 40, 'memory_percent': 50, 'collectors_stale': 1})
+        self.assertEqual(scheduler.stale(), ['gpu'])
+        self.assertIsInstance(diagnostics.record_error.call_args[0][1], TimeoutError)
+        # Still running: not started a second time
+        self.assertNotIn(scheduler.collectors['gpu'], scheduler.due(1002))
+
+        release.set()
+        for _ in range(100):
+            if not scheduler.collectors['gpu'].running:
+                break
+            time.sleep(0.01)
+        self.assertEqual(scheduler.snapshot(), {'gpu_temp_c': 41, 'memory_percent': 50})
+        self.assertEqual(scheduler.stale(), [])
+        gpu_collector = scheduler.collectors['gpu']
+        self.assertEqual(gpu_collector.timeouts, 1)
+        scheduler.close()
+
+    def test_backoff_doubles_with_each_miss(self):
+        scheduler = CollectorScheduler(max_workers=1, timeout=0.01)
+        collector = scheduler.register('gpu', lambda: time.sleep(0.03) or {})
+        delays = []
+        for _ in range(3):
+            scheduler.run_due(scheduler._heap[0][0])
+            while collector.running:
+                time.sleep(0.005)
+            delays.append(scheduler._heap[0][0] - time.time())
+        self.assertEqual(collector.timeouts, 3)
+        # 0.01s deadline: backed off 0.01, 0.02 then 0.04s after it returned
+        self.assertLess(delays[0], delays[1])
+        self.assertLess(delays[1], delays[2])
+        self.assertLess(delays[2], 0.04)
+        scheduler.close()
+
+
+class TestCounterDelta(unittest.TestCase):
+    def test_decrease_is_a_reset(self):
+        self.assertEqual(counter_delta(100, 150), 50)
+        # A 64-bit counter that was reset (device re-added, cgroup reused)
+        self.assertEqual(counter_delta(3_000_000_000, 100), -1)
+
+    def test_wrap_of_narrow_counter(self):
+        self.assertEqual(counter_delta(2**32 - 10, 5, width=32), 15)
+        self.assertEqual(counter_delta(2**33, 5, width=32), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import sys
+import os
+import json
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from compact import CompactEncoder, decode
+from mqtt_client import MQTTClient
+
+
+class TestCompactEncoder(unittest.TestCase):
+    def test_round_trip(self):
+        encoder = CompactEncoder()
+        stats = {
+            'cpu_usage_percent': 12.3,
+            'cpu_core_117_usage_percent': 99.9,
+            'memory_total_mb': 64000,
+            'boot_time': 1700000123.0,
+            'load_1m': 0.05,
+        }
+        payload, changed = encoder.encode(stats)
+        self.assertTrue(changed)
+        schema = json.loads(encoder.schema)
+        # Too large for float32 to hold to the second
+        self.assertEqual(schema['types'][schema['keys'].index('boot_time')], 'd')
+
+        self.assertEqual(decode(schema, payload), {
+            'cpu_usage_percent': 12.3,
+            'cpu_core_117_usage_percent': 99.9,
+            'memory_total_mb': 64000,
+            'boot_time': 1700000123,
+            'load_1m': 0.05,
+        })
+        self.assertLess(len(payload), len(json.dumps(stats)) / 2)
+
+    def test_schema_changes_with_key_set(self):
+        encoder = CompactEncoder()
+        first, changed = encoder.encode({'cpu_usage_percent': 1.0})
+        schema = json.loads(encoder.schema)
+
+        second, changed = encoder.encode({'cpu_usage_percent': 2.0})
+        self.assertFalse(changed)
+        # Each payload is its own copy of the reused buffer
+        self.assertEqual(decode(schema, first), {'cpu_usage_percent': 1})
+        self.assertEqual(decode(schema, second), {'cpu_usage_percent': 2})
+
+        third, changed = encoder.encode({'cpu_usage_percent': 3.0, 'gpu_nvidia_0_temp_c': 60})
+        self.assertTrue(changed)
+        with self.assertRaises(ValueError):
+            decode(schema, third)
+        self.assertEqual(decode(json.loads(encoder.schema), third)['gpu_nvidia_0_temp_c'], 60)
+
+    def test_value_outgrowing_float32_widens_schema(self):
+        encoder = CompactEncoder()
+        encoder.encode({'net_bytes_sent_mb': 100, 'uptime_seconds': 10})
+        payload, changed = encoder.encode({'net_bytes_sent_mb': 100, 'uptime_seconds': 2 ** 24 + 1})
+        self.assertTrue(changed)
+        self.assertEqual(decode(json.loads(encoder.schema), payload)['uptime_seconds'], 2 ** 24 + 1)
+
+
+class TestCompactPublishing(unittest.TestCase):
+    def test_schema_retained_before_state(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test PC", state_encoding='compact')
+        client.client = MagicMock()
+
+        client.publish_update({'cpu_usage_percent': 10.0})
+        client.publish_update({'cpu_usage_percent': 20.0})
+        calls = [(c[0][0], c[0][1], c[1].get('retain')) for c in client.client.publish.call_args_list
+                 if not c[0][0].endswith('/config')]
+
+        self.assertEqual([topic for topic, _, _ in calls], [
+            'homeassistant/sensor/test_pc/schema',
+            'homeassistant/sensor/test_pc/compact',
+            'homeassistant/sensor/test_pc/compact',
+        ])
+        self.assertTrue(calls[0][2])
+        schema = json.loads(calls[0][1])
+        self.assertEqual(decode(schema, calls[2][1]), {'cpu_usage_percent': 20})
+
+        # The broker may have lost the retained schema
+        client._on_connect(client.client, None, {}, 0)
+        client._on_connect(client.client, None, {}, 0)
+        client.client.publish.reset_mock()
+        client.publish_update({'cpu_usage_percent': 30.0})
+        topics = [c[0][0] for c in client.client.publish.call_args_list]
+        self.assertIn('homeassistant/sensor/test_pc/schema', topics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import sys
+import os
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+# Mock dependencies before importing local modules
+sys.modules.setdefault('psutil', MagicMock())
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+import diagnostics
+from diagnostics import Diagnostics, Histogram, StartupProfile
+from collectors import CollectorScheduler
+from mqtt_client import MQTTClient
+
+
+class TestHistogram(unittest.TestCase):
+    def test_window_stats_reset_but_buckets_accumulate(self):
+        histogram = Histogram(bounds=(1, 10, 100))
+        for value in [0.5] * 18 + [5, 500]:
+            histogram.observe(value)
+
+        mean, p95, peak = histogram.window_stats()
+        self.assertAlmostEqual(mean, (0.5 * 18 + 5 + 500) / 20)
+        self.assertEqual(p95, 10)  # 19 of 20 values are <= 10
+        self.assertEqual(peak, 500)
+        self.assertIsNone(histogram.window_stats())
+
+        histogram.observe(50)
+        self.assertEqual(histogram.buckets(), {'1': 18, '10': 19, '100': 20, '+Inf': 21})
+
+
+class TestDiagnostics(unittest.TestCase):
+    def test_collector_durations_and_errors(self):
+        diag = Diagnostics()
+        scheduler = CollectorScheduler(diag)
+        scheduler.register('cpu', lambda: {'cpu_usage_percent': 1.0})
+        scheduler.register('gpu', MagicMock(side_effect=PermissionError('denied')))
+        scheduler.run_due(1000)
+        scheduler.run_due(1001)
+        diag.observe_tick(0.02, overruns=1)
+
+        process = SimpleNamespace(memory_info=lambda: SimpleNamespace(rss=50 * 1024 * 1024))
+        with patch.object(diagnostics.psutil, 'Process', return_value=process):
+            values, details = diag.collect()
+
+        self.assertIn('diag_collector_cpu_ms_mean', values)
+        self.assertIn('diag_collector_gpu_ms_p95', values)
+        self.assertEqual(details['diag_collector_cpu_ms_max']['+Inf'], 2)
+        self.assertEqual(values['diag_errors_gpu'], 2)
+        self.assertEqual(details['diag_errors_gpu'], {'PermissionError': 2})
+        self.assertEqual(values['diag_ticks'], 1)
+        self.assertEqual(values['diag_tick_overruns'], 1)
+        self.assertEqual(values['diag_tick_ms_max'], 20.0)
+        self.assertEqual(values['diag_rss_mb'], 50.0)
+
+        # Durations are per window, counters are totals
+        values, _ = diag.collect()
+        self.assertNotIn('diag_collector_cpu_ms_mean', values)
+        self.assertEqual(values['diag_errors_gpu'], 2)
+        self.assertIn('diag_cpu_percent', values)
+
+    def test_startup_profile(self):
+        with patch('diagnostics.time.perf_counter', side_effect=[1.0, 1.2, 1.25, 2.0]):
+            profile = StartupProfile()
+            profile.mark('imports')
+            profile.mark('monitor')
+            profile.mark('first_publish')
+        self.assertEqual(profile.phases, [('imports', 200.0), ('monitor', 50.0), ('first_publish', 750.0)])
+        self.assertIn('first_publish', profile.report())
+
+        diag = Diagnostics()
+        diag.set_startup(profile)
+        values, details = diag.collect()
+        self.assertEqual(values['diag_startup_ms'], 1000.0)
+        self.assertEqual(details['diag_startup_ms']['monitor'], 50.0)
+
+    def test_published_as_diagnostic_entities(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test PC")
+        client.client = MagicMock()
+
+        client.publish_diagnostics({'diag_errors_gpu': 2, 'diag_ticks': 5},
+                                   {'diag_errors_gpu': {'PermissionError': 2}})
+        client.publish_diagnostics({'diag_errors_gpu': 3, 'diag_ticks': 6},
+                                   {'diag_errors_gpu': {'PermissionError': 3}})
+
+        calls = client.client.publish.call_args_list
+        configs = {c[0][0]: json.loads(c[0][1]) for c in calls if c[0][0].endswith('/config')}
+        states = [json.loads(c[0][1]) for c in calls if c[0][0].endswith('/diagnostics')]
+
+        # Discovered once, on the diagnostics topic
+        self.assertEqual(len(configs), 2)
+        errors = configs['homeassistant/sensor/test_pc/diag_errors_gpu/config']
+        self.assertEqual(errors['entity_category'], 'diagnostic')
+        self.assertEqual(errors['state_topic'], 'homeassistant/sensor/test_pc/diagnostics')
+        self.assertIn('json_attributes_template', errors)
+        self.assertNotIn('json_attributes_topic',
+                         configs['homeassistant/sensor/test_pc/diag_ticks/config'])
+        self.assertEqual(states[-1]['diag_ticks'], 6)
+        self.assertEqual(states[-1]['details']['diag_errors_gpu'], {'PermissionError': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import sys
+import os
+import time
+import tempfile
+import threading
+import unittest
+from collections import namedtuple
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from disks import DiskUsage, DiskIO
+
+MOUNTS = """overlay / overlay rw,relatime 0 0
+proc /proc proc rw,nosuid 0 0
+tmpfs /dev tmpfs rw 0 0
+/dev/sda1 /etc/hosts ext4 rw 0 0
+/dev/sda1 /mnt/data ext4 rw 0 0
+/dev/sda1 /mnt/data/sub ext4 rw 0 0
+nas:/export /mnt/nas nfs4 rw 0 0
+/dev/sdb1 /devdata ext4 rw 0 0
+tmpfs /dev/shm tmpfs rw 0 0
+/dev/sdc1 /dev/sdc-data ext4 rw 0 0
+cgroup2 /sys/fs/cgroup cgroup2 ro 0 0
+"""
+
+statvfs_result = namedtuple('statvfs_result', 'f_blocks f_bfree f_bavail f_frsize')
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class TestDiskUsage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        write_file(os.path.join(self.tmp.name, 'self/mounts'), MOUNTS)
+        self.release_nfs = threading.Event()
+
+    def tearDown(self):
+        self.release_nfs.set()
+        self.tmp.cleanup()
+
+    def fake_statvfs(self, path):
+        if path == '/mnt/nas':
+            # Hung NFS server
+            self.release_nfs.wait()
+        # 100 GiB disk, 40% used
+        return statvfs_result(100 * 1024**2, 60 * 1024**2, 60 * 1024**2, 1024)
+
+    def test_discovers_real_mounts_once_per_device(self):
+        usage = DiskUsage(self.tmp.name)
+        usage.discover()
+        # Only whole path components are matched against /dev, /proc, ...
+        self.assertEqual(usage.mounts, [('/', 'root'), ('/devdata', 'devdata'),
+                                        ('/mnt/data', 'mnt_data'), ('/mnt/nas', 'mnt_nas')])
+
+    def test_hung_mount_does_not_block(self):
+        usage = DiskUsage(self.tmp.name, timeout=0.1)
+        with patch('disks.os.statvfs', side_effect=self.fake_statvfs):
+            started = time.monotonic()
+            data = usage.sample()
+            self.assertLess(time.monotonic() - started, 1)
+
+            self.assertEqual(data['disk_root_usage_percent'], 40.0)
+            self.assertEqual(data['disk_mnt_data_free_gb'], 60)
+            self.assertNotIn('disk_mnt_nas_usage_percent', data)
+
+            # The stuck call isn't retried while it hangs
+            usage.sample()
+            self.assertIn('/mnt/nas', usage._pending)
+
+            self.release_nfs.set()
+            time.sleep(0.05)
+            self.assertIn('disk_mnt_nas_usage_percent', usage.sample())
+
+    def test_hung_mount_keeps_last_values(self):
+        usage = DiskUsage(self.tmp.name, timeout=0.1)
+        with patch('disks.os.statvfs', side_effect=self.fake_statvfs):
+            self.release_nfs.set()
+            first = usage.sample()
+            self.release_nfs.clear()
+            usage.sample()
+            # Hung now, its sensors stay with their last values
+            data = usage.sample()
+            self.assertEqual(data['disk_mnt_nas_usage_percent'], first['disk_mnt_nas_usage_percent'])
+            self.assertEqual(usage.stale, ['/mnt/nas'])
+
+            self.release_nfs.set()
+            time.sleep(0.05)
+            usage.sample()
+            self.assertEqual(usage.stale, [])
+
+
+class TestDiskIO(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.diskstats = os.path.join(self.tmp.name, 'proc/diskstats')
+        for dev in ['sda', 'loop0', 'nvme0n1']:
+            os.makedirs(os.path.join(self.tmp.name, 'sys/block', dev))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_stats(self, sda, nvme):
+        lines = []
+        for name, (reads, sectors_read, writes, sectors_written, io_ms) in [('sda', sda), ('nvme0n1', nvme)]:
+            lines.append(f"   8       0 {name} {reads} 0 {sectors_read} 0 {writes} 0 {sectors_written} 0 0 {io_ms} 0 0 0 0 0")
+        lines.append("   8       1 sda1 1 0 1 0 1 0 1 0 0 1 0 0 0 0 0")
+        lines.append("   7       0 loop0 1 0 1 0 1 0 1 0 0 1 0 0 0 0 0")
+        write_file(self.diskstats, "\n".join(lines) + "\n")
+
+    def test_rates_from_deltas(self):
+        disk_io = DiskIO(os.path.join(self.tmp.name, 'proc'), os.path.join(self.tmp.name, 'sys'))
+        self.write_stats((100, 1000, 100, 1000, 0), (0, 0, 0, 0, 0))
+        self.assertEqual(disk_io.sample(2.0), {})
+
+        self.write_stats((300, 5000, 120, 3000, 1000), (10, 8, 0, 0, 5000))
+        data = disk_io.sample(2.0)
+
+        self.assertEqual(data['disk_sda_read_iops'], 100.0)
+        self.assertEqual(data['disk_sda_read_bytes_per_s'], 4000 * 512 / 2)
+        self.assertEqual(data['disk_sda_write_iops'], 10.0)
+        self.assertEqual(data['disk_sda_util_percent'], 50.0)
+        self.assertEqual(data['disk_nvme0n1_util_percent'], 100.0)
+        # Partitions and loop devices are skipped
+        self.assertFalse(any('sda1' in k or 'loop' in k for k in data))
+        disk_io.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
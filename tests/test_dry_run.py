@@ -1,9 +1,12 @@
 import sys
+import errno
 import unittest
 from unittest.mock import MagicMock, patch, mock_open
 import os
 import json
 import time
+import tempfile
+from collections import namedtuple
 
 # Mock dependencies before importing local modules
 sys.modules['psutil'] = MagicMock()
@@ -15,9 +18,16 @@ sys.modules['pynvml'] = MagicMock()
 # Now we can import our code
 sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
 
-from monitor import SystemMonitor
+import hardware
+from monitor import SystemMonitor, describe_metric
 from mqtt_client import MQTTClient
 
+def write_sysfs(root, rel_path, content):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content + '\n')
+
 class TestSystemMonitor(unittest.TestCase):
     @patch('monitor.platform')
     @patch('monitor.psutil')
@@ -38,7 +48,8 @@ class TestSystemMonitor(unittest.TestCase):
         mock_psutil.net_io_counters.return_value.bytes_recv = 2048
         mock_psutil.boot_time.return_value = 1600000000
 
-        monitor = SystemMonitor()
+        # No /proc/stat: falls back to psutil
+        monitor = SystemMonitor(proc_root='/nonexistent')
         stats = monitor.get_stats()
 
         self.assertIn('cpu_usage_percent', stats)
@@ -49,112 +60,220 @@ class TestSystemMonitor(unittest.TestCase):
         # Verify default values
         self.assertEqual(stats['cpu_usage_percent'], 10.5)
 
-    @patch('monitor.glob.glob')
-    @patch('monitor.os.path.exists')
-    @patch('monitor.os.path.join')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
     @patch('monitor.platform')
-    def test_amd_gpu_detection(self, mock_platform, mock_open_file, mock_join, mock_exists, mock_glob):
+    @patch('monitor.psutil')
+    def test_network_rates(self, mock_psutil, mock_platform):
         mock_platform.system.return_value = 'Linux'
         mock_platform.machine.return_value = 'x86_64'
-        
-        # Mock glob to find one card
-        mock_glob.side_effect = lambda x: ['/sys/class/drm/card0'] if 'card' in x else []
-
-        mock_exists.return_value = True
-        mock_join.side_effect = lambda *args: "/".join(args)
-
-        # Mock file reads. 
-        # Logic: 
-        # 1. Intel check: read vendor -> "0x1002" (Not Intel)
-        # 2. AMD check: read vendor -> "0x1002" (Is AMD)
-        # 3. AMD Usage: read "50"
-        # 4. AMD Temp: read "35000" (35C)
-        # 5. AMD Power: read "50000000" (50W) from power1_average
-        
-        mock_open_file.side_effect = [
-            unittest.mock.mock_open(read_data="0x1002").return_value, # Intel check
-            unittest.mock.mock_open(read_data="0x1002").return_value, # AMD check
-            unittest.mock.mock_open(read_data="50").return_value,     # Usage
-            unittest.mock.mock_open(read_data="35000").return_value,  # Temp
-            unittest.mock.mock_open(read_data="50000000").return_value, # Power
-            unittest.mock.mock_open(read_data="0x1002").return_value, # Extra for safety
-        ]
-
-        monitor = SystemMonitor()
-        stats = monitor.get_stats()
-        
+        snetio = namedtuple('snetio', 'bytes_sent bytes_recv packets_sent packets_recv errin errout dropin dropout')
+
+        monitor = SystemMonitor(proc_root='/nonexistent', collector_intervals={'network': 0})
+        counters = {
+            'eth0': snetio(1000, 1000, 10, 20, 0, 0, 0, 0),
+            'eth1': snetio(5000, 5000, 50, 50, 0, 0, 0, 0),
+            'veth1234': snetio(0, 0, 0, 0, 0, 0, 0, 0),
+        }
+        mock_psutil.net_io_counters.side_effect = lambda pernic=False: counters if pernic else MagicMock()
+        monitor.collectors.run_due(1000)
+        # No rates, and no totals, before there are two samples
+        self.assertNotIn('net_rx_bytes_per_s', monitor.collectors.snapshot())
+
+        counters = {
+            # psutil (nowrap=True) already undoes 32-bit wraps
+            'eth0': snetio(3000, 3000, 30, 40, 1, 1, 0, 2),
+            # Counters went backwards: the interface was reset
+            'eth1': snetio(10, 10, 1, 1, 0, 0, 0, 0),
+            'veth1234': snetio(100, 100, 1, 1, 0, 0, 0, 0),
+        }
+        monitor.collectors.run_due(1002)
+        stats = monitor.collectors.snapshot()
+
+        self.assertEqual(stats['net_eth0_tx_bytes_per_s'], 1000.0)
+        self.assertEqual(stats['net_eth0_rx_bytes_per_s'], 1000.0)
+        self.assertEqual(stats['net_eth0_rx_packets_per_s'], 10.0)
+        self.assertEqual(stats['net_eth0_errors_per_s'], 1.0)
+        self.assertEqual(stats['net_eth0_drops_per_s'], 1.0)
+        self.assertNotIn('net_eth1_rx_bytes_per_s', stats)
+        self.assertFalse(any(k.startswith('net_veth') for k in stats))
+        self.assertEqual(stats['net_rx_bytes_per_s'], 1000.0)
+
+        # Removed interfaces, excluded or not, are forgotten
+        counters = {'eth0': counters['eth0']}
+        monitor.collectors.run_due(1004)
+        self.assertEqual(list(monitor._net_keys), ['eth0'])
+
+    @patch('monitor.platform')
+    def test_amd_gpu_detection(self, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            card = 'class/drm/card0'
+            write_sysfs(sysfs, f'{card}/device/vendor', '0x1002')
+            write_sysfs(sysfs, f'{card}/device/gpu_busy_percent', '50')
+            write_sysfs(sysfs, f'{card}/device/hwmon/hwmon3/temp1_input', '35000')     # 35C
+            write_sysfs(sysfs, f'{card}/device/hwmon/hwmon3/power1_average', '50000000')  # 50W
+
+            monitor = SystemMonitor(sysfs_root=sysfs)
+            stats = monitor.get_stats()
+
         self.assertIn('gpu_amd_card0_usage_percent', stats)
         self.assertEqual(stats['gpu_amd_card0_usage_percent'], 50)
         self.assertIn('gpu_amd_card0_power_watts', stats)
         self.assertEqual(stats['gpu_amd_card0_power_watts'], 50.0)
+        self.assertEqual(stats['gpu_amd_card0_temp_c'], 35.0)
 
-    @patch('monitor.glob.glob')
-    @patch('monitor.os.path.exists')
-    @patch('monitor.os.path.join')
-    @patch('builtins.open', new_callable=unittest.mock.mock_open)
     @patch('monitor.platform')
-    def test_cpu_power_calculation(self, mock_platform, mock_open_file, mock_join, mock_exists, mock_glob):
+    def test_cpu_power_calculation(self, mock_platform):
         mock_platform.system.return_value = 'Linux'
         mock_platform.machine.return_value = 'x86_64'
-        
-        # Mock rapl paths
-        mock_exists.return_value = True
-        mock_glob.side_effect = [
-            ['/sys/class/drm/card0'], # drm card glob (first call)
-            ['/sys/class/powercap/intel-rapl/intel-rapl:0'], # rapl packages (first call)
-            ['/sys/class/drm/card0'], # drm card glob (second call)
-            ['/sys/class/powercap/intel-rapl/intel-rapl:0'], # rapl packages (second call)
-            [], [] # extra calls
-        ]
-        mock_join.side_effect = lambda *args: "/".join(args)
-
-        # Monitor Logic calls CPU stats then GPU stats.
-        # We want to test CPU stats.
-        # CPU Stats Logic:
-        # Glob rapl packages. For each: read name, read energy_uj.
-        
-        # First call:
-        # Read name: "package-0"
-        # Read energy: "1000000" (1J)
-        
-        # Second call:
-        # Read name: "package-0"
-        # Read energy: "2000000" (2J) -> Delta 1J in X seconds
-        
-        # We need to interleave these returns with the GPU logic calls or ensure GPU logic doesn't crash/consume too many side effects.
-        # To simplify, let's assume GPU returns nothing or fails gracefully.
-        # But we need to handle the vendor/file reads if GPU logic runs.
-        # Easier: Mock platform such that GPU logic is skipped or make glob return empty for drm.
-        
-        # Re-setup mocks strictly for this test to avoid complexity
-        mock_glob.side_effect = lambda x: ['/sys/class/powercap/intel-rapl/intel-rapl:0'] if 'intel-rapl' in x else []
-        
-        monitor = SystemMonitor()
-        
-        # First Call
-        mock_open_file.side_effect = [
-            unittest.mock.mock_open(read_data="package-0").return_value,
-            unittest.mock.mock_open(read_data="1000000").return_value,
-        ]
-        monitor.get_stats()
-        
-        # Wait a bit to ensure non-zero delta
-        time.sleep(0.1)
-        
-        # Second Call
-        mock_open_file.side_effect = [
-            unittest.mock.mock_open(read_data="package-0").return_value,
-            unittest.mock.mock_open(read_data="2000000").return_value,
-        ]
-        stats = monitor.get_stats()
-        
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            pkg = 'class/powercap/intel-rapl/intel-rapl:0'
+            write_sysfs(sysfs, f'{pkg}/name', 'package-0')
+            write_sysfs(sysfs, f'{pkg}/energy_uj', '1000000')  # 1J
+
+            monitor = SystemMonitor(sysfs_root=sysfs)
+            monitor.get_stats()
+
+            # Wait a bit to ensure non-zero delta
+            time.sleep(0.1)
+
+            write_sysfs(sysfs, f'{pkg}/energy_uj', '2000000')  # 2J -> Delta 1J
+            stats = monitor.get_stats()
+
         self.assertIn('cpu_power_package-0_watts', stats)
         # 1,000,000 uJ diff = 1 Joule.
         # Time delta approx 0.1s. Power = 1J / 0.1s = 10W.
         # Allow some float margin
         self.assertAlmostEqual(stats['cpu_power_package-0_watts'], 10.0, delta=2.0)
 
+    @patch('monitor.psutil')
+    @patch('monitor.platform')
+    def test_temperature_error_keeps_cpu_power(self, mock_platform, mock_psutil):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+        mock_psutil.sensors_temperatures.side_effect = OSError(errno.EIO, 'EIO')
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            pkg = 'class/powercap/intel-rapl/intel-rapl:0'
+            write_sysfs(sysfs, f'{pkg}/name', 'package-0')
+            write_sysfs(sysfs, f'{pkg}/energy_uj', '1000000')
+
+            monitor = SystemMonitor(sysfs_root=sysfs)
+            monitor.get_stats()
+            time.sleep(0.1)
+            # A slow I2C sensor bus fails, the energy counter still advances
+            write_sysfs(sysfs, f'{pkg}/energy_uj', '2000000')
+            stats = monitor.get_stats()
+
+        self.assertAlmostEqual(stats['cpu_power_package-0_watts'], 10.0, delta=2.0)
+        _, errors = monitor.diagnostics.totals()
+        self.assertEqual(errors[('cpu_temp', 'OSError')], 2)
+
+    @patch('monitor.platform')
+    def test_hardware_discovered_once(self, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            write_sysfs(sysfs, 'class/drm/card0/device/vendor', '0x8086')
+            write_sysfs(sysfs, 'class/drm/card0/gt_act_freq_mhz', '300')
+
+            monitor = SystemMonitor(sysfs_root=sysfs)
+            with patch('hardware.glob.glob', wraps=hardware.glob.glob) as mock_glob:
+                monitor.get_stats()
+                scans = mock_glob.call_count
+                monitor.get_stats()
+                # The second tick reads the known files without globbing
+                self.assertEqual(mock_glob.call_count, scans)
+
+                # A hotplugged card shows up after an explicit rescan
+                write_sysfs(sysfs, 'class/drm/card1/device/vendor', '0x8086')
+                write_sysfs(sysfs, 'class/drm/card1/gt_act_freq_mhz', '450')
+                monitor.rescan_hardware()
+                stats = monitor.get_stats()
+
+        self.assertEqual(stats['gpu_intel_card0_freq_mhz'], 300)
+        self.assertEqual(stats['gpu_intel_card1_freq_mhz'], 450)
+
+    @patch('monitor.platform')
+    def test_close_releases_files(self, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            pkg = 'class/powercap/intel-rapl/intel-rapl:0'
+            write_sysfs(sysfs, f'{pkg}/name', 'package-0')
+            write_sysfs(sysfs, f'{pkg}/energy_uj', '1000000')
+            write_sysfs(sysfs, 'class/drm/card0/device/vendor', '0x8086')
+            write_sysfs(sysfs, 'class/drm/card0/gt_act_freq_mhz', '300')
+
+            monitor = SystemMonitor(sysfs_root=sysfs)
+            monitor.get_stats()
+            domains = list(monitor.energy.domains.values())
+            self.assertTrue(monitor.sysfs.attributes)
+            monitor.procstat = MagicMock()
+            monitor.disk_io = MagicMock()
+            monitor.containers = MagicMock()
+            monitor.processes = MagicMock()
+            monitor.nvidia = MagicMock()
+
+            monitor.close()
+
+        self.assertFalse(monitor.sysfs.attributes)
+        self.assertEqual([d.attr.fd for d in domains], [None])
+        for collector in (monitor.procstat, monitor.disk_io, monitor.containers, monitor.processes, monitor.nvidia):
+            collector.close.assert_called_once_with()
+
+    @patch('monitor.platform')
+    def test_rescan_only_when_device_gone(self, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            write_sysfs(sysfs, 'class/drm/card0/device/vendor', '0x8086')
+            write_sysfs(sysfs, 'class/drm/card0/gt_act_freq_mhz', '300')
+            monitor = SystemMonitor(sysfs_root=sysfs)
+            monitor.get_stats()
+
+            # A GPU in a low-power state fails its reads, it's still there
+            with patch.object(monitor.sysfs, 'read_int', side_effect=OSError(errno.EIO, 'EIO')):
+                with patch('hardware.glob.glob', wraps=hardware.glob.glob) as mock_glob:
+                    for _ in range(3):
+                        monitor.get_stats()
+                    self.assertEqual(mock_glob.call_count, 0)
+            self.assertEqual(monitor.diagnostics.totals()[1][('sysfs', 'OSError')], 3)
+
+            with patch.object(monitor.sysfs, 'read_int', side_effect=OSError(errno.ENODEV, 'ENODEV')):
+                monitor.get_stats()
+            self.assertIsNone(monitor.hardware.last_scan)
+
+    @patch('monitor.platform')
+    def test_nvml_loaded_only_with_nvidia_gpu(self, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        pynvml = sys.modules['pynvml']
+
+        with tempfile.TemporaryDirectory() as sysfs:
+            # An NVIDIA USB controller alone is not a GPU
+            write_sysfs(sysfs, 'bus/pci/devices/0000:01:00.2/vendor', '0x10de')
+            write_sysfs(sysfs, 'bus/pci/devices/0000:01:00.2/class', '0x0c0330')
+            mock_platform.machine.return_value = 'x86_64'
+            pynvml.reset_mock()
+            self.assertIsNone(SystemMonitor(sysfs_root=sysfs, proc_root='/nonexistent').nvidia)
+            pynvml.nvmlInit.assert_not_called()
+
+            write_sysfs(sysfs, 'bus/pci/devices/0000:01:00.0/vendor', '0x10de')
+            write_sysfs(sysfs, 'bus/pci/devices/0000:01:00.0/class', '0x030000')
+            self.assertTrue(hardware.has_nvidia_gpu(sysfs, '/nonexistent'))
+            self.assertIsNotNone(SystemMonitor(sysfs_root=sysfs, proc_root='/nonexistent').nvidia)
+            pynvml.nvmlInit.assert_called_once()
+
+            # The GPU collector skips ARM, so NVML isn't worth loading there
+            mock_platform.machine.return_value = 'aarch64'
+            pynvml.reset_mock()
+            self.assertIsNone(SystemMonitor(sysfs_root=sysfs, proc_root='/nonexistent').nvidia)
+            pynvml.nvmlInit.assert_not_called()
 
 
 class TestMQTTClient(unittest.TestCase):
@@ -178,5 +297,80 @@ class TestMQTTClient(unittest.TestCase):
         
         self.assertTrue(any("homeassistant/sensor/test_device/cpu_usage_percent/config" in t for t in topics))
 
+    def test_delta_publishing(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test Device",
+                            publish_mode='delta', deadband=(1.0, 0.0),
+                            deadbands={'cpu_power_': (0.0, 0.1)}, full_refresh_ticks=3)
+        client.client.publish = MagicMock()
+
+        def published():
+            topics = {c[0][0].split('/')[-2]: json.loads(c[0][1])
+                      for c in client.client.publish.call_args_list if c[0][0].endswith('/state')}
+            client.client.publish.reset_mock()
+            return topics
+
+        client.publish_update({"cpu_usage_percent": 10.0, "cpu_power_package-0_watts": 20.0, "boot_time": 1})
+        self.assertEqual(len(published()), 3)
+        self.assertEqual(client.publish_stats()['mqtt_publish_messages'], 3)
+
+        # Within the absolute deadband / 10% relative deadband: nothing is sent
+        client.publish_update({"cpu_usage_percent": 10.5, "cpu_power_package-0_watts": 21.0, "boot_time": 1})
+        self.assertEqual(published(), {})
+        self.assertEqual(client.publish_stats(), {'mqtt_publish_messages': 0, 'mqtt_publish_bytes': 0})
+
+        client.publish_update({"cpu_usage_percent": 12.0, "cpu_power_package-0_watts": 21.0, "boot_time": 1})
+        self.assertEqual(published(), {"cpu_usage_percent": 12.0})
+
+        # Forced full refresh
+        client.publish_update({"cpu_usage_percent": 12.0, "cpu_power_package-0_watts": 21.0, "boot_time": 1})
+        self.assertEqual(len(published()), 3)
+
+    def test_delta_discovery_uses_metric_topics(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test Device", publish_mode='delta')
+        client.client.publish = MagicMock()
+        client.publish_discovery({"cpu_usage_percent": 10.5})
+        payload = json.loads(client.client.publish.call_args[0][1])
+        self.assertEqual(payload["state_topic"], "homeassistant/sensor/test_device/cpu_usage_percent/state")
+        self.assertNotIn("value_template", payload)
+
+    def test_discovery_only_for_changed_key_set(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test Device",
+                            describe_metric=describe_metric, removal_ticks=2)
+        client.client.publish = MagicMock()
+
+        def config_topics():
+            topics = [c[0][0] for c in client.client.publish.call_args_list if c[0][0].endswith('/config')]
+            client.client.publish.reset_mock()
+            return topics
+
+        client.publish_discovery({"cpu_usage_percent": 1, "net_bytes_sent_mb": 5})
+        self.assertEqual(len(config_topics()), 2)
+
+        # Same key set: only the state is published
+        client.publish_update({"cpu_usage_percent": 2, "net_bytes_sent_mb": 6})
+        self.assertEqual(config_topics(), [])
+
+        # A metric appearing after startup (e.g. GPU hotplug) gets discovered
+        client.publish_update({"cpu_usage_percent": 2, "net_bytes_sent_mb": 6, "gpu_amd_card1_temp_c": 40.0})
+        self.assertEqual(config_topics(), ["homeassistant/sensor/test_device/gpu_amd_card1_temp_c/config"])
+
+        # A metric missing for removal_ticks updates is removed with an empty config
+        client.publish_update({"cpu_usage_percent": 2, "net_bytes_sent_mb": 6})
+        self.assertEqual(config_topics(), [])
+        client.publish_update({"cpu_usage_percent": 2, "net_bytes_sent_mb": 6})
+        client.client.publish.assert_any_call("homeassistant/sensor/test_device/gpu_amd_card1_temp_c/config", "", retain=True)
+
+    def test_discovery_uses_declared_metadata(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test Device", describe_metric=describe_metric)
+        client.client.publish = MagicMock()
+        client.publish_discovery({"net_bytes_sent_mb": 5, "load_1m": 0.5})
+        payloads = {c[0][0]: json.loads(c[0][1]) for c in client.client.publish.call_args_list}
+
+        net = payloads["homeassistant/sensor/test_device/net_bytes_sent_mb/config"]
+        self.assertEqual(net["state_class"], "total_increasing")
+        self.assertEqual(net["unit_of_measurement"], "MB")
+        load = payloads["homeassistant/sensor/test_device/load_1m/config"]
+        self.assertNotIn("unit_of_measurement", load)
+
 if __name__ == '__main__':
     unittest.main()
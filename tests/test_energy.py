@@ -0,0 +1,162 @@
+import sys
+import os
+import errno
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from hardware import HardwareRegistry
+from energy import EnergyCounters
+
+PKG = 'class/powercap/intel-rapl/intel-rapl:0'
+MAX_RANGE = 262143328850
+
+
+def write_file(root, path, content):
+    path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(f'{content}\n')
+
+
+class TestEnergyDomains(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.sysfs = self.tmp.name
+
+    def test_rapl_subdomains(self):
+        write_file(self.sysfs, f'{PKG}/name', 'package-0')
+        write_file(self.sysfs, f'{PKG}/energy_uj', 0)
+        write_file(self.sysfs, f'{PKG}/max_energy_range_uj', MAX_RANGE)
+        for sub, name in enumerate(['core', 'dram']):
+            write_file(self.sysfs, f'{PKG}/intel-rapl:0:{sub}/name', name)
+            write_file(self.sysfs, f'{PKG}/intel-rapl:0:{sub}/energy_uj', 0)
+        write_file(self.sysfs, 'class/powercap/intel-rapl/intel-rapl:1/name', 'psys')
+        write_file(self.sysfs, 'class/powercap/intel-rapl/intel-rapl:1/energy_uj', 0)
+
+        registry = HardwareRegistry(self.sysfs)
+        registry.scan()
+        self.assertEqual([(d['name'], d['max_range']) for d in registry.energy_domains], [
+            ('package-0', MAX_RANGE),
+            ('package-0_core', None),
+            ('package-0_dram', None),
+            ('psys', None),
+        ])
+
+    def test_amd_energy_sockets(self):
+        hwmon = 'class/hwmon/hwmon3'
+        write_file(self.sysfs, f'{hwmon}/name', 'amd_energy')
+        write_file(self.sysfs, f'{hwmon}/energy1_label', 'Ecore000')
+        write_file(self.sysfs, f'{hwmon}/energy1_input', 0)
+        write_file(self.sysfs, f'{hwmon}/energy2_label', 'Esocket0')
+        write_file(self.sysfs, f'{hwmon}/energy2_input', 0)
+
+        registry = HardwareRegistry(self.sysfs)
+        registry.scan()
+        self.assertEqual([d['name'] for d in registry.energy_domains], ['socket0'])
+
+
+class TestEnergyCounters(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.sysfs = self.tmp.name
+        write_file(self.sysfs, f'{PKG}/name', 'package-0')
+        write_file(self.sysfs, f'{PKG}/max_energy_range_uj', MAX_RANGE)
+        self.set_energy(MAX_RANGE - 1_000_000)
+
+    def set_energy(self, uj):
+        write_file(self.sysfs, f'{PKG}/energy_uj', uj)
+
+    def counters(self):
+        registry = HardwareRegistry(self.sysfs)
+        registry.scan()
+        energy = EnergyCounters()
+        energy.set_domains(registry.energy_domains)
+        return energy
+
+    def test_wrap_corrected(self):
+        energy = self.counters()
+        data = energy.sample(1.0)
+        self.assertNotIn('cpu_power_package-0_watts', data)
+        self.assertEqual(data['cpu_energy_package-0_kwh'], 0)
+
+        # Wrapped: 1J up to the range and 2J after it
+        self.set_energy(2_000_000)
+        data = energy.sample(1.0)
+        self.assertEqual(data['cpu_power_package-0_watts'], 3.0)
+
+        self.set_energy(3_600_000_000 + 2_000_000)
+        data = energy.sample(10.0)
+        self.assertEqual(data['cpu_power_package-0_watts'], 360.0)
+        self.assertEqual(data['cpu_energy_package-0_kwh'], round(3_603_000_000 / 3.6e12, 6))
+
+    def test_reset_without_range_skipped(self):
+        os.remove(os.path.join(self.sysfs, PKG, 'max_energy_range_uj'))
+        self.set_energy(5_000_000)
+        energy = self.counters()
+        energy.sample(1.0)
+        self.set_energy(1_000_000)
+        self.assertNotIn('cpu_power_package-0_watts', energy.sample(1.0))
+        self.set_energy(2_000_000)
+        self.assertEqual(energy.sample(1.0)['cpu_power_package-0_watts'], 1.0)
+
+    def test_polls_between_samples_catch_every_wrap(self):
+        energy = self.counters()
+        energy.sample(1.0)
+        # Two wraps within one sample interval, each seen by a poll
+        for reading in (MAX_RANGE // 2, 1_000_000, MAX_RANGE // 2, 1_000_000):
+            self.set_energy(reading)
+            energy.poll()
+        data = energy.sample(1000.0)
+        self.assertEqual(data['cpu_power_package-0_watts'], round(2 * MAX_RANGE / 1e6 / 1000, 2))
+
+    def test_unreadable_counter_skipped_without_rescan(self):
+        invalidate = MagicMock()
+        diagnostics = MagicMock()
+        registry = HardwareRegistry(self.sysfs)
+        registry.scan()
+        energy = EnergyCounters(invalidate, diagnostics)
+        energy.set_domains(registry.energy_domains)
+        domain = energy.domains[registry.energy_domains[0]['path']]
+
+        # Root-only energy_uj in a rootless container
+        with patch.object(domain.attr, 'read_int', side_effect=PermissionError(errno.EACCES, 'EACCES')) as read:
+            for _ in range(5):
+                self.assertEqual(energy.sample(1.0), {})
+            self.assertEqual(read.call_count, 1)
+        invalidate.assert_not_called()
+        self.assertEqual(diagnostics.record_error.call_count, 1)
+
+        # Retried after the next scan
+        energy.set_domains(registry.energy_domains)
+        self.assertIn('cpu_energy_package-0_kwh', energy.sample(1.0))
+
+        with patch.object(domain.attr, 'read_int', side_effect=OSError(errno.ENODEV, 'ENODEV')):
+            energy.sample(1.0)
+        invalidate.assert_called_once_with()
+
+    def test_state_round_trip(self):
+        energy = self.counters()
+        energy.sample(1.0)
+        self.set_energy(1_000_000)
+        energy.sample(1.0)
+        readings, totals = energy.export_state()
+
+        restarted = EnergyCounters()
+        restarted.import_state(readings, totals)
+        self.set_energy(3_000_000)
+        registry = HardwareRegistry(self.sysfs)
+        registry.scan()
+        restarted.set_domains(registry.energy_domains)
+        data = restarted.sample(2.0)
+        # Power right away, and the total carries on
+        self.assertEqual(data['cpu_power_package-0_watts'], 1.0)
+        self.assertEqual(data['cpu_energy_package-0_kwh'], round(4_000_000 / 3.6e12, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+import sys
+import os
+import gzip
+import unittest
+import urllib.request
+from unittest.mock import MagicMock
+
+# Mock dependencies before importing local modules
+sys.modules.setdefault('psutil', MagicMock())
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from exporter import PrometheusExporter
+from diagnostics import Diagnostics
+from monitor import METRIC_LABELS, describe_metric
+
+
+# Sample name suffixes each OpenMetrics family type allows
+SAMPLE_SUFFIXES = {
+    'gauge': ('',),
+    'counter': ('_total', '_created'),
+    'histogram': ('_bucket', '_count', '_sum', '_created'),
+}
+
+
+def assert_openmetrics(test, text):
+    """
+    The checks of an OpenMetrics parser that a scraper would reject the
+    whole exposition for: one TYPE per family, samples directly after their
+    family's TYPE, and sample names that belong to their family. Also that
+    no gauge or counter family mixes an unlabelled series with labelled
+    ones, which sum() would count twice.
+    """
+    lines = text.splitlines()
+    test.assertEqual(lines[-1], '# EOF')
+    families = set()
+    labelled = {}  # {family: set of whether each series has labels}
+    family = metric_type = None
+    for line in lines[:-1]:
+        if line.startswith('# TYPE '):
+            family, metric_type = line.split()[2:]
+            test.assertNotIn(family, families, 'Clashing name: ' + family)
+            families.add(family)
+            continue
+        test.assertIsNotNone(family, line)
+        sample = line.split('{')[0].split(' ')[0]
+        test.assertIn(sample, [family + suffix for suffix in SAMPLE_SUFFIXES[metric_type]], line)
+        if metric_type in ('gauge', 'counter'):
+            labelled.setdefault(family, set()).add('{' in line.split(' ')[0])
+    for name, kinds in labelled.items():
+        test.assertEqual(len(kinds), 1, 'Labelled and unlabelled series in ' + name)
+    # A sample name can't be claimed by two families
+    samples = [f + suffix for f in families for suffix in ('', '_total', '_bucket', '_count', '_sum')]
+    for name in families:
+        test.assertEqual(samples.count(name), 1, 'Clashing name: ' + name)
+
+
+class TestPrometheusExporter(unittest.TestCase):
+    def make_exporter(self, diagnostics=None):
+        return PrometheusExporter(0, '127.0.0.1', describe_metric=describe_metric,
+                                  label_rules=METRIC_LABELS, diagnostics=diagnostics)
+
+    def test_labels_and_types(self):
+        exporter = self.make_exporter()
+        text = exporter.render({
+            'cpu_usage_percent': 12.5,
+            'cpu_core_0_usage_percent': 10.0,
+            'cpu_core_1_usage_percent': 15.0,
+            'cpu_core_1_usage_percent_max': 40.0,
+            'cpu_power_package-0_watts': 35.2,
+            'gpu_nvidia_0_temp_c': 61,
+            'gpu_amd_card1_temp_c': 55.0,
+            'net_eth0_rx_bytes_per_s': 1024.0,
+            'disk_nvme0n1_read_iops': 3.0,
+            'disk_mnt_data_free_gb': 100,
+            'uptime_seconds': 3600,
+            'sampler_jitter_ms_mean': 0.4,
+        })
+        lines = text.splitlines()
+
+        self.assertEqual(lines[-1], '# EOF')
+        self.assertIn('# TYPE system_monitor_cpu_core_usage_percent gauge', lines)
+        self.assertIn('system_monitor_cpu_core_usage_percent{core="0"} 10.0', lines)
+        self.assertIn('system_monitor_cpu_core_usage_percent{aggregate="max",core="1"} 40.0', lines)
+        self.assertIn('system_monitor_cpu_power_watts{domain="package-0"} 35.2', lines)
+        self.assertIn('system_monitor_gpu_temp_c{gpu="0",vendor="nvidia"} 61', lines)
+        self.assertIn('system_monitor_gpu_temp_c{card="card1",vendor="amd"} 55.0', lines)
+        self.assertIn('system_monitor_net_rx_bytes_per_s{interface="eth0"} 1024.0', lines)
+        self.assertIn('system_monitor_disk_read_iops{device="nvme0n1"} 3.0', lines)
+        self.assertIn('system_monitor_disk_free_gb{mount="mnt_data"} 100', lines)
+        # total_increasing metrics are counters
+        self.assertIn('# TYPE system_monitor_uptime_seconds counter', lines)
+        self.assertIn('system_monitor_uptime_seconds_total 3600', lines)
+        # A metric that merely ends in _mean is not an aggregate
+        self.assertIn('system_monitor_sampler_jitter_ms_mean 0.4', lines)
+        # Each family is declared once with all its samples after it
+        self.assertEqual(text.count('# TYPE system_monitor_gpu_temp_c '), 1)
+        type_line = lines.index('# TYPE system_monitor_gpu_temp_c gauge')
+        self.assertTrue(lines[type_line + 1].startswith('system_monitor_gpu_temp_c{'))
+        self.assertTrue(lines[type_line + 2].startswith('system_monitor_gpu_temp_c{'))
+
+    def test_sampler_aggregates_parse(self):
+        exporter = self.make_exporter(Diagnostics())
+        text = exporter.render({
+            'net_bytes_sent_mb': 100,
+            'net_bytes_sent_mb_min': 90,
+            'net_bytes_sent_mb_max': 100,
+            'net_bytes_sent_mb_mean': 95.0,
+            'cpu_usage_percent': 12.5,
+            'cpu_usage_percent_max': 40.0,
+        })
+        lines = text.splitlines()
+        self.assertIn('system_monitor_net_bytes_sent_mb_total 100', lines)
+        self.assertIn('# TYPE system_monitor_net_bytes_sent_mb_aggregate gauge', lines)
+        self.assertIn('system_monitor_net_bytes_sent_mb_aggregate{aggregate="min"} 90', lines)
+        self.assertIn('system_monitor_cpu_usage_percent{aggregate="max"} 40.0', lines)
+        self.assertIn('system_monitor_cpu_usage_percent{aggregate="last"} 12.5', lines)
+        assert_openmetrics(self, text)
+
+    def test_totals_not_mixed_with_labelled_series(self):
+        exporter = self.make_exporter()
+        text = exporter.render({
+            'net_rx_bytes_per_s': 300.0,
+            'net_tx_bytes_per_s': 30.0,
+            'net_eth0_rx_bytes_per_s': 100.0,
+            'net_wlan0_rx_bytes_per_s': 200.0,
+            'net_eth0_tx_bytes_per_s': 30.0,
+            'cpu_temp': 50.0,
+            'cpu_temp_Core 0': 48.0,
+            'cpu_temp_Core 1': 52.0,
+            'cpu_usage_percent': 12.5,
+            'cpu_core_0_usage_percent': 10.0,
+            'disk_root_usage_percent': 40.0,
+            'disk_sda_util_percent': 5.0,
+            'process_count': 200,
+            'process_top_cpu_percent': 12.0,
+            'container_0123456789ab_cpu_percent': 3.0,
+            'gpu_nvidia_0_power_watts': 80.0,
+        })
+        lines = text.splitlines()
+        self.assertIn('system_monitor_net_total_rx_bytes_per_s 300.0', lines)
+        self.assertIn('system_monitor_net_rx_bytes_per_s{interface="eth0"} 100.0', lines)
+        self.assertIn('system_monitor_cpu_temp 50.0', lines)
+        self.assertIn('system_monitor_cpu_sensor_temp{sensor="Core 0"} 48.0', lines)
+        assert_openmetrics(self, text)
+
+    def test_diagnostics_histogram(self):
+        diagnostics = Diagnostics()
+        diagnostics.observe_collector('cpu', 0.003)
+        diagnostics.record_error('gpu', OSError())
+        text = self.make_exporter(diagnostics).render({})
+
+        self.assertIn('# TYPE system_monitor_collector_duration_seconds histogram', text)
+        self.assertIn('system_monitor_collector_duration_seconds_bucket{collector="cpu",le="0.0025"} 0', text)
+        self.assertIn('system_monitor_collector_duration_seconds_bucket{collector="cpu",le="0.005"} 1', text)
+        self.assertIn('system_monitor_collector_duration_seconds_count{collector="cpu"} 1', text)
+        self.assertIn('system_monitor_errors_total{source="gpu",type="OSError"} 1', text)
+
+    def test_scrapes_served_from_cached_body(self):
+        exporter = self.make_exporter()
+        exporter.start()
+        self.addCleanup(exporter.stop)
+        url = f'http://127.0.0.1:{exporter.server.server_address[1]}/metrics'
+
+        exporter.update({'cpu_usage_percent': 12.5})
+        with urllib.request.urlopen(url) as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('application/openmetrics-text'))
+            body = response.read()
+        self.assertIn(b'system_monitor_cpu_usage_percent 12.5', body)
+
+        request = urllib.request.Request(url, headers={'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(request) as response:
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.read()), body)
+        # The compressed variant is built once per update
+        self.assertIs(exporter.body(True), exporter.body(True))
+
+        exporter.update({'cpu_usage_percent': 50.0})
+        with urllib.request.urlopen(url) as response:
+            self.assertIn(b'system_monitor_cpu_usage_percent 50.0', response.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
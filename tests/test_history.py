@@ -0,0 +1,187 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import unittest
+from collections import namedtuple
+from unittest.mock import MagicMock, patch
+
+# Mock dependencies before importing local modules
+sys.modules.setdefault('psutil', MagicMock())
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from history import HistoryStore, RingFile
+from monitor import SystemMonitor
+
+snetio = namedtuple('snetio', 'bytes_sent bytes_recv packets_sent packets_recv errin errout dropin dropout')
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content + '\n')
+
+
+class TestRingFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'cpu_usage_percent.ring')
+
+    def test_rollups_per_resolution(self):
+        ring = RingFile(self.path, levels=((1, 10), (60, 5)))
+        for t, value in [(6000, 10.0), (6000.5, 30.0), (6001, 20.0)]:
+            ring.add(t, value)
+        self.assertEqual(ring.read(1, until=6001), [
+            (6000, 10.0, 30.0, 20.0, 2),
+            (6001, 20.0, 20.0, 20.0, 1),
+        ])
+
+        ring.add(6059, 60.0)
+        ring.add(6060, 5.0)
+        # 6000 and 6001 are older than the 10s ring
+        self.assertEqual(ring.read(1, until=6060), [
+            (6059, 60.0, 60.0, 60.0, 1),
+            (6060, 5.0, 5.0, 5.0, 1),
+        ])
+        self.assertEqual(ring.read(60, until=6060), [
+            (6000, 10.0, 60.0, 30.0, 4),
+            (6060, 5.0, 5.0, 5.0, 1),
+        ])
+        with self.assertRaises(ValueError):
+            ring.read(3600)
+        ring.close()
+
+    def test_ring_wraps_and_survives_reopen(self):
+        ring = RingFile(self.path, levels=((1, 4),))
+        for t in range(100, 110):
+            ring.add(t, float(t))
+        ring.close()
+
+        # Only the last four seconds are left, read back after a restart
+        ring = RingFile(self.path, levels=((1, 4),))
+        self.assertEqual([row[0] for row in ring.read(1, until=109)], [106, 107, 108, 109])
+        ring.close()
+
+        # Other levels: the file is started over
+        ring = RingFile(self.path, levels=((1, 8),))
+        self.assertEqual(ring.read(1, until=109), [])
+        ring.close()
+
+
+class TestHistoryStore(unittest.TestCase):
+    def test_record_and_query(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = HistoryStore(directory, max_metrics=2)
+            store.record(1000, {'cpu_usage_percent': 10.0, 'memory_percent': 50, 'online': True})
+            store.record(1001, {'cpu_usage_percent': 20.0, 'memory_percent': 50, 'load_1m': 0.5})
+            # Over the metric cap, and a bool is not a metric
+            self.assertEqual(store.keys(), ['cpu_usage_percent', 'memory_percent'])
+            self.assertEqual(store.query('cpu_usage_percent', 60, until=1001), [(960, 10.0, 20.0, 15.0, 2)])
+            self.assertEqual(store.query('load_1m', 60, until=1001), [])
+            store.close()
+
+            store.save_state({'time': 1001})
+            self.assertEqual(HistoryStore(directory).load_state(), {'time': 1001})
+
+    def test_cap_prefers_host_metrics(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = HistoryStore(directory, max_metrics=3)
+            stats = {f'cpu_core_{i}_usage_percent': 1.0 for i in range(4)}
+            stats.update({'cpu_usage_percent': 1.0, 'cpu_usage_percent_max': 2.0, 'memory_percent': 50})
+            store.record(1000, stats)
+            # Aggregates aren't rings, the host metrics go first
+            self.assertEqual(store.keys(), ['cpu_core_0_usage_percent', 'cpu_usage_percent', 'memory_percent'])
+
+            # A host metric appearing later takes a per-core ring
+            stats['cpu_power_package-0_watts'] = 30.0
+            with patch('builtins.print') as log:
+                store.record(1001, stats)
+            self.assertEqual(store.keys(), ['cpu_power_package-0_watts', 'cpu_usage_percent', 'memory_percent'])
+            self.assertIn('cpu_core_0_usage_percent', log.call_args[0][0])
+            store.close()
+
+    def test_rings_of_gone_metrics_pruned(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = HistoryStore(directory, max_metrics=2, prune_after=600)
+            interface = 'net_eth1_rx_bytes_per_s'
+            store.record(1000, {'cpu_usage_percent': 1.0, interface: 5.0})
+            store.record(1100, {'cpu_usage_percent': 1.0, 'memory_percent': 50})
+            self.assertEqual(store.keys(), ['cpu_usage_percent', interface])
+
+            # The removed interface's ring is deleted and its slot reused
+            store.record(1700, {'cpu_usage_percent': 1.0, 'memory_percent': 50})
+            store.record(1701, {'cpu_usage_percent': 1.0, 'memory_percent': 50})
+            self.assertEqual(store.keys(), ['cpu_usage_percent', 'memory_percent'])
+            store.close()
+
+
+class TestCounterState(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.proc = os.path.join(self.tmp.name, 'proc')
+        self.sysfs = os.path.join(self.tmp.name, 'sys')
+        write_file(os.path.join(self.proc, 'sys/kernel/random/boot_id'), 'boot-1')
+        write_file(os.path.join(self.proc, 'stat'), 'cpu  100 0 100 800 0 0 0 0 0 0\ncpu0 100 0 100 800 0 0 0 0 0 0')
+        write_file(os.path.join(self.proc, 'diskstats'), '   8       0 sda 100 0 2000 0 50 0 1000 0 0 100 0 0 0 0 0 0 0')
+        write_file(os.path.join(self.proc, 'self/mounts'), '')
+        os.makedirs(os.path.join(self.sysfs, 'block/sda'))
+        write_file(os.path.join(self.sysfs, 'class/powercap/intel-rapl/intel-rapl:0/name'), 'package-0')
+        write_file(os.path.join(self.sysfs, 'class/powercap/intel-rapl/intel-rapl:0/energy_uj'), '1000000')
+
+    def monitor(self):
+        return SystemMonitor(sysfs_root=self.sysfs, proc_root=self.proc,
+                             collector_intervals={'cpu': 0, 'disk_io': 0, 'network': 0})
+
+    @patch('monitor.platform')
+    @patch('monitor.psutil')
+    def test_rates_resume_after_restart(self, mock_psutil, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+        mock_psutil.sensors_temperatures.return_value = {}
+        counters = {'eth0': snetio(1000, 1000, 10, 10, 0, 0, 0, 0)}
+        mock_psutil.net_io_counters.side_effect = lambda pernic=False: counters if pernic else MagicMock()
+
+        first = self.monitor()
+        first.refresh_hardware(1000)
+        first.collectors.run_due(1000)
+        state = json.loads(json.dumps(first.export_state()))
+        self.assertEqual(state['collectors']['cpu'], 1000)
+
+        # Counters moved on while the monitor was down
+        write_file(os.path.join(self.proc, 'stat'), 'cpu  150 0 150 900 0 0 0 0 0 0\ncpu0 150 0 150 900 0 0 0 0 0 0')
+        write_file(os.path.join(self.proc, 'diskstats'), '   8       0 sda 110 0 4000 0 50 0 1000 0 0 100 0 0 0 0 0 0 0')
+        write_file(os.path.join(self.sysfs, 'class/powercap/intel-rapl/intel-rapl:0/energy_uj'), '21000000')
+        counters = {'eth0': snetio(3000, 1000, 20, 10, 0, 0, 0, 0)}
+
+        second = self.monitor()
+        state['time'] = time.time()
+        self.assertTrue(second.import_state(state))
+        second.refresh_hardware(1010)
+        second.collectors.run_due(1010)
+        stats = second.collectors.snapshot()
+        # Rates on the first tick, over the 10s since the snapshot
+        self.assertEqual(stats['cpu_usage_percent'], 50.0)
+        self.assertEqual(stats['cpu_power_package-0_watts'], 2.0)
+        self.assertEqual(stats['net_eth0_tx_bytes_per_s'], 200.0)
+        self.assertEqual(stats['disk_sda_read_bytes_per_s'], 2000 * 512 / 10)
+
+    @patch('monitor.platform')
+    def test_state_from_another_boot_is_ignored(self, mock_platform):
+        mock_platform.system.return_value = 'Linux'
+        mock_platform.machine.return_value = 'x86_64'
+        monitor = self.monitor()
+        state = monitor.export_state()
+        self.assertTrue(monitor.import_state(dict(state)))
+        self.assertFalse(monitor.import_state(dict(state, boot_id='boot-0')))
+        self.assertFalse(monitor.import_state(dict(state, time=state['time'] - 3600)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import sys
+import os
+import time
+import signal
+import threading
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+
+# Mock dependencies before importing local modules
+sys.modules.setdefault('psutil', MagicMock())
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+import main
+from collectors import CollectorScheduler
+
+
+class TestRuntime(unittest.TestCase):
+    def test_hung_collector_does_not_stall_ticks(self):
+        monitor = MagicMock()
+        monitor.collectors = CollectorScheduler()
+        monitor.collectors.register('memory', lambda: {'memory_percent': 50.0})
+        monitor.collectors.register('gpu', lambda: time.sleep(1) or {'gpu_nvidia_0_temp_c': 40})
+
+        client = MagicMock()
+        client.wait_connected.return_value = True
+        client.publish_stats.return_value = {}
+        published = []
+
+        def publish_update(stats):
+            published.append((time.monotonic(), stats))
+            if len(published) == 3:
+                os.kill(os.getpid(), signal.SIGTERM)
+        client.publish_update.side_effect = publish_update
+
+        started = time.monotonic()
+        asyncio.run(main.run(monitor, client, None, interval=0.05, collector_timeout=0.05))
+
+        self.assertEqual(len(published), 3)
+        # The hung GPU collector only delays each tick by the collector timeout
+        self.assertLess(published[-1][0] - started, 0.5)
+        # Its values are missing on the first tick and counted as stale
+        self.assertEqual(published[0][1], {'memory_percent': 50.0, 'collectors_stale': 1})
+        client.disconnect.assert_called_once()
+        monitor.close.assert_called_once()
+
+    def test_stop_while_waiting_for_broker(self):
+        monitor = MagicMock()
+        monitor.collectors = CollectorScheduler()
+        monitor.collectors.register('memory', lambda: {'memory_percent': 50.0})
+
+        client = MagicMock()
+        client.wait_connected.return_value = False
+        threading.Timer(0.2, os.kill, (os.getpid(), signal.SIGTERM)).start()
+
+        started = time.monotonic()
+        asyncio.run(main.run(monitor, client, None, interval=0.05, collector_timeout=0.05, connect_timeout=30))
+
+        # SIGTERM ends the wait instead of the connect timeout
+        self.assertLess(time.monotonic() - started, 2)
+        client.publish_update.assert_not_called()
+        client.disconnect.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+import sys
+import os
+import types
+import unittest
+from unittest.mock import MagicMock
+
+sys.modules.setdefault('psutil', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from nvidia import NvidiaGPUs
+from diagnostics import Diagnostics
+
+
+class NVMLError(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def make_fake_nvml(gpus, field_values=True):
+    """
+    Builds a stand-in for the pynvml module. gpus is a list of dicts with the
+    values each device reports; a value that is an exception is raised.
+    """
+    nvml = types.SimpleNamespace()
+    nvml.NVML_ERROR_NOT_SUPPORTED = 3
+    nvml.NVML_ERROR_GPU_IS_LOST = 15
+    nvml.NVML_FI_DEV_POWER_AVERAGE = 185
+    nvml.calls = []
+
+    def call(name, index):
+        nvml.calls.append((name, index))
+        value = gpus[index][name]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    nvml.nvmlDeviceGetCount = lambda: len(gpus)
+    nvml.nvmlDeviceGetHandleByIndex = lambda i: i
+    nvml.nvmlDeviceGetName = lambda h: call('name', h)
+    nvml.nvmlDeviceGetUUID = lambda h: call('uuid', h)
+    nvml.nvmlDeviceGetMemoryInfo = lambda h: call('memory', h)
+    nvml.nvmlDeviceGetEnforcedPowerLimit = lambda h: call('power_limit', h)
+    nvml.nvmlDeviceGetUtilizationRates = lambda h: call('util', h)
+    nvml.nvmlDeviceGetTemperature = lambda h, sensor: call('temp', h)
+    nvml.nvmlDeviceGetPowerUsage = lambda h: call('power', h)
+    nvml.nvmlShutdown = lambda: None
+
+    if field_values:
+        def get_field_values(h, field_ids):
+            nvml.calls.append(('fields', h))
+            results = []
+            for field_id in field_ids:
+                power = gpus[h].get('power_average')
+                results.append(types.SimpleNamespace(
+                    nvmlReturn=0 if power is not None else nvml.NVML_ERROR_NOT_SUPPORTED,
+                    valueType=1,
+                    value=types.SimpleNamespace(uiVal=power or 0),
+                ))
+            return results
+        nvml.nvmlDeviceGetFieldValues = get_field_values
+    return nvml
+
+
+def gpu(**overrides):
+    values = {
+        'name': b'NVIDIA A100',
+        'uuid': 'GPU-1234',
+        'memory': types.SimpleNamespace(total=40 * 1024**3, used=10 * 1024**3),
+        'power_limit': 400000,
+        'util': types.SimpleNamespace(gpu=75),
+        'temp': 60,
+        'power': 250000,
+        'power_average': 255000,
+    }
+    values.update(overrides)
+    return values
+
+
+class TestNvidiaGPUs(unittest.TestCase):
+    def test_static_attributes_cached_at_init(self):
+        nvml = make_fake_nvml([gpu(), gpu()])
+        gpus = NvidiaGPUs(nvml)
+        nvml.calls.clear()
+
+        data = gpus.sample()
+        gpus.sample()
+
+        self.assertEqual(gpus.devices[0]['name'], 'NVIDIA A100')
+        self.assertEqual(gpus.devices[0]['uuid'], 'GPU-1234')
+        # Name, UUID and power limit are never queried again
+        self.assertFalse([c for c in nvml.calls if c[0] in ('name', 'uuid', 'power_limit')])
+        self.assertEqual(data['gpu_nvidia_1_usage_percent'], 75)
+        self.assertEqual(data['gpu_nvidia_0_memory_percent'], 25.0)
+        self.assertEqual(data['gpu_nvidia_0_memory_total_mb'], 40 * 1024)
+        self.assertEqual(data['gpu_nvidia_0_power_limit_watts'], 400.0)
+
+    def test_power_from_batched_field_values(self):
+        nvml = make_fake_nvml([gpu()])
+        gpus = NvidiaGPUs(nvml)
+        # Supported fields are found by the first sample, not an extra call at init
+        self.assertNotIn(('fields', 0), nvml.calls)
+        nvml.calls.clear()
+        data = gpus.sample()
+        self.assertEqual(data['gpu_nvidia_0_power_watts'], 255.0)
+        self.assertNotIn(('power', 0), nvml.calls)
+        # Field values, utilization, memory and temperature
+        self.assertEqual(len(nvml.calls), 4)
+
+    def test_falls_back_without_field_values(self):
+        nvml = make_fake_nvml([gpu(power_average=None)])
+        gpus = NvidiaGPUs(nvml)
+        self.assertEqual(gpus.sample()['gpu_nvidia_0_power_watts'], 250.0)
+        # An unsupported field is not requested again
+        nvml.calls.clear()
+        self.assertEqual(gpus.sample()['gpu_nvidia_0_power_watts'], 250.0)
+        self.assertNotIn(('fields', 0), nvml.calls)
+
+        nvml = make_fake_nvml([gpu()], field_values=False)
+        data = NvidiaGPUs(nvml).sample()
+        self.assertEqual(data['gpu_nvidia_0_power_watts'], 250.0)
+
+    def test_errors_isolated_per_metric_and_device(self):
+        nvml = make_fake_nvml([
+            gpu(temp=NVMLError(3)),                # Temperature not supported
+            gpu(util=NVMLError(15), memory=NVMLError(15)),  # Fell off the bus
+            gpu(),
+        ])
+        diagnostics = Diagnostics()
+        gpus = NvidiaGPUs(nvml, diagnostics)
+        data = gpus.sample()
+
+        self.assertNotIn('gpu_nvidia_0_temp_c', data)
+        self.assertEqual(data['gpu_nvidia_0_usage_percent'], 75)
+        self.assertNotIn('gpu_nvidia_1_usage_percent', data)
+        self.assertEqual(data['gpu_nvidia_2_temp_c'], 60)
+        self.assertTrue(gpus.devices[1]['lost'])
+        # Total memory at init, then temp of GPU 0 and util and memory of GPU 1
+        self.assertEqual(diagnostics.totals()[1], {('nvidia_init', 'NVMLError'): 1, ('nvidia', 'NVMLError'): 3})
+
+        # The lost GPU is not queried again
+        nvml.calls.clear()
+        gpus.sample()
+        self.assertFalse([c for c in nvml.calls if c[1] == 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
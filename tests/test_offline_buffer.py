@@ -0,0 +1,144 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+import mqtt_client
+from mqtt_client import MQTTClient
+from offline_buffer import OfflineBuffer
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+
+class FakePahoClient:
+    """Stands in for paho's Client: records publishes while 'online'."""
+
+    def __init__(self, *args, **kwargs):
+        self.online = False
+        self.published = []
+        self.on_connect = None
+        self.on_disconnect = None
+
+    def username_pw_set(self, *args): pass
+    def connect_async(self, *args): pass
+    def loop_start(self): pass
+
+    def publish(self, topic, payload, retain=False):
+        info = MagicMock()
+        if self.online:
+            self.published.append((topic, payload))
+            info.rc = MQTT_ERR_SUCCESS
+        else:
+            info.rc = MQTT_ERR_NO_CONN
+        return info
+
+    def go_online(self):
+        self.online = True
+        self.on_connect(self, None, {}, 0)
+
+    def go_offline(self):
+        self.online = False
+        self.on_disconnect(self, None, 1)
+
+
+class TestOfflineBuffer(unittest.TestCase):
+    def test_evicts_oldest_first_within_memory_cap(self):
+        buffer = OfflineBuffer(max_bytes=100)
+        for i in range(50):
+            buffer.append(i, b'x' * 10)
+        self.assertLessEqual(buffer.bytes, 100)
+        self.assertEqual(len(buffer), 10)
+        self.assertEqual(buffer.dropped, 40)
+        self.assertEqual([ts for ts, _ in buffer.pop_batch(3)], [40, 41, 42])
+
+    def test_spills_to_segments_and_survives_restart(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            buffer = OfflineBuffer(max_bytes=50, spill_dir=spill_dir,
+                                   max_spill_bytes=10_000, segment_bytes=100)
+            for i in range(20):
+                buffer.append(i, b'%02d' % i + b'x' * 8)
+            self.assertEqual(buffer.dropped, 0)
+            self.assertEqual(len(buffer), 20)
+
+            # A new process picks up the spilled records, oldest first
+            restarted = OfflineBuffer(max_bytes=50, spill_dir=spill_dir,
+                                      max_spill_bytes=10_000, segment_bytes=100)
+            records = restarted.pop_batch(100)
+            self.assertEqual([ts for ts, _ in records], list(range(15)))
+            self.assertEqual(records[0][1], b'00xxxxxxxx')
+
+    def test_spill_cap_drops_oldest_segments(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            buffer = OfflineBuffer(max_bytes=20, spill_dir=spill_dir,
+                                   max_spill_bytes=200, segment_bytes=50)
+            for i in range(100):
+                buffer.append(i, b'x' * 10)
+            self.assertLessEqual(buffer.spill.bytes, 200 + 50)
+            self.assertGreater(buffer.dropped, 0)
+            self.assertEqual(len(buffer) + buffer.dropped, 100)
+
+
+@patch.object(mqtt_client.mqtt, 'MQTT_ERR_NO_CONN', MQTT_ERR_NO_CONN)
+@patch.object(mqtt_client.mqtt, 'Client', FakePahoClient)
+class TestOfflineReplay(unittest.TestCase):
+    def test_recovers_after_broker_restart(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test Device",
+                            offline_buffer=OfflineBuffer(max_bytes=2000),
+                            replay_batch_size=10, replay_batches=2)
+        paho = client.client
+        paho.go_online()
+        client.publish_update({"cpu_usage_percent": 1.0})
+
+        paho.go_offline()
+        for i in range(100):
+            client.publish_update({"cpu_usage_percent": float(i)})
+        # Memory stays bounded, the oldest samples were dropped
+        self.assertLessEqual(client.offline_buffer.bytes, 2000)
+        stats = client.publish_stats()
+        self.assertGreater(stats['mqtt_offline_dropped'], 0)
+        queued = stats['mqtt_offline_queued']
+        self.assertEqual(queued + stats['mqtt_offline_dropped'], 100)
+
+        paho.go_online()
+        paho.published.clear()
+        client.publish_update({"cpu_usage_percent": 5.0})
+        # Discovery is republished after a reconnect
+        self.assertTrue(any(t.endswith('/config') for t, _ in paho.published))
+
+        # Replay is rate limited to replay_batches batches per call
+        self.assertEqual(client.flush_offline(), 20)
+        history = [json.loads(p) for t, p in paho.published if t.endswith('/history')]
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[0][0]['state']['cpu_usage_percent'], 100.0 - queued)
+        self.assertIn('timestamp', history[0][0])
+
+        while client.flush_offline():
+            pass
+        self.assertEqual(len(client.offline_buffer), 0)
+
+    def test_requeues_batch_when_connection_drops_mid_replay(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test Device",
+                            offline_buffer=OfflineBuffer(), replay_batch_size=5)
+        paho = client.client
+        for i in range(10):
+            client.publish_update({"load_1m": float(i)})
+
+        client.connected.set()  # Callback says connected, broker is gone
+        self.assertEqual(client.flush_offline(), 0)
+        self.assertEqual(len(client.offline_buffer), 10)
+
+        paho.go_online()
+        self.assertEqual(client.flush_offline(), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import sys
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+# Mock dependencies before importing local modules
+sys.modules.setdefault('psutil', MagicMock())
+sys.modules.setdefault('paho', MagicMock())
+sys.modules.setdefault('paho.mqtt', MagicMock())
+sys.modules.setdefault('paho.mqtt.client', MagicMock())
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+import processes
+from processes import TopProcesses
+from mqtt_client import MQTTClient
+
+
+def write_stat(root, pid, name, cpu_ticks=0, rss_pages=0, starttime=100):
+    os.makedirs(os.path.join(root, str(pid)), exist_ok=True)
+    # 52 fields, utime is field 14, stime 15, starttime 22 and rss 24
+    fields = ['S', '1', '1', '1', '0', '-1', '4194304', '0', '0', '0', '0',
+              str(cpu_ticks), '0', '0', '0', '20', '0', '1', '0', str(starttime), '1000', str(rss_pages)]
+    fields += ['0'] * 28
+    with open(os.path.join(root, str(pid), 'stat'), 'w') as f:
+        f.write(f'{pid} ({name}) ' + ' '.join(fields) + '\n')
+
+
+class TestTopProcesses(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = self.tmp.name
+        os.makedirs(os.path.join(self.root, 'self'))
+        write_stat(self.root, 'self', 'python')
+        self.mb = 1024 * 1024 // processes.PAGE_SIZE
+        # A name with spaces and parentheses
+        write_stat(self.root, 1, 'init (main)', cpu_ticks=100, rss_pages=10 * self.mb)
+        write_stat(self.root, 2, 'worker', cpu_ticks=100, rss_pages=500 * self.mb)
+        write_stat(self.root, 3, 'idle', cpu_ticks=100, rss_pages=1 * self.mb)
+
+    def test_top_by_cpu_and_rss(self):
+        top = TopProcesses(self.root, top_n=2)
+        self.assertTrue(top.available())
+        data = top.sample(1.0, now=1000)
+        self.assertEqual(data['process_count'], 3)
+
+        ticks = processes.CLOCK_TICKS
+        write_stat(self.root, 1, 'init (main)', cpu_ticks=100 + ticks // 2, rss_pages=10 * self.mb)
+        write_stat(self.root, 2, 'worker', cpu_ticks=100 + ticks * 2, rss_pages=500 * self.mb)
+        data = top.sample(2.0, now=1002)
+        # Two CPU-seconds in two seconds is one full core
+        self.assertEqual(data['process_top_cpu_percent'], 100.0)
+        self.assertEqual(data['process_top_rss_mb'], 500)
+
+        by_cpu = top.attributes['process_top_cpu_percent']['processes']
+        self.assertEqual([(p['pid'], p['name']) for p in by_cpu], [(2, 'worker'), (1, 'init (main)')])
+        self.assertEqual(by_cpu[1]['cpu_percent'], 25.0)
+        by_rss = top.attributes['process_top_rss_mb']['processes']
+        self.assertEqual([p['pid'] for p in by_rss], [2, 1])
+
+    def test_new_processes_wait_for_rescan(self):
+        top = TopProcesses(self.root, rescan_interval=30)
+        top.sample(1.0, now=1000)
+        write_stat(self.root, 4, 'new')
+        self.assertEqual(top.sample(1.0, now=1010)['process_count'], 3)
+        self.assertEqual(top.sample(1.0, now=1030)['process_count'], 4)
+
+    def test_exited_and_reused_pids(self):
+        top = TopProcesses(self.root, rescan_interval=30)
+        top.sample(1.0, now=1000)
+        top.sample(1.0, now=1030)
+        # Survived a rescan: stat file kept open, up to max_open_files
+        self.assertIsNotNone(top.processes[1].attr)
+
+        # Exited: dropped on the next tick, not at the next rescan
+        os.unlink(os.path.join(self.root, '3', 'stat'))
+        top.processes[3].attr.close()
+        self.assertEqual(top.sample(1.0, now=1031)['process_count'], 2)
+        self.assertNotIn(3, top.processes)
+
+        # Reused PID: a new start time means no CPU rate from the old counters
+        write_stat(self.root, 2, 'other', cpu_ticks=5, starttime=200)
+        top.sample(1.0, now=1032)
+        by_cpu = top.attributes['process_top_cpu_percent']['processes']
+        self.assertIn({'pid': 2, 'name': 'other', 'cpu_percent': 0.0, 'rss_mb': 0}, by_cpu)
+        top.close()
+        self.assertEqual(top.open_files, 0)
+
+    def test_open_file_cap(self):
+        top = TopProcesses(self.root, rescan_interval=0, max_open_files=1)
+        top.sample(1.0, now=1000)
+        top.sample(1.0, now=1001)
+        self.assertEqual(sum(1 for p in top.processes.values() if p.attr is not None), 1)
+        self.assertEqual(top.sample(1.0, now=1002)['process_count'], 3)
+        top.close()
+
+
+class TestAttributePublishing(unittest.TestCase):
+    def test_attributes_topic(self):
+        client = MQTTClient("localhost", 1883, None, None, "Test PC")
+        client.client = MagicMock()
+        client.connected.set()
+        attributes = {'process_top_cpu_percent': {'processes': [{'pid': 1, 'name': 'init'}]}}
+
+        for value in (5.0, 6.0):
+            client.publish_update({'process_top_cpu_percent': value, 'process_count': 10})
+            client.publish_attributes(attributes)
+        calls = {c[0][0]: c for c in client.client.publish.call_args_list}
+
+        config = json.loads(calls['homeassistant/sensor/test_pc/process_top_cpu_percent/config'][0][1])
+        self.assertEqual(config['json_attributes_topic'], 'homeassistant/sensor/test_pc/attributes')
+        self.assertNotIn('json_attributes_topic',
+                         json.loads(calls['homeassistant/sensor/test_pc/process_count/config'][0][1]))
+        attribute_calls = [c for c in client.client.publish.call_args_list
+                           if c[0][0] == 'homeassistant/sensor/test_pc/attributes']
+        # Unchanged attributes aren't published again
+        self.assertEqual(len(attribute_calls), 1)
+        self.assertEqual(json.loads(attribute_calls[0][0][1]), attributes)
+        self.assertTrue(attribute_calls[0][1]['retain'])
+
+
+if __name__ == '__main__':
+    unittest.main()
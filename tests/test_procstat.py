@@ -0,0 +1,69 @@
+import sys
+import os
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from procstat import ProcStat
+
+STAT_HEADER = "cpu  {0}\ncpu0 {1}\ncpu2 {2}\nintr 123456 " + "0 " * 2000 + "\nctxt 42\n"
+
+
+def cpu_line(user=0, nice=0, system=0, idle=0, iowait=0, irq=0, softirq=0, steal=0, guest=0, guest_nice=0):
+    return f"{user} {nice} {system} {idle} {iowait} {irq} {softirq} {steal} {guest} {guest_nice}"
+
+
+class TestProcStat(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'stat')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, total, core0, core2):
+        with open(self.path, 'w') as f:
+            f.write(STAT_HEADER.format(total, core0, core2))
+
+    def test_usage_and_breakdown_from_deltas(self):
+        self.write(cpu_line(idle=200), cpu_line(idle=100), cpu_line(idle=100))
+        stat = ProcStat(self.path)
+        stat.sample()
+
+        # core0: 50 user + 50 idle, core2 (cpu1 offline): 25 iowait + 25 steal + 50 idle
+        self.write(cpu_line(user=50, iowait=25, steal=25, idle=300),
+                   cpu_line(user=50, idle=150),
+                   cpu_line(iowait=25, steal=25, idle=150))
+        data = stat.sample()
+
+        self.assertEqual(data['cpu_core_0_usage_percent'], 50.0)
+        self.assertEqual(data['cpu_core_2_usage_percent'], 25.0)
+        self.assertNotIn('cpu_core_1_usage_percent', data)
+        self.assertEqual(data['cpu_usage_percent'], 37.5)
+        self.assertEqual(data['cpu_user_percent'], 25.0)
+        self.assertEqual(data['cpu_iowait_percent'], 12.5)
+        self.assertEqual(data['cpu_steal_percent'], 12.5)
+        self.assertEqual(data['cpu_system_percent'], 0.0)
+
+    def test_guest_time_not_counted_twice(self):
+        self.write(cpu_line(), cpu_line(), cpu_line())
+        stat = ProcStat(self.path)
+        stat.sample()
+        self.write(cpu_line(user=50, guest=50, idle=50), cpu_line(), cpu_line())
+        self.assertEqual(stat.sample()['cpu_usage_percent'], 50.0)
+
+    def test_grows_buffer_to_fit_cpu_lines(self):
+        self.write(cpu_line(user=1, idle=1), cpu_line(user=1, idle=1), cpu_line(user=1, idle=3))
+        stat = ProcStat(self.path)
+        stat.attr.buffer = bytearray(16)
+        stat.attr._view = memoryview(stat.attr.buffer)
+        labels, jiffies = stat.read()
+        self.assertEqual(labels, (0, 2))
+        self.assertEqual(len(jiffies), 30)
+        # The intr line doesn't need to fit
+        self.assertLess(len(stat.attr.buffer), os.path.getsize(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import sys
+import os
+import time
+import unittest
+from unittest.mock import MagicMock
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+from sampler import RingBuffer, Sampler
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_aggregate(self):
+        ring = RingBuffer(capacity=4)
+        ring.append({'cpu_usage_percent': 10.0, 'cpu_power_package-0_watts': 5.0})
+        ring.append({'cpu_usage_percent': 90.0})
+        ring.append({'cpu_usage_percent': 20.0, 'cpu_power_package-0_watts': 7.0})
+
+        agg = ring.aggregate()
+        self.assertEqual(agg['cpu_usage_percent'], (10.0, 90.0, 40.0, 20.0))
+        # Missing samples are ignored rather than counted as zero
+        self.assertEqual(agg['cpu_power_package-0_watts'], (5.0, 7.0, 6.0, 7.0))
+
+    def test_overwrites_oldest_when_full(self):
+        ring = RingBuffer(capacity=3)
+        for v in [1, 2, 3, 4, 5]:
+            ring.append({'load_1m': v})
+        self.assertEqual(ring.aggregate()['load_1m'], (3, 5, 4.0, 5))
+
+    def test_grows_columns_without_losing_data(self):
+        ring = RingBuffer(capacity=2, width=2)
+        ring.append({'a': 1.0, 'b': 2.0})
+        ring.append({'a': 3.0, 'b': 4.0, 'c': 5.0, 'd': 6.0})
+        agg = ring.aggregate()
+        self.assertEqual(agg['a'], (1.0, 3.0, 2.0, 3.0))
+        self.assertEqual(agg['d'], (6.0, 6.0, 6.0, 6.0))
+        self.assertEqual(ring.width, 4)
+
+    def test_container_churn_keeps_columns_bounded(self):
+        ring = RingBuffer(capacity=4, width=8)
+        for generation in range(200):
+            container = f'container_{generation:012x}'
+            for _ in range(4):
+                ring.append({'load_1m': 1.0, f'{container}_cpu_percent': 2.0, f'{container}_memory_mb': 3.0})
+            agg = ring.aggregate()
+            self.assertEqual(agg[f'{container}_memory_mb'], (3.0, 3.0, 3.0, 3.0))
+            ring.clear(agg)
+        # Only the last window's metrics keep their columns
+        self.assertEqual(len(ring.columns), 3)
+        self.assertEqual(ring.width, 8)
+        self.assertEqual(len(ring.data), 4 * 8)
+
+        # A burst of metrics grows the array, it shrinks once they're gone
+        ring.append({f'container_{i:012x}_cpu_percent': 1.0 for i in range(40)})
+        self.assertEqual(ring.width, 64)
+        ring.clear({'load_1m'})
+        self.assertEqual(ring.width, 8)
+
+        ring.append({'load_1m': 2.0})
+        self.assertEqual(ring.aggregate(), {'load_1m': (2.0, 2.0, 2.0, 2.0)})
+
+
+class TestSampler(unittest.TestCase):
+    def test_collect_reports_aggregates_and_timing(self):
+        monitor = MagicMock()
+        values = iter(range(1000))
+        monitor.get_stats.side_effect = lambda: {'cpu_usage_percent': float(next(values))}
+
+        sampler = Sampler(monitor, interval=0.01, capacity=1000)
+        sampler.start()
+        time.sleep(0.1)
+        sampler.stop()
+        data = sampler.collect()
+
+        self.assertGreater(data['sampler_samples'], 2)
+        self.assertEqual(data['cpu_usage_percent_min'], 0.0)
+        self.assertEqual(data['cpu_usage_percent'], data['cpu_usage_percent_max'])
+        self.assertIn('sampler_jitter_ms_max', data)
+        self.assertIn('sampler_tick_ms_mean', data)
+
+        # The window starts over after each collect
+        self.assertEqual(sampler.collect()['sampler_samples'], 0)
+
+    def test_aggregate_prefixes(self):
+        monitor = MagicMock()
+        sampler = Sampler(monitor, interval=1, capacity=4, aggregate_prefixes=['cpu_'])
+        sampler.ring.append({'cpu_usage_percent': 1.0, 'memory_percent': 2.0})
+        data = sampler.collect()
+        self.assertIn('cpu_usage_percent_max', data)
+        self.assertNotIn('memory_percent_max', data)
+        self.assertEqual(data['memory_percent'], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
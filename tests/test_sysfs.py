@@ -0,0 +1,78 @@
+import sys
+import os
+import errno
+import tempfile
+import unittest
+from unittest.mock import patch
+
+sys.path.append(os.path.join(os.getcwd(), 'system_monitor'))
+
+import sysfs
+from sysfs import SysfsAttribute, SysfsReader
+
+
+def write_file(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class TestSysfsReader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'energy_uj')
+        write_file(self.path, '1000\n')
+        self.reader = SysfsReader()
+
+    def tearDown(self):
+        self.reader.close()
+        self.tmp.cleanup()
+
+    def test_keeps_fd_open_between_reads(self):
+        self.assertEqual(self.reader.read_int(self.path), 1000)
+        fd = self.reader.get(self.path).fd
+
+        write_file(self.path, '2000\n')
+        with patch('sysfs.os.open', wraps=os.open) as mock_open:
+            self.assertEqual(self.reader.read_int(self.path), 2000)
+            mock_open.assert_not_called()
+        self.assertEqual(self.reader.get(self.path).fd, fd)
+
+    def test_reopens_on_enodev(self):
+        self.reader.read_int(self.path)
+
+        # Simulate the device being unplugged and replaced: the old fd fails
+        # with ENODEV and the new file at the same path has a new value.
+        os.unlink(self.path)
+        write_file(self.path, '42\n')
+        real_pread = sysfs.os.preadv if sysfs._HAVE_PREADV else sysfs.os.pread
+        calls = []
+
+        def failing_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError(errno.ENODEV, 'No such device')
+            return real_pread(*args)
+
+        name = 'preadv' if sysfs._HAVE_PREADV else 'pread'
+        with patch(f'sysfs.os.{name}', side_effect=failing_once):
+            self.assertEqual(self.reader.read_int(self.path), 42)
+        self.assertEqual(len(calls), 2)
+
+    def test_missing_device_raises_and_drops_fd(self):
+        self.reader.read_int(self.path)
+        os.unlink(self.path)
+        attr = self.reader.get(self.path)
+        attr.close()
+        with self.assertRaises(OSError):
+            self.reader.read_int(self.path)
+        self.assertNotIn(self.path, self.reader.attributes)
+
+    def test_buffer_grows_for_large_files(self):
+        attr = SysfsAttribute(self.path, size=4)
+        write_file(self.path, 'x' * 100)
+        self.assertEqual(attr.read_text(), 'x' * 100)
+        attr.close()
+
+
+if __name__ == '__main__':
+    unittest.main()